@@ -0,0 +1,90 @@
+"""Add table for mailbox state
+
+Revision ID: 3c5e2a9d7f41
+Revises: 8ffff45dc8a3
+Create Date: 2026-10-18 10:12:37.418206
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3c5e2a9d7f41"
+down_revision: Union[str, None] = "8ffff45dc8a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade(engine_name: str) -> None:
+    globals()["upgrade_%s" % engine_name]()
+
+
+def downgrade(engine_name: str) -> None:
+    globals()["downgrade_%s" % engine_name]()
+
+
+def upgrade_api() -> None:
+    op.add_column("domains", sa.Column("state_checked_at", sa.DateTime(), nullable=True))
+    op.add_column("domains", sa.Column("mailboxes_changed_at", sa.DateTime(), nullable=True))
+    # ascii_bin, as everywhere: the joins with OX and dovecot expect the rows in
+    # the order of python, and the case of the addresses matters
+    op.create_table(
+        "mailbox_state",
+        sa.Column(
+            "email", sa.String(length=255, collation="ascii_bin"), nullable=False
+        ),
+        sa.Column(
+            "username", sa.String(length=128, collation="ascii_bin"), nullable=False
+        ),
+        sa.Column(
+            "domain", sa.String(length=128, collation="ascii_bin"), nullable=False
+        ),
+        sa.Column("ox_uid", sa.Integer(), nullable=True),
+        sa.Column("in_dovecot", sa.Boolean(), nullable=False),
+        sa.Column("active", sa.Boolean(), nullable=True),
+        sa.Column(
+            "status", sa.String(length=16, collation="ascii_bin"), nullable=False
+        ),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("email"),
+    )
+    op.create_index(
+        "ix_mailbox_state_domain_username",
+        "mailbox_state",
+        ["domain", "username"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_mailbox_state_domain_status",
+        "mailbox_state",
+        ["domain", "status", "username"],
+        unique=False,
+    )
+
+
+def downgrade_api() -> None:
+    op.drop_index("ix_mailbox_state_domain_status", table_name="mailbox_state")
+    op.drop_index("ix_mailbox_state_domain_username", table_name="mailbox_state")
+    op.drop_table("mailbox_state")
+    op.drop_column("domains", "mailboxes_changed_at")
+    op.drop_column("domains", "state_checked_at")
+
+
+def upgrade_dovecot() -> None:
+    pass
+
+
+def downgrade_dovecot() -> None:
+    pass
+
+
+def upgrade_postfix() -> None:
+    pass
+
+
+def downgrade_postfix() -> None:
+    pass
@@ -1,5 +1,6 @@
+from . import creds_cache
 from .basic_admin import DependsBasicAdmin
 from .basic_user import DependsBasicUser
-from .token_user import DependsTokenUser
+from .token_user import DependsTokenUser, configure_tokens
 
-__all__ = [DependsBasicAdmin, DependsBasicUser, DependsTokenUser]
+__all__ = [creds_cache, DependsBasicAdmin, DependsBasicUser, DependsTokenUser, configure_tokens]
@@ -5,19 +5,19 @@ import fastapi
 
 from .. import sql_api
 from . import err
-from .basic_user import BasicUser
+from .basic_user import BasicUser, DependsApiDb
 
 
 class BasicAdmin(BasicUser):
     def __init__(self):
         super(BasicAdmin, self).__init__()
 
-    async def __call__(self, request: fastapi.Request):
+    async def __call__(self, request: fastapi.Request, db: DependsApiDb):
         log = logging.getLogger(__name__)
         log.debug("Trying to auth an ADMIN with basic http")
         user: sql_api.DBUser
         try:
-            user = await super(BasicAdmin, self).__call__(request).__anext__()
+            user = await super(BasicAdmin, self).__call__(request, db)
         except Exception as e:
             log.info(f"Failed super with exception {e}, so failed auth.")
             raise e
@@ -27,6 +27,6 @@ class BasicAdmin(BasicUser):
         if not user.is_admin:
             log.info("This user is not an admin. Failed auth.")
             raise err.PermissionDenied()
-        yield user
+        return user
 
 DependsBasicAdmin = typing.Annotated[sql_api.DBUser, fastapi.Depends(BasicAdmin())]
@@ -3,31 +3,41 @@ import typing
 
 import fastapi
 import fastapi.security
-import sqlalchemy.orm as orm
+import sqlalchemy.ext.asyncio as sa_async
 
 from .. import sql_api
-from . import err
+from . import creds_cache, err
 
+# The session of the request, shared with the route
+DependsApiDb = typing.Annotated[sa_async.AsyncSession, fastapi.Depends(sql_api.get_db)]
 
-def authenticate_user(db: orm.Session, user_name: str, password: str) -> sql_api.DBUser:
+
+async def authenticate_user(
+    db: sa_async.AsyncSession, user_name: str, password: str
+) -> sql_api.DBUser:
     """Fetch a user from the API db, checks their password, if everything
     is fine, returns the user. Will raise a PermissionDenied exception
     if something is wrong.
-    May forge an admin user if the API db is empty."""
+    May forge an admin user if the API db is empty.
+    When the credentials cache is enabled, credentials checked recently are
+    not checked again with argon2 (but the user is still read from the db)."""
     log = logging.getLogger(__name__)
-    db_user = sql_api.get_user(db, user_name)
+    db_user = await sql_api.aget_user(db, user_name)
     if db_user is None:
         log.info(f"No user found in database for username {user_name}")
-        nb_users = sql_api.count_users(db)
+        nb_users = await sql_api.acount_users(db)
         if nb_users == 0:
             log.info("Database is empty, forging a fake admin user for setup")
             db_user = sql_api.DBUser(name="FAKE", is_admin=True)
             return db_user
         raise err.PermissionDenied()
-    ok = db_user.verify_password(password)
+    if creds_cache.check(user_name, password, db_user.hashed_password):
+        return db_user
+    ok = await db_user.averify_password(password)
     if not ok:
         log.info("Wrong password")
         raise err.PermissionDenied()
+    creds_cache.remember(user_name, password, db_user.hashed_password)
     return db_user
 
 
@@ -35,7 +45,7 @@ class BasicUser(fastapi.security.HTTPBasic):
     def __init__(self):
         super(BasicUser, self).__init__()
 
-    async def __call__(self, request: fastapi.Request):
+    async def __call__(self, request: fastapi.Request, db: DependsApiDb):
         log = logging.getLogger(__name__)
         log.debug("Trying to auth a user with basic http")
         creds: fastapi.security.HTTPBasicCredentials
@@ -53,19 +63,13 @@ class BasicUser(fastapi.security.HTTPBasic):
         #    log.info("No credentials provided, failed auth.")
         #    raise err.PermissionDenied()
 
-        maker = sql_api.get_maker()
-        session = maker()
         try:
-            user = authenticate_user(session, creds.username, creds.password)
+            user = await authenticate_user(db, creds.username, creds.password)
         except Exception as e:
             log.debug("Failed auth")
-            session.close()
             raise e
-        try:
-            log.debug(f"Greetings user {user.name}")
-            yield user
-        finally:
-            session.close()
+        log.debug(f"Greetings user {user.name}")
+        return user
 
 
 DependsBasicUser = typing.Annotated[sql_api.DBUser, fastapi.Depends(BasicUser())]
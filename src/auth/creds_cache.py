@@ -0,0 +1,97 @@
+"""A short lived cache of the basic auth credentials we already checked, to
+avoid running argon2 on every request of the provisioning scripts. It is
+disabled unless a ttl is configured.
+
+The cache never holds the passwords: the entries are keyed on an HMAC of the
+user name and the password, with a key drawn when the process starts. An
+entry also remembers the hash of the password it was checked against, so it
+is ignored as soon as the password is changed, even by another process. The
+routes which change or remove a user forget its entries, too."""
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class CredsCache:
+    def __init__(self):
+        self.key = secrets.token_bytes(32)
+        self.ttl = 0
+        self.max_entries = 0
+        # digest -> (user name, hashed password, expiration)
+        self.entries: dict[bytes, tuple[str, str, float]] = {}
+        self.lock = threading.Lock()
+
+    def configure(self, ttl: int = 0, max_entries: int = 10000) -> None:
+        """`ttl` (in seconds) is how long we trust checked credentials, 0
+        disables the cache."""
+        with self.lock:
+            self.ttl = ttl
+            self.max_entries = max_entries
+            self.entries = {}
+
+    def digest(self, user_name: str, password: str) -> bytes:
+        # The length of the name is part of the message: ("ab", "c") and
+        # ("a", "bc") must not share an entry.
+        msg = f"{len(user_name)}:{user_name}:{password}".encode()
+        return hmac.new(self.key, msg, hashlib.sha256).digest()
+
+    def check(self, user_name: str, password: str, hashed_password: str) -> bool:
+        """True if these credentials were checked against this very hash,
+        not too long ago."""
+        if self.ttl <= 0:
+            return False
+        digest = self.digest(user_name, password)
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return False
+            (name, hashed, expires) = entry
+            if name != user_name or hashed != hashed_password or expires < time.monotonic():
+                del self.entries[digest]
+                return False
+        return True
+
+    def remember(self, user_name: str, password: str, hashed_password: str) -> None:
+        if self.ttl <= 0:
+            return
+        digest = self.digest(user_name, password)
+        now = time.monotonic()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                self.entries = {
+                    key: entry for key, entry in self.entries.items() if entry[2] >= now
+                }
+            if len(self.entries) >= self.max_entries:
+                log.warning("The credentials cache is full")
+                return
+            self.entries[digest] = (user_name, hashed_password, now + self.ttl)
+
+    def forget(self, user_name: str) -> None:
+        with self.lock:
+            self.entries = {
+                key: entry for key, entry in self.entries.items() if entry[0] != user_name
+            }
+
+
+cache = CredsCache()
+
+
+def configure(**kwargs) -> None:
+    cache.configure(**kwargs)
+
+
+def check(user_name: str, password: str, hashed_password: str) -> bool:
+    return cache.check(user_name, password, hashed_password)
+
+
+def remember(user_name: str, password: str, hashed_password: str) -> None:
+    cache.remember(user_name, password, hashed_password)
+
+
+def forget(user_name: str) -> None:
+    cache.forget(user_name)
@@ -1,24 +1,79 @@
+import collections
 import datetime
+import hashlib
 import logging
+import threading
 import typing
 
 import fastapi
 import fastapi.security
 import jwt
+import pydantic
 
 from .. import config, sql_api
 from . import err
+from .basic_user import DependsApiDb
+
+
+class ClaimsUser(pydantic.BaseModel):
+    """A user known from the claims of its token only, without reading the
+    API database. Has what the routes need from a sql_api.DBUser."""
+
+    name: str
+    creds: sql_api.Creds
+
+    def get_creds(self) -> sql_api.Creds:
+        return self.creds
 
 
 class TokenUser(fastapi.security.HTTPBearer):
     """Dependency for fastapi. Checks the authorization header is correct, controls
     the JWT provided by the user, controls the signature, decode it, fetch from the
-    API database the credentials for this user, and yields an sql_api.Creds object."""
+    API database the credentials for this user, and yields an sql_api.Creds object.
+    When the token carries the permissions of the user, and they are still
+    current, we trust them and yield a ClaimsUser instead.
+
+    The tokens already decoded are kept (up to `cache_size` of them), so that
+    the signature of a token is checked only once. Their expiration is still
+    checked on each request."""
 
     def __init__(self):
         super(TokenUser, self).__init__(auto_error=True)
+        self.secret: str | None = None
+        self.algo = "HS256"
+        self.cache_size = 0
+        # sha256 of the raw token -> decoded token, least recently used first
+        self.cache: collections.OrderedDict[bytes, dict] = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def configure(self, secret: str, cache_size: int = 0) -> None:
+        """Freezes the secret used to check the tokens, and sets how many
+        decoded tokens we keep (0: every token is decoded again)."""
+        with self.lock:
+            self.secret = secret
+            self.cache_size = cache_size
+            self.cache.clear()
+
+    def get_cached(self, digest: bytes) -> dict | None:
+        with self.lock:
+            token = self.cache.get(digest)
+            if token is not None:
+                self.cache.move_to_end(digest)
+            return token
+
+    def set_cached(self, digest: bytes, token: dict) -> None:
+        if self.cache_size <= 0:
+            return
+        with self.lock:
+            self.cache[digest] = token
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
 
-    async def __call__(self, request: fastapi.Request):
+    def forget_cached(self, digest: bytes) -> None:
+        with self.lock:
+            self.cache.pop(digest, None)
+
+    async def __call__(self, request: fastapi.Request, db: DependsApiDb):
         log = logging.getLogger(__name__)
         log.debug("Trying to auth a user with a token")
         credentials: fastapi.security.HTTPAuthorizationCredentials
@@ -36,33 +91,57 @@ class TokenUser(fastapi.security.HTTPBearer):
         token = self.verify_jwt(log, credentials.credentials)
         username = token["sub"]
         log.info(f"Greetings user {username}")
-        maker = sql_api.get_maker()
-        session = maker()
+        if self.current_claims(token):
+            log.info("Using the permissions in the token")
+            return ClaimsUser(
+                name=username,
+                creds=sql_api.Creds(is_admin=token["adm"], domains=token["dom"]),
+            )
         try:
             log.info("Getting the user in db")
-            user = sql_api.get_user(session, username)
+            user = await sql_api.aget_user(db, username)
         except Exception as e:
             log.error(f"Failed to get user: {e}")
-            session.close()
             raise e
         if not user:
             log.info("User not found in database")
-            session.close()
             raise err.PermissionDenied()
         log.info(f"Got the user in db: {user}")
-        # We need to keep the orm session running, so that the user object is
-        # usable (it needs its orm session for some operations)
-        try:
-            yield user
-        finally:
-            session.close()
+        # The user object stays usable (it needs its orm session for some
+        # operations): the session of the request is closed after the route.
+        return user
+
+    def current_claims(self, token: dict) -> bool:
+        """True if the token carries the permissions of its user, and they did
+        not change since it was made."""
+        if "pv" not in token:
+            return False
+        return token["pv"] == sql_api.get_perm_version(token["sub"])
 
     def verify_jwt(self, log, jwtoken: str) -> dict:
-        secret = config.settings["JWT_SECRET"]
-        algo = "HS256"
+        if self.secret is None:
+            self.configure(config.settings["JWT_SECRET"])
+        digest = hashlib.sha256(jwtoken.encode()).digest()
+        token = self.get_cached(digest)
+        if token is None:
+            token = self.decode_jwt(log, jwtoken)
+            self.set_cached(digest, token)
+
+        # TODO cette vérification est redondante
+        # le jwt.decode le vérifie déjà (mais pas pour les tokens du cache)
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+        exp = token["exp"]
+        if exp < now:
+            log.info(f"Token is expired now={now}, exp={exp}")
+            self.forget_cached(digest)
+            raise err.PermissionDenied()
+        log.info("Token is valid")
+        return token
+
+    def decode_jwt(self, log, jwtoken: str) -> dict:
         log.info("Trying to decode the token...")
         try:
-            token = jwt.decode(jwtoken, secret, algo)
+            token = jwt.decode(jwtoken, self.secret, self.algo)
         except jwt.ExpiredSignatureError:
             log.info("Token has expired")
             raise err.PermissionDenied()
@@ -74,15 +153,14 @@ class TokenUser(fastapi.security.HTTPBearer):
             raise e
 
         log.info(f"Decoded token as {token}")
-        # TODO cette vérification est redondante
-        # le jwt.decode le vérifie déjà
-        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
-        exp = token["exp"]
-        if exp < now:
-            log.info(f"Token is expired now={now}, exp={exp}")
-            raise err.PermissionDenied()
-        log.info("Token is valid")
         return token
 
 
-DependsTokenUser = typing.Annotated[sql_api.DBUser, fastapi.Depends(TokenUser())]
+token_user = TokenUser()
+
+
+def configure_tokens(secret: str, cache_size: int = 0) -> None:
+    token_user.configure(secret, cache_size)
+
+
+DependsTokenUser = typing.Annotated[sql_api.DBUser | ClaimsUser, fastapi.Depends(token_user)]
@@ -0,0 +1,87 @@
+"""Throughput of the requests which only need the database, on one worker, at
+several concurrencies. Each statement is slowed down by `--latency` seconds in
+the driver (like a remote MySQL server would be), on a sqlite database in /tmp:
+
+    python -m src.bench.db_concurrency --latency 0.005 --count 200
+
+The `sync` run reads the domains with the sync orm sessions from coroutines
+(as the routes did before the async sessions), the `async` run with the async
+sessions, as the routes do now.
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import sqlalchemy as sa
+
+from .. import sql_api
+
+
+def slow_statements(engine: sa.Engine, latency: float) -> None:
+    # The trace callback of sqlite runs in the thread of the driver: for the
+    # async engine, it is the thread of aiosqlite, not the event loop.
+    def slow(statement):
+        time.sleep(latency)
+
+    @sa.event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, "run_async"):
+            dbapi_connection.run_async(lambda conn: conn.set_trace_callback(slow))
+        else:
+            dbapi_connection.set_trace_callback(slow)
+
+
+async def sync_request() -> None:
+    maker = sql_api.get_maker()
+    with maker() as db:
+        sql_api.get_domains(db)
+
+
+async def async_request() -> None:
+    maker = sql_api.get_amaker()
+    async with maker() as db:
+        await sql_api.aget_domains(db)
+
+
+async def measure(request, concurrency: int, count: int) -> float:
+    # `count` requests, `concurrency` of them in flight at any time
+    todo = iter(range(count))
+
+    async def worker():
+        for _ in todo:
+            await request()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return count / (time.perf_counter() - start)
+
+
+async def run(name: str, request, count: int) -> None:
+    for concurrency in [1, 4, 16, 64]:
+        rate = await measure(request, concurrency, count)
+        print(f"{name:>6}: concurrency {concurrency:3}: {rate:8.1f} requests/s")
+    # The connections of the async engine belong to this event loop
+    await sql_api.get_amaker().kw["bind"].dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--latency", type=float, default=0.005, help="duration of a statement")
+    parser.add_argument("--count", type=int, default=200, help="requests per measure")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{tmp}/api.db"
+        pool = {"size": 64, "max_overflow": 0}
+        engine = sql_api.init_db(url, pool)
+        slow_statements(engine, args.latency)
+        slow_statements(sql_api.get_amaker().kw["bind"].sync_engine, args.latency)
+        sql_api.database.Api.metadata.create_all(engine)
+
+        for name, request in [("sync", sync_request), ("async", async_request)]:
+            asyncio.run(run(name, request, args.count))
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,113 @@
+"""A fake OX cluster, for the benchmarks: it is run instead of ssh, with the
+remote command as argument, and understands the few OX commands the API uses.
+Its state (contexts and users) is kept in a json file in a directory.
+
+    python src/bench/fake_ox.py <state dir> <latency> <remote command>
+
+`latency` (in seconds) is slept once per call, to mimic the ssh round trip and
+the start of the OX java tools.
+"""
+import csv
+import json
+import os
+import shlex
+import sys
+import time
+
+MARK = "@@dimail@@"
+USER_FIELDS = ["Id", "Name", "PrimaryEmail", "Given_name", "Sur_name", "Display_name"]
+
+
+def load(state: str) -> dict:
+    path = os.path.join(state, "state.json")
+    if not os.path.exists(path):
+        return {"contexts": [], "users": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(state: str, data: dict) -> None:
+    # We may be killed at any time (oxcli kills the listings it stops reading)
+    path = os.path.join(state, "state.json")
+    with open(f"{path}.{os.getpid()}", "w") as f:
+        json.dump(data, f)
+    os.replace(f"{path}.{os.getpid()}", path)
+
+
+def arg(args: list[str], option: str) -> str:
+    return args[args.index(option) + 1]
+
+
+def run(data: dict, args: list[str]) -> int:
+    command = os.path.basename(args[0])
+    out = csv.writer(sys.stdout, lineterminator="\n")
+    if command == "listcontext":
+        out.writerow(["id", "name", "lmappings"])
+        for ctx in data["contexts"]:
+            mappings = ",".join([ctx["id"], ctx["name"]] + ctx["domains"])
+            out.writerow([ctx["id"], ctx["name"], mappings])
+        return 0
+    if command == "createcontext":
+        data["contexts"].append(
+            {
+                "id": arg(args, "--contextid"),
+                "name": arg(args, "--contextname"),
+                "domains": [arg(args, "--addmapping")],
+            }
+        )
+        return 0
+    if command == "changecontext":
+        for ctx in data["contexts"]:
+            if ctx["id"] == arg(args, "--contextid"):
+                ctx["domains"].append(arg(args, "--addmapping"))
+        return 0
+    if command == "listuser":
+        users = data["users"].get(arg(args, "-c"), [])
+        out.writerow(USER_FIELDS)
+        for user in users:
+            if "-s" in args and user["Name"] != arg(args, "-s"):
+                continue
+            out.writerow([user[key] for key in USER_FIELDS])
+        return 0
+    if command == "createuser":
+        ctx_users = data["users"].setdefault(arg(args, "-c"), [])
+        ctx_users.append(
+            {
+                "Id": str(len(ctx_users) + 2),
+                "Name": arg(args, "--username"),
+                "PrimaryEmail": arg(args, "--email"),
+                "Given_name": arg(args, "--givenname"),
+                "Sur_name": arg(args, "--surname"),
+                "Display_name": arg(args, "--displayname"),
+            }
+        )
+        return 0
+    print(f"Unknown command {command}", file=sys.stderr)
+    return 1
+
+
+def run_script(data: dict, script: str) -> int:
+    # Only the scripts made by oxcli for the batches: one command per line,
+    # followed by the marker with its index.
+    for line in script.splitlines():
+        (command, marker) = line.split(" </dev/null 2>&1; ")
+        index = marker.split()[2]
+        status = run(data, shlex.split(command))
+        print(f"{MARK} {index} {status}")
+    return 0
+
+
+def main():
+    (state, latency, remote) = sys.argv[1:]
+    time.sleep(float(latency))
+    data = load(state)
+    if remote == "sh -s":
+        status = run_script(data, sys.stdin.read())
+    else:
+        status = run(data, shlex.split(remote))
+    save(state, data)
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
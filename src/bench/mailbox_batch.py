@@ -0,0 +1,120 @@
+"""Throughput of mailbox provisioning, one `POST /mailboxes/{user}` per
+mailbox against one `POST /mailboxes:batch` for all of them. Runs the app in
+FAKE mode (sqlite in /tmp), with a fake OX cluster (bench/fake_ox.py) which
+sleeps `--latency` seconds per ssh call:
+
+    python -m src.bench.mailbox_batch --sizes 1000,10000 --latency 0.3
+
+The one by one requests are slow: they are measured on `--single` mailboxes
+only, and the throughput is extrapolated.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DIMAIL_MODE", "FAKE")
+os.environ.setdefault("DIMAIL_JWT_SECRET", "bench secret")
+
+import httpx  # noqa: E402
+
+from .. import main, oxcli  # noqa: E402
+from . import fake_ox  # noqa: E402
+
+ADMIN = ("bench", "bench")
+
+
+def declare_fake_cluster(latency: float) -> None:
+    state = tempfile.mkdtemp(prefix="dimail-bench-")
+    oxcli.begin_test_clusters()
+    oxcli.declare_cluster("bench", "ssh://bench", [])
+    oxcli.set_default_cluster("bench")
+    oxcli.OxCluster("bench")._transport.command = lambda remote: [
+        sys.executable,
+        fake_ox.__file__,
+        state,
+        f"{latency}",
+        remote,
+    ]
+
+
+def item(prefix: str, i: int) -> dict:
+    return {
+        "user_name": f"{prefix}{i}",
+        "givenName": "Bench",
+        "surName": f"User {i}",
+        "displayName": f"Bench User {i}",
+    }
+
+
+async def setup(client: httpx.AsyncClient, domain: str) -> dict:
+    res = await client.post(
+        "/users/", json={"name": ADMIN[0], "password": ADMIN[1], "is_admin": True}, auth=ADMIN
+    )
+    res.raise_for_status()
+    res = await client.post(
+        "/domains/",
+        json={"name": domain, "features": ["mailbox", "webmail"], "context_name": "bench"},
+        auth=ADMIN,
+    )
+    res.raise_for_status()
+    res = await client.get("/token/", auth=ADMIN)
+    res.raise_for_status()
+    return {"Authorization": f"Bearer {res.json()['access_token']}"}
+
+
+async def bench(sizes: list[int], single: int) -> None:
+    domain = "bench.fr"
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        headers = await setup(client, domain)
+
+        start = time.perf_counter()
+        for i in range(single):
+            mailbox = item("single", i)
+            res = await client.post(
+                f"/domains/{domain}/mailboxes/{mailbox.pop('user_name')}",
+                json=mailbox,
+                headers=headers,
+            )
+            res.raise_for_status()
+        rate = single / (time.perf_counter() - start)
+        print(f"one by one: {rate:8.1f} mailboxes/s (measured on {single} mailboxes)")
+
+        for size in sizes:
+            start = time.perf_counter()
+            res = await client.post(
+                f"/domains/{domain}/mailboxes:batch",
+                json=[item(f"batch{size}-", i) for i in range(size)],
+                headers=headers,
+            )
+            res.raise_for_status()
+            elapsed = time.perf_counter() - start
+            created = sum(1 for got in res.json() if got["status"] == "created")
+            print(
+                f"batch of {size:>6}: {created / elapsed:8.1f} mailboxes/s "
+                f"({created} created in {elapsed:.1f} s)"
+            )
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="1000,10000", help="sizes of the batches")
+    parser.add_argument("--single", type=int, default=20, help="mailboxes created one by one")
+    parser.add_argument("--latency", type=float, default=0.3, help="duration of an ssh call")
+    args = parser.parse_args()
+
+    declare_fake_cluster(args.latency)
+    try:
+        sizes = [int(size) for size in args.sizes.split(",")]
+        asyncio.run(bench(sizes, args.single))
+    finally:
+        oxcli.end_test_clusters()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,130 @@
+"""Latency of `GET /domains/{domain}/mailboxes/{user}`, when OX and the dovecot
+database are slow, with the lookups made one after the other (`sequential`,
+as before) and at the same time (`concurrent`, utils.fanout). Runs the app in
+FAKE mode (sqlite in /tmp, fake OX cluster), each OX lookup takes `--ox`
+seconds more, and each dovecot statement `--imap` seconds more:
+
+    python -m src.bench.mailbox_fanout --ox 0.02 --imap 0.01 --count 200
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("DIMAIL_MODE", "FAKE")
+os.environ.setdefault("DIMAIL_JWT_SECRET", "bench secret")
+
+import httpx  # noqa: E402
+import sqlalchemy as sa  # noqa: E402
+
+from .. import oxcli, sql_api, sql_dovecot, sql_postfix, utils  # noqa: E402
+
+ADMIN = ("bench", "bench")
+DOMAIN = "bench.fr"
+
+
+def slow_ox(delay: float) -> None:
+    def slow(lookup):
+        async def slow_lookup(*args, **kwargs):
+            await asyncio.sleep(delay)
+            return await lookup(*args, **kwargs)
+
+        return slow_lookup
+
+    oxcli.OxCluster.aget_context_by_domain = slow(oxcli.OxCluster.aget_context_by_domain)
+    oxcli.OxContext.aget_user_by_email = slow(oxcli.OxContext.aget_user_by_email)
+
+
+def slow_imap(delay: float) -> None:
+    # The trace callback of sqlite runs in the thread of aiosqlite
+    def slow(statement):
+        time.sleep(delay)
+
+    engine = sql_dovecot.get_amaker().kw["bind"].sync_engine
+
+    @sa.event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.run_async(lambda conn: conn.set_trace_callback(slow))
+
+
+async def sequential_gather(**lookups) -> dict:
+    return {source: await utils.fanout.within(source, lookup) for source, lookup in lookups.items()}
+
+
+async def setup(client: httpx.AsyncClient) -> dict:
+    res = await client.post(
+        "/users/", json={"name": ADMIN[0], "password": ADMIN[1], "is_admin": True}, auth=ADMIN
+    )
+    res.raise_for_status()
+    res = await client.post(
+        "/domains/",
+        json={"name": DOMAIN, "features": ["mailbox", "webmail"], "context_name": "bench"},
+        auth=ADMIN,
+    )
+    res.raise_for_status()
+    res = await client.get("/token/", auth=ADMIN)
+    res.raise_for_status()
+    headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+    res = await client.post(
+        f"/domains/{DOMAIN}/mailboxes/bench",
+        json={"givenName": "Bench", "surName": "Bench", "displayName": "Bench"},
+        headers=headers,
+    )
+    res.raise_for_status()
+    return headers
+
+
+async def measure(client: httpx.AsyncClient, headers: dict, count: int) -> list[float]:
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        res = await client.get(f"/domains/{DOMAIN}/mailboxes/bench", headers=headers)
+        res.raise_for_status()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    times = sorted(times)
+    p99 = times[min(len(times) - 1, int(len(times) * 0.99))]
+    print(f"{name:>10}: p50 {statistics.median(times):7.1f} ms, p99 {p99:7.1f} ms")
+
+
+async def bench(ox: float, imap: float, count: int) -> None:
+    # Not at the top: the processes hashing the passwords import this module,
+    # they must not start (and reset) the app again.
+    from .. import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        headers = await setup(client)
+        slow_ox(ox)
+        slow_imap(imap)
+        await sql_dovecot.get_amaker().kw["bind"].dispose()
+
+        gather = utils.fanout.gather
+        utils.fanout.gather = sequential_gather
+        report("sequential", await measure(client, headers, count))
+        utils.fanout.gather = gather
+        report("concurrent", await measure(client, headers, count))
+
+    # The connections of aiosqlite are threads, which would keep us running
+    for module in [sql_api, sql_dovecot, sql_postfix]:
+        await module.get_amaker().kw["bind"].dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--ox", type=float, default=0.02, help="duration of an OX lookup")
+    parser.add_argument("--imap", type=float, default=0.01, help="duration of a dovecot statement")
+    parser.add_argument("--count", type=int, default=200, help="requests to measure")
+    args = parser.parse_args()
+    try:
+        asyncio.run(bench(args.ox, args.imap, args.count))
+    finally:
+        utils.hashing.shutdown()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,98 @@
+"""Cost of pairing the OX users with the dovecot users of a domain, as
+get_mailboxes does, with the set of emails and the dicts of the users it used
+to build (`before`), and with the sorted merge-join (`after`, the OX users are
+sorted once per snapshot of the user index, the dovecot users come sorted from
+the database). Measures the time and the peak of memory, on users in memory:
+
+    python -m src.bench.mailbox_join --users 100000
+"""
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+
+from .. import oxcli, sql_dovecot, web_models
+from ..routes.mailboxes.join import join_users
+
+DOMAIN = "bench.fr"
+
+
+def make_users(count: int) -> tuple[list, list]:
+    # 10% of the mailboxes are only in OX, 10% only in dovecot
+    names = [f"user{i:06d}" for i in range(count)]
+    ox_users = [
+        oxcli.OxUser.model_construct(
+            uid=i,
+            username=name,
+            givenName="Bench",
+            surName=name,
+            displayName=f"Bench {name}",
+            email=f"{name}@{DOMAIN}",
+            ctx=None,
+        )
+        for i, name in enumerate(names)
+        if i % 10 != 0
+    ]
+    db_users = [
+        sql_dovecot.ImapUser(username=name, domain=DOMAIN)
+        for i, name in enumerate(names)
+        if i % 10 != 1
+    ]
+    # OX lists its users in no useful order
+    random.shuffle(ox_users)
+    return (ox_users, db_users)
+
+
+def before(ox_users: list, db_users: list) -> int:
+    emails = set([user.email for user in ox_users] + [user.email() for user in db_users])
+    ox_users_dict = {user.email: user for user in ox_users}
+    db_users_dict = {user.email(): user for user in db_users}
+    my_mailboxes = [
+        web_models.Mailbox.from_both_users(
+            ox_users_dict.get(email),
+            db_users_dict.get(email),
+            False,
+        )
+        for email in emails
+    ]
+    return len(my_mailboxes)
+
+
+def after(ox_users: list, db_users: list) -> int:
+    async def count():
+        # Like the ndjson stream, each mailbox is sent then forgotten
+        count = 0
+        async for _ in join_users(ox_users, db_users, False):
+            count += 1
+        return count
+
+    return asyncio.run(count())
+
+
+def measure(name: str, func, *args) -> None:
+    # The time, then the memory (tracing the allocations slows it down)
+    start = time.perf_counter()
+    count = func(*args)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(*args)
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:>7}: {count} mailboxes in {elapsed * 1000:8.1f} ms, peak {peak / 2**20:8.2f} MiB")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=100000, help="users on each side")
+    args = parser.parse_args()
+
+    (ox_users, db_users) = make_users(args.users)
+    measure("before", before, ox_users, db_users)
+    measure("sort", lambda users: len(sorted(users, key=oxcli.OxUser.email_key)), ox_users)
+    ox_users.sort(key=oxcli.OxUser.email_key)
+    measure("after", after, ox_users, db_users)
+
+
+if __name__ == "__main__":
+    main_bench()
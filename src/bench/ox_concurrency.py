@@ -0,0 +1,96 @@
+"""Checks that the API keeps serving while OX commands are in flight. Runs the
+app in FAKE mode (sqlite in /tmp), except for the OX cluster: its ssh commands
+are replaced by a local `sleep`, to mimic a slow cluster. While `--slow`
+requests to `POST /system/ox/refresh` wait for OX, we measure the latency of
+`GET /domains/`, which only needs the database:
+
+    python -m src.bench.ox_concurrency --slow 4 --delay 1
+
+The `blocking` run calls the sync oxcli API from the route (as the routes did
+before the async API), the `async` run uses the async API.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("DIMAIL_MODE", "FAKE")
+os.environ.setdefault("DIMAIL_JWT_SECRET", "bench secret")
+
+import httpx  # noqa: E402
+
+from .. import main, oxcli  # noqa: E402
+
+# The database is empty: any login is an admin.
+AUTH = ("bench", "bench")
+
+
+def declare_slow_cluster(delay: float) -> None:
+    oxcli.begin_test_clusters()
+    oxcli.declare_cluster("bench", "ssh://bench", [])
+    oxcli.set_default_cluster("bench")
+    csv = 'id,name,lmappings\\n1,bench,"1,bench,bench.fr"\\n'
+    oxcli.OxCluster("bench")._transport.command = lambda remote: [
+        "sh",
+        "-c",
+        f"sleep {delay}; printf '{csv}'",
+    ]
+
+
+async def blocking_refresh_contexts(self):
+    return self.refresh_contexts()
+
+
+async def measure(slow: int, delay: float, count: int) -> list[float]:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/domains/", auth=AUTH)
+        slow_calls = [
+            asyncio.create_task(client.post("/system/ox/refresh", auth=AUTH))
+            for _ in range(slow)
+        ]
+        # The fast requests are due at regular intervals, while the OX
+        # commands run. We count their latency from when they were due: when
+        # the event loop is blocked, they are late.
+        first = time.perf_counter() + 0.05
+        times = []
+        for i in range(count):
+            due = first + i * delay / count
+            await asyncio.sleep(max(due - time.perf_counter(), 0))
+            res = await client.get("/domains/", auth=AUTH)
+            res.raise_for_status()
+            times.append((time.perf_counter() - due) * 1000)
+        for res in await asyncio.gather(*slow_calls):
+            res.raise_for_status()
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    times = sorted(times)
+    print(
+        f"{name:>8}: min {times[0]:8.1f} ms, median {statistics.median(times):8.1f} ms, "
+        f"max {times[-1]:8.1f} ms"
+    )
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--slow", type=int, default=4, help="concurrent OX requests")
+    parser.add_argument("--delay", type=float, default=1.0, help="duration of an OX command")
+    parser.add_argument("--count", type=int, default=10, help="fast requests to measure")
+    args = parser.parse_args()
+
+    declare_slow_cluster(args.delay)
+    try:
+        run = oxcli.OxCluster.arefresh_contexts
+        oxcli.OxCluster.arefresh_contexts = blocking_refresh_contexts
+        report("blocking", asyncio.run(measure(args.slow, args.delay, args.count)))
+        oxcli.OxCluster.arefresh_contexts = run
+        report("async", asyncio.run(measure(args.slow, args.delay, args.count)))
+    finally:
+        oxcli.end_test_clusters()
+
+
+if __name__ == "__main__":
+    main_bench()
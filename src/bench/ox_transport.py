@@ -0,0 +1,64 @@
+"""Compares the latency of OX commands with and without persistent ssh
+connections. Needs a running sshd to talk to, the oxtest container of the
+docker compose will do (that's the default url):
+
+    python -m src.bench.ox_transport --count 20
+
+Any sshd where we can run `true` is enough, e.g. a local one:
+
+    python -m src.bench.ox_transport --url ssh://me@localhost:22 --arg=-i --arg=key
+"""
+import argparse
+import statistics
+import time
+
+from .. import oxcli
+
+
+def measure(cluster: oxcli.OxCluster, count: int) -> list[float]:
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        cluster.run_for_item(["true"])
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    times = sorted(times)
+    p95 = times[int(len(times) * 0.95) - 1] if len(times) >= 20 else times[-1]
+    print(
+        f"{name:>6}: min {times[0]:7.1f} ms, median {statistics.median(times):7.1f} ms, "
+        f"p95 {p95:7.1f} ms, max {times[-1]:7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="ssh://root@localhost:2222")
+    parser.add_argument("--arg", action="append", default=[], help="extra ssh argument")
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--pool", type=int, default=2)
+    args = parser.parse_args()
+
+    ssh_args = ["-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null"]
+    ssh_args += args.arg
+    oxcli.declare_cluster("cold", args.url, ssh_args)
+    oxcli.declare_cluster("warm", args.url, ssh_args, ssh_pool=args.pool)
+
+    cold = oxcli.OxCluster("cold")
+    warm = oxcli.OxCluster("warm")
+    try:
+        report("cold", measure(cold, args.count))
+        start = time.perf_counter()
+        warm.run_for_item(["true"])
+        first = (time.perf_counter() - start) * 1000
+        print(f"  first: {first:7.1f} ms (opens the first persistent connection)")
+        warm._transport.warm()
+        report("warm", measure(warm, args.count))
+    finally:
+        oxcli.close_clusters()
+
+
+if __name__ == "__main__":
+    main()
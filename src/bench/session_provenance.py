@@ -0,0 +1,70 @@
+"""Cost of the session dependency (create a session, close it), with the way
+get_maker used to find its caller (inspect.currentframe, three times, written
+in the shared `info` of the maker) and with the provenance of the sessions,
+at several sample rates:
+
+    python -m src.bench.session_provenance --count 100000
+"""
+import argparse
+import inspect
+import time
+
+import sqlalchemy as sa
+import sqlalchemy.orm as orm
+
+from .. import utils
+
+
+def before_get_maker(maker: orm.sessionmaker) -> orm.sessionmaker:
+    caller = inspect.currentframe().f_back.f_code.co_qualname
+    file = inspect.currentframe().f_back.f_code.co_filename
+    line = inspect.currentframe().f_back.f_code.co_firstlineno
+    maker.kw["info"]["caller"] = caller
+    maker.kw["info"]["file"] = f"{file}:{line}"
+    return maker
+
+
+def after_get_maker(maker: orm.sessionmaker) -> orm.sessionmaker:
+    return maker
+
+
+def best_of(func, count: int) -> float:
+    # The best of a few runs, in µs per call
+    best = None
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count * 1e6
+
+
+def measure(name: str, maker: orm.sessionmaker, get_maker, count: int) -> None:
+    def session():
+        db = get_maker(maker)()
+        db.close()
+
+    alone = best_of(lambda: get_maker(maker), count)
+    total = best_of(session, count)
+    print(f"{name:>12}: get_maker {alone:6.2f} µs, get_maker + session {total:6.2f} µs")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--count", type=int, default=100000, help="sessions to create")
+    args = parser.parse_args()
+
+    engine = sa.create_engine("sqlite://")
+    before = orm.sessionmaker(bind=engine, info={}, close_resets_only=False)
+    after = orm.sessionmaker(
+        bind=engine, info={}, close_resets_only=False, class_=utils.provenance.TracedSession
+    )
+    measure("before", before, before_get_maker, args.count)
+    for rate in [1, 0.1, 0]:
+        utils.provenance.set_sample_rate(rate)
+        measure(f"after ({rate})", after, after_get_maker, args.count)
+
+
+if __name__ == "__main__":
+    main_bench()
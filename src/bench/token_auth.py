@@ -0,0 +1,59 @@
+"""Cost of the check of a bearer token, on each request, when the same token is
+sent again and again (as the UI does, for the 47 minutes of its token):
+
+    python -m src.bench.token_auth --count 100000
+
+The `before` run decodes the token on each call, reading the secret from the
+settings (as TokenUser.verify_jwt did before its cache), the `after` run goes
+through TokenUser.verify_jwt, with its cache of decoded tokens.
+"""
+import argparse
+import datetime
+import logging
+import os
+import time
+
+os.environ.setdefault("DIMAIL_JWT_SECRET", "bench secret")
+
+import jwt  # noqa: E402
+
+from .. import auth, config  # noqa: E402
+
+
+def make_token() -> str:
+    expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=47)
+    return jwt.encode({"sub": "bench", "exp": expire}, config.settings["JWT_SECRET"], "HS256")
+
+
+def before(log, jwtoken: str) -> dict:
+    token = jwt.decode(jwtoken, config.settings["JWT_SECRET"], "HS256")
+    now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    if token["exp"] < now:
+        raise Exception("expired")
+    return token
+
+
+def measure(name: str, verify, count: int) -> None:
+    log = logging.getLogger(__name__)
+    token = make_token()
+    start = time.perf_counter()
+    for _ in range(count):
+        verify(log, token)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>6}: {elapsed / count * 1e6:8.1f} µs per request")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--count", type=int, default=100000, help="requests to measure")
+    parser.add_argument("--cache-size", type=int, default=4096, help="decoded tokens kept")
+    args = parser.parse_args()
+
+    token_user = auth.token_user.TokenUser()
+    token_user.configure(config.settings["JWT_SECRET"], cache_size=args.cache_size)
+    measure("before", before, args.count)
+    measure("after", token_user.verify_jwt, args.count)
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -16,7 +16,10 @@ import testcontainers.mysql as tc_mysql
 import alembic.command
 import alembic.config
 
-from . import config, main, oxcli, sql_api, sql_dovecot, sql_postfix
+from . import config, main, oxcli, sql_api, sql_dovecot, sql_postfix, utils
+
+# We want to know where every lost session comes from
+utils.provenance.set_sample_rate(1)
 
 def make_db(name: str, conn: sa.Connection) -> str:
     """Utility function, for internal use. Ensure a database, named 'name'
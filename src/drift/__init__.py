@@ -0,0 +1,8 @@
+from . import report
+from .report import AlreadyRunning, arun
+
+__all__ = [
+    AlreadyRunning,
+    arun,
+    report,
+]
@@ -0,0 +1,53 @@
+"""Computes the drift between OX and dovecot on the whole cluster, with the
+settings of the API, and writes the drifts as ndjson (the summary goes to
+stderr):
+
+    python -m src.drift --output drift.ndjson
+"""
+import argparse
+import asyncio
+import sys
+
+from .. import config, oxcli, sql_api, sql_dovecot, sql_postfix, utils
+from . import report
+
+
+async def amain(output: str, parallel: int) -> None:
+    # Not at the top: the processes hashing the passwords import this module,
+    # they must not configure (and, in FAKE mode, reset) the app again.
+    from .. import main  # noqa: F401
+
+    summary = await report.arun(parallel)
+    out = sys.stdout if output == "-" else open(output, "w")
+    try:
+        for drift in report.last_drifts:
+            out.write(drift.model_dump_json() + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(summary.model_dump_json(indent=2), file=sys.stderr)
+
+    # The connections of aiosqlite are threads, which would keep us running
+    for module in [sql_api, sql_dovecot, sql_postfix]:
+        await module.get_amaker().kw["bind"].dispose()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", default="-", help="the ndjson file, - for stdout")
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=config.settings.drift_parallel,
+        help="OX contexts listed at the same time",
+    )
+    args = parser.parse_args()
+    try:
+        asyncio.run(amain(args.output, args.parallel))
+    finally:
+        oxcli.close_clusters()
+        utils.hashing.shutdown()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,151 @@
+"""The drift between OX and dovecot, on the whole cluster, in one pass: one
+listcontext, the users of all the contexts listed in parallel, and the users
+table of dovecot read once, in order. Both sides are joined on the address,
+domain by domain.
+
+The last report is kept in memory until the next run."""
+import asyncio
+import datetime
+import logging
+import typing
+
+from .. import oxcli, sql_api, sql_dovecot, utils, web_models
+
+log = logging.getLogger(__name__)
+
+last_report: web_models.DriftReport | None = None
+last_drifts: list[web_models.Drift] = []
+running = False
+
+
+class AlreadyRunning(Exception):
+    pass
+
+
+def ox_key(ox_user: oxcli.OxUser) -> tuple:
+    (username, domain) = ox_user.email_key()
+    return (domain, username)
+
+
+def imap_key(db_user: sql_dovecot.ImapUser) -> tuple:
+    return (db_user.domain, db_user.username)
+
+
+async def afetch_ox_users(
+    cluster: oxcli.OxCluster, parallel: int
+) -> tuple[list[oxcli.OxContext], list[oxcli.OxUser]]:
+    """The contexts of the cluster, and the users of all of them, ordered by
+    (domain, username). At most `parallel` contexts are listed at the same
+    time."""
+    contexts = await cluster.arefresh_contexts()
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def fetch(ctx: oxcli.OxContext) -> list[oxcli.OxUser]:
+        async with semaphore:
+            return await ctx.arefresh_users()
+
+    users = await asyncio.gather(*[fetch(ctx) for ctx in contexts])
+    ox_users = sorted((user for ctx_users in users for user in ctx_users), key=ox_key)
+    return (contexts, ox_users)
+
+
+def find_drift(
+    key: tuple,
+    ox_user: oxcli.OxUser | None,
+    db_user: sql_dovecot.ImapUser | None,
+    webmail_domains: set[str],
+) -> web_models.Drift | None:
+    (domain, username) = key
+    drift = web_models.Drift(
+        kind=web_models.DriftKind.OxOnly,
+        domain=domain,
+        email=f"{username}@{domain}",
+    )
+    if ox_user is not None:
+        drift.context = ox_user.ctx.name
+        drift.ox_username = ox_user.username
+    if db_user is not None:
+        drift.imap_username = db_user.username
+
+    if db_user is None:
+        return drift
+    if ox_user is None:
+        # Without the webmail, a mailbox is only in dovecot
+        if domain not in webmail_domains:
+            return None
+        drift.kind = web_models.DriftKind.DovecotOnly
+        return drift
+    if ox_user.username != db_user.username:
+        drift.kind = web_models.DriftKind.NameMismatch
+        return drift
+    return None
+
+
+async def afind_drifts(
+    ox_users: list[oxcli.OxUser],
+    db_users: typing.AsyncIterable[sql_dovecot.ImapUser],
+    webmail_domains: set[str],
+    counts: dict[str, int],
+) -> typing.AsyncIterator[web_models.Drift]:
+    """Joins the OX and dovecot users, both ordered by (domain, username), and
+    yields their drifts. Counts the dovecot users in `counts`."""
+    counts["imap_users"] = 0
+    async for key, ox_user, db_user in utils.merge.amerge_join(
+        ox_users, db_users, ox_key, imap_key
+    ):
+        if db_user is not None:
+            counts["imap_users"] += 1
+        drift = find_drift(key, ox_user, db_user, webmail_domains)
+        if drift is not None:
+            yield drift
+
+
+async def arun(parallel: int) -> web_models.DriftReport:
+    """Computes the drift report, and keeps it (with its drifts) until the next
+    run. Raises AlreadyRunning when a report is being computed."""
+    global last_report, last_drifts, running
+    if running:
+        raise AlreadyRunning("A drift report is already running")
+    running = True
+    try:
+        started_at = datetime.datetime.now(datetime.timezone.utc)
+        cluster = oxcli.OxCluster()
+        (contexts, ox_users) = await afetch_ox_users(cluster, parallel)
+        log.info(f"Drift: {len(ox_users)} users in {len(contexts)} OX contexts")
+
+        api = sql_api.get_amaker()()
+        imap = sql_dovecot.get_amaker()()
+        try:
+            webmail_domains = {
+                domain.name
+                for domain in await sql_api.aget_domains(api)
+                if "webmail" in domain.features
+            }
+            counts = {}
+            drifts = [
+                drift
+                async for drift in afind_drifts(
+                    ox_users, sql_dovecot.astream_users(imap), webmail_domains, counts
+                )
+            ]
+        finally:
+            await imap.close()
+            await api.close()
+
+        domains = {}
+        for drift in drifts:
+            by_kind = domains.setdefault(drift.domain, {})
+            by_kind[drift.kind] = by_kind.get(drift.kind, 0) + 1
+        last_report = web_models.DriftReport(
+            started_at=started_at,
+            finished_at=datetime.datetime.now(datetime.timezone.utc),
+            contexts=len(contexts),
+            ox_users=len(ox_users),
+            imap_users=counts["imap_users"],
+            domains=domains,
+        )
+        last_drifts = drifts
+        log.info(f"Drift: {len(drifts)} drifts in {len(domains)} domains")
+        return last_report
+    finally:
+        running = False
@@ -0,0 +1,53 @@
+import asyncio
+
+from .. import oxcli, sql_dovecot, web_models
+from . import report
+
+
+def make_ox_user(username: str, email: str) -> oxcli.OxUser:
+    ctx = oxcli.OxContext.model_construct(cid=1, name="ctx", domains={"a.fr", "b.fr"})
+    return oxcli.OxUser.model_construct(
+        uid=1,
+        username=username,
+        givenName="Test",
+        surName=username,
+        displayName=f"Test {username}",
+        email=email,
+        ctx=ctx,
+    )
+
+
+def test_find_drifts():
+    ox_users = sorted(
+        [
+            make_ox_user("ok", "ok@a.fr"),
+            make_ox_user("renamed", "other@a.fr"),
+            make_ox_user("only", "only@b.fr"),
+        ],
+        key=report.ox_key,
+    )
+    db_users = [
+        sql_dovecot.ImapUser(username="imap", domain="a.fr"),
+        sql_dovecot.ImapUser(username="ok", domain="a.fr"),
+        sql_dovecot.ImapUser(username="other", domain="a.fr"),
+        # b.fr has no webmail, its mailboxes are only in dovecot
+        sql_dovecot.ImapUser(username="imap", domain="b.fr"),
+    ]
+
+    async def find():
+        counts = {}
+        drifts = [
+            drift async for drift in report.afind_drifts(ox_users, db_users, {"a.fr"}, counts)
+        ]
+        return (drifts, counts)
+
+    (drifts, counts) = asyncio.run(find())
+    assert counts == {"imap_users": 4}
+    assert [(drift.kind, drift.email) for drift in drifts] == [
+        (web_models.DriftKind.DovecotOnly, "imap@a.fr"),
+        (web_models.DriftKind.NameMismatch, "other@a.fr"),
+        (web_models.DriftKind.OxOnly, "only@b.fr"),
+    ]
+    assert drifts[1].ox_username == "renamed"
+    assert drifts[1].imap_username == "other"
+    assert drifts[1].context == "ctx"
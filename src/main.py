@@ -1,9 +1,10 @@
+import contextlib
 import pathlib
 
 import fastapi
 from fastapi.middleware.cors import CORSMiddleware
 
-from . import config, oxcli, routes, sql_api, sql_dovecot, sql_postfix
+from . import auth, config, oxcli, routes, sql_api, sql_dovecot, sql_postfix, utils
 
 if config.settings.mode == "FAKE":
     print("Running in FAKE mode")
@@ -15,11 +16,23 @@ if config.settings.mode == "FAKE":
     config.settings.postfix_db_url = "sqlite:////tmp/postfix.db"
     config.settings.ox_ssh_url = "FAKE"
 
-engine_api = sql_api.init_db(config.settings.api_db_url)
-engine_dovecot = sql_dovecot.init_db(config.settings.imap_db_url)
-engine_postfix = sql_postfix.init_db(config.settings.postfix_db_url)
+engine_api = sql_api.init_db(config.settings.api_db_url, config.settings.api_db_pool)
+engine_dovecot = sql_dovecot.init_db(config.settings.imap_db_url, config.settings.imap_db_pool)
+engine_postfix = sql_postfix.init_db(
+    config.settings.postfix_db_url, config.settings.postfix_db_pool
+)
 
-oxcli.declare_cluster("default", config.settings.ox_ssh_url, [])
+oxcli.declare_cluster(
+    "default",
+    config.settings.ox_ssh_url,
+    [],
+    ssh_pool=config.settings.ox_ssh_pool,
+    ssh_persist=config.settings.ox_ssh_persist,
+    context_ttl=config.settings.ox_context_ttl,
+    user_ttl=config.settings.ox_user_ttl,
+    stale_limit=config.settings.ox_stale_limit,
+    max_commands=config.settings.ox_max_commands,
+)
 oxcli.set_default_cluster("default")
 
 if config.settings.mode == "FAKE":
@@ -28,22 +41,83 @@ if config.settings.mode == "FAKE":
     sql_dovecot.Dovecot.metadata.create_all(engine_dovecot)
     sql_postfix.Postfix.metadata.create_all(engine_postfix)
 
+utils.hashing.configure(
+    workers=config.settings.hash_workers,
+    max_pending=config.settings.hash_max_pending,
+    time_cost=config.settings.argon2_time_cost,
+    memory_cost=config.settings.argon2_memory_cost,
+    parallelism=config.settings.argon2_parallelism,
+)
+
+utils.provenance.set_sample_rate(config.settings.session_provenance_rate)
+
+utils.fanout.configure(
+    ox=config.settings.ox_lookup_timeout,
+    imap=config.settings.imap_lookup_timeout,
+)
+
+auth.creds_cache.configure(ttl=config.settings.basic_auth_cache_ttl)
+
 if config.settings.JWT_SECRET == "bare secret":
     raise Exception("please configure JWT_SECRET")
 
+auth.configure_tokens(
+    secret=config.settings.JWT_SECRET,
+    cache_size=config.settings.token_cache_size,
+)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    # The routes use the async engines
+    await utils.pool.awarm_up(
+        "api", sql_api.get_amaker().kw["bind"], config.settings.api_db_pool
+    )
+    await utils.pool.awarm_up(
+        "imap", sql_dovecot.get_amaker().kw["bind"], config.settings.imap_db_pool
+    )
+    await utils.pool.awarm_up(
+        "postfix", sql_postfix.get_amaker().kw["bind"], config.settings.postfix_db_pool
+    )
+    oxcli.warm_clusters()
+    oxcli.start_refresh()
+    routes.mailboxes.reconcile.start_reconcile(config.settings.mailbox_state_interval)
+    yield
+    await routes.mailboxes.reconcile.astop_reconcile()
+    oxcli.stop_refresh()
+    oxcli.close_clusters()
+    utils.hashing.shutdown()
+    utils.provenance.log_open_sessions()
+
+
 app = fastapi.FastAPI(
+    lifespan=lifespan,
     responses={
         401: {"description": "Not authorized"},
         404: {"description": "Not found"},
     },
 )
 
+
+@app.exception_handler(utils.HashingBusy)
+async def hashing_busy(request: fastapi.Request, exc: utils.HashingBusy):
+    return fastapi.responses.JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": "1"},
+    )
+
+
+app.add_middleware(utils.provenance.RouteMiddleware)
+app.add_middleware(oxcli.age.DataAgeMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", oxcli.age.HEADER],
 )
 
 
@@ -53,5 +127,6 @@ app.include_router(routes.routers.allows)
 app.include_router(routes.routers.token)
 app.include_router(routes.routers.mailboxes)
 app.include_router(routes.routers.aliases)
+app.include_router(routes.routers.system)
 
 
@@ -1,19 +1,52 @@
 from .ox import OxCluster, OxContext, OxUser
+from . import age, aox
 from .setup import (
     begin_test_clusters,
+    close_clusters,
     declare_cluster,
     end_test_clusters,
     get_cluster_info,
+    get_cluster_stats,
+    get_context_cache,
+    get_flights,
+    get_scheduler,
+    get_user_indexes,
+    list_clusters,
     set_default_cluster,
+    warm_clusters,
 )
+from .cache import ContextCache, Snapshot, UserIndex, UserIndexes
+from .flight import Flights
+from .refresh import start_refresh, stop_refresh
+from .scheduler import Scheduler
+from .transport import SshTransport
 
 __all__ = [
+    age,
+    aox,
     OxCluster,
     OxContext,
     OxUser,
+    ContextCache,
+    Flights,
+    Scheduler,
+    Snapshot,
+    SshTransport,
+    UserIndex,
+    UserIndexes,
     begin_test_clusters,
+    close_clusters,
     declare_cluster,
     end_test_clusters,
     get_cluster_info,
+    get_cluster_stats,
+    get_context_cache,
+    get_flights,
+    get_scheduler,
+    get_user_indexes,
+    list_clusters,
     set_default_cluster,
+    start_refresh,
+    stop_refresh,
+    warm_clusters,
 ]
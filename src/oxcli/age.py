@@ -0,0 +1,56 @@
+"""How old the OX data used to serve a request is. The lookups which answer
+from a snapshot (the context cache, the user indexes) observe its age, the
+ones which listed on the cluster observe 0. DataAgeMiddleware tells the
+client the oldest age observed while serving its request, in seconds, in the
+X-OX-Data-Age header (not sent when the request did not use OX)."""
+import contextvars
+import math
+
+HEADER = "X-OX-Data-Age"
+
+
+class Ages:
+    def __init__(self):
+        self.oldest: float | None = None
+
+    def observe(self, age: float) -> None:
+        if self.oldest is None or age > self.oldest:
+            self.oldest = age
+
+
+# The Ages of the current request. It is the same object in the threads the
+# sync routes run in (they get a copy of the context, not of the object).
+current: contextvars.ContextVar[Ages | None] = contextvars.ContextVar(
+    "ox_data_age", default=None
+)
+
+
+def observe(age: float | None) -> None:
+    ages = current.get()
+    if ages is not None and age is not None:
+        ages.observe(age)
+
+
+class DataAgeMiddleware:
+    """ASGI middleware adding the X-OX-Data-Age header to the responses."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        ages = Ages()
+
+        async def send_with_age(message):
+            if message["type"] == "http.response.start" and ages.oldest is not None:
+                age = f"{math.floor(ages.oldest)}".encode()
+                message["headers"] = [*message.get("headers", []), (HEADER.lower().encode(), age)]
+            await send(message)
+
+        token = current.set(ages)
+        try:
+            await self.app(scope, receive, send_with_age)
+        finally:
+            current.reset(token)
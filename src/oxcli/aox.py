@@ -0,0 +1,540 @@
+"""The async flavour of the oxcli API. Same methods as the sync ones, with an
+'a' in front (`alist_contexts`, `aget_user_by_email`, ...), to be awaited from
+the async routes: the ssh commands run with asyncio subprocesses, and never
+block the event loop. The fake clusters have no I/O, their async methods just
+call the sync ones."""
+import asyncio
+import collections
+import contextlib
+import csv
+import logging
+import typing
+
+from . import age
+from .cache import ContextCache, Snapshot, UserIndex
+from .ox import (
+    STDERR_LINES,
+    OxCluster,
+    OxContext,
+    OxUser,
+    _batch_commands,
+    _batch_results,
+    _batch_script,
+    _changecontext_command,
+    _changed_user,
+    _changeuser_command,
+    _check_cluster,
+    _cmd,
+    _command_context,
+    _createcontext_command,
+    _created_context,
+    _created_user,
+    _createuser_command,
+    _deleted_user,
+    _deleteuser_command,
+    _enabled_user_index,
+    _find_user,
+    _listcontext_command,
+    _listuser_command,
+    _mapped_domain,
+    _new_context_id,
+    _new_user_names,
+    _read_batch_output,
+)
+
+log = logging.getLogger("oxcli")
+
+
+# The csv lines are long when a user has many aliases, asyncio's default
+# limit of 64k would make readline fail.
+LINE_LIMIT = 1024 * 1024
+
+# The background refills of the stale snapshots
+revalidations: set[asyncio.Task] = set()
+
+
+async def _acommand(self: OxCluster, remote: str) -> list[str]:
+    if not self._transport.is_multiplexed():
+        return self._transport.command(remote)
+    # Opening the ssh master is a blocking handshake, it must not hold the
+    # event loop
+    return await asyncio.to_thread(self._transport.command, remote)
+
+
+async def _aspawn(self: OxCluster, command: list[str]) -> asyncio.subprocess.Process:
+    _check_cluster(self)
+    return await asyncio.create_subprocess_exec(
+        *await _acommand(self, _cmd(command)),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=LINE_LIMIT,
+    )
+
+
+async def _adrain(stream: asyncio.StreamReader) -> str:
+    lines = collections.deque(maxlen=STDERR_LINES)
+    async for line in stream:
+        lines.append(line.decode())
+    return "".join(lines)
+
+
+async def _arecords(stream: asyncio.StreamReader) -> typing.AsyncIterator[str]:
+    # A csv record ends on a line with an even count of quotes so far: a
+    # quoted field may hold a newline, and escaped quotes come in pairs.
+    pending = ""
+    async for line in stream:
+        pending += line.decode()
+        if pending.count('"') % 2 == 0:
+            yield pending
+            pending = ""
+    if pending:
+        yield pending
+
+
+async def _astream_csv(self: OxCluster, command: list[str]) -> typing.AsyncIterator[dict]:
+    """Runs the command, and yields the csv lines of its output as they come,
+    without keeping them. If the caller stops early, the command is killed."""
+    _check_cluster(self)
+    async with self._scheduler.aslot():
+        proc = await _aspawn(self, command)
+        drain = asyncio.create_task(_adrain(proc.stderr))
+        header = None
+        count = 0
+        done = False
+        try:
+            async for record in _arecords(proc.stdout):
+                values = next(csv.reader([record]), [])
+                if header is None:
+                    header = values
+                    continue
+                if not values:
+                    continue
+                count += 1
+                yield dict(zip(header, values))
+            done = True
+        finally:
+            if not done:
+                proc.kill()
+            await proc.wait()
+            errors = await drain
+
+    if proc.returncode != 0:
+        log.error(f"Failed to call {command}")
+        log.error(errors)
+        raise Exception("Failed to run ssh command")
+
+    log.info(f"We got {count} csv lines from command")
+
+
+async def _arun_for_csv(self: OxCluster, command: list[str]) -> list[dict]:
+    async def fetch() -> list[dict]:
+        return [line async for line in self.astream_csv(command)]
+
+    return list(await self._flights.ado(_cmd(command), fetch))
+
+
+async def _arun_for_item(self: OxCluster, command: list[str]) -> str:
+    _check_cluster(self)
+    async with self._scheduler.aslot(write=True, cid=_command_context(command)):
+        proc = await _aspawn(self, command)
+        stdout, stderr = await proc.communicate()
+    # The listings which ran during the change must not be shared any more
+    self._flights.forget()
+
+    if proc.returncode != 0:
+        log.error(f"Failed to call {command}")
+        log.error(stderr.decode())
+        raise Exception("Failed to run ssh command")
+
+    log.info("Command success")
+    return stdout.decode()
+
+
+async def _arun_script(self: OxCluster, script: str, cid: int | None = None) -> str:
+    _check_cluster(self)
+    async with self._scheduler.aslot(write=True, cid=cid):
+        proc = await asyncio.create_subprocess_exec(
+            *await _acommand(self, "sh -s"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate(script.encode())
+    self._flights.forget()
+
+    if proc.returncode != 0:
+        log.error("Failed to run a script")
+        log.error(stderr.decode())
+        raise Exception("Failed to run ssh command")
+
+    log.info("Script success")
+    return stdout.decode()
+
+
+async def _apurge(self: OxCluster) -> None:
+    if self.is_fake():
+        return self.purge()
+    log.info("Purge everything from the cluster")
+    await self.arun_for_item(["/root/purge.sh"])
+    log.info("Ox server is empty")
+
+
+async def _astream_contexts(self: OxCluster) -> typing.AsyncIterator[OxContext]:
+    if self.is_fake():
+        for ctx in self.stream_contexts():
+            yield ctx
+        return
+    async with contextlib.aclosing(self.astream_csv(_listcontext_command(self))) as lines:
+        async for line in lines:
+            yield OxContext.read_from_csv(self, line)
+
+
+async def _afetch_contexts(self: OxCluster) -> list[OxContext]:
+    async def fetch() -> list[OxContext]:
+        return [ctx async for ctx in self.astream_contexts()]
+
+    # The callers listing the contexts at the same time share one listcontext
+    command = _cmd(_listcontext_command(self))
+    age.observe(0)
+    return list(await self._flights.ado(command, fetch))
+
+
+def _arevalidate(
+    snapshot: Snapshot, what: str, refill: typing.Callable[[], typing.Awaitable]
+):
+    """Refills a stale snapshot in a background task, unless it is already
+    being refilled."""
+    if not snapshot.begin_refresh():
+        return
+
+    async def run():
+        try:
+            await refill()
+        except Exception as e:
+            log.error(f"Failed to refresh {what}: {e}")
+        finally:
+            snapshot.end_refresh()
+
+    # Keep a reference on the task, the event loop only keeps a weak one
+    task = asyncio.create_task(run(), name=f"oxcli-revalidate-{what}")
+    revalidations.add(task)
+    task.add_done_callback(revalidations.discard)
+
+
+async def _acached_contexts(self: OxCluster) -> ContextCache | None:
+    cache = self._contexts
+    if cache is None or not cache.is_enabled():
+        return None
+    if cache.is_fresh():
+        pass
+    elif cache.is_usable():
+        _arevalidate(cache, self.name, lambda: _arefill_contexts(self, cache))
+    else:
+        await _arefill_contexts(self, cache)
+    age.observe(cache.age())
+    return cache
+
+
+async def _alookup(
+    snapshot: Snapshot,
+    lookup: typing.Callable,
+    refill: typing.Callable[[], typing.Awaitable],
+):
+    # See ox._lookup
+    found = lookup()
+    if found is None and not snapshot.is_fresh():
+        await refill()
+        found = lookup()
+    return found
+
+
+async def _arefill_contexts(self: OxCluster, cache: ContextCache) -> None:
+    cache.fill(await _afetch_contexts(self))
+
+
+async def _arefresh_contexts(self: OxCluster) -> list[OxContext]:
+    if self.is_fake():
+        return self.refresh_contexts()
+    contexts = await _afetch_contexts(self)
+    if self._contexts is not None and self._contexts.is_enabled():
+        self._contexts.fill(contexts)
+    return contexts
+
+
+async def _alist_contexts(self: OxCluster) -> list[OxContext]:
+    if self.is_fake():
+        return self.list_contexts()
+    cache = await _acached_contexts(self)
+    if cache is not None:
+        return cache.all()
+    return await _afetch_contexts(self)
+
+
+async def _aget_context(self: OxCluster, cid: int) -> OxContext | None:
+    if self.is_fake():
+        return self.get_context(cid)
+    cache = await _acached_contexts(self)
+    if cache is not None:
+        return await _alookup(
+            cache, lambda: cache.get(cid), lambda: _arefill_contexts(self, cache)
+        )
+    # The lookups at the same time share one listcontext
+    for ctx in await _afetch_contexts(self):
+        if ctx.cid == cid:
+            return ctx
+    return None
+
+
+async def _aget_context_by_name(self: OxCluster, name: str) -> OxContext | None:
+    if self.is_fake():
+        return self.get_context_by_name(name)
+    cache = await _acached_contexts(self)
+    if cache is not None:
+        return await _alookup(
+            cache, lambda: cache.get_by_name(name), lambda: _arefill_contexts(self, cache)
+        )
+    # The lookups at the same time share one listcontext
+    for ctx in await _afetch_contexts(self):
+        if ctx.name == name:
+            return ctx
+    return None
+
+
+async def _aget_context_by_domain(self: OxCluster, domain: str) -> OxContext | None:
+    if self.is_fake():
+        return self.get_context_by_domain(domain)
+    cache = await _acached_contexts(self)
+    if cache is not None:
+        return await _alookup(
+            cache, lambda: cache.get_by_domain(domain), lambda: _arefill_contexts(self, cache)
+        )
+    # The lookups at the same time share one listcontext
+    for ctx in await _afetch_contexts(self):
+        if domain in ctx.domains:
+            return ctx
+    return None
+
+
+async def _acreate_context(
+    self: OxCluster, cid: int | None, name: str, domain: str
+) -> OxContext:
+    if self.is_fake():
+        return self.create_context(cid, name, domain)
+    cid = _new_context_id(await self.alist_contexts(), cid, name, domain)
+    await self.arun_for_item(_createcontext_command(self, cid, name, domain))
+    ctx = _created_context(self, await _acached_contexts(self), cid, name, domain)
+    if ctx is not None:
+        return ctx
+    ctx = await self.aget_context(cid)
+    if ctx is None:
+        raise Exception("Created the context, but failed to list it")
+    return ctx
+
+
+async def _aadd_mapping(self: OxCluster, cid: int, domain: str) -> OxContext:
+    ctx = await self.aget_context(cid)
+    if ctx is None:
+        raise Exception("Context not found")
+    return await ctx.aadd_mapping(domain)
+
+
+async def _actx_add_mapping(self: OxContext, domain: str) -> OxContext:
+    if self.is_fake():
+        return self.add_mapping(domain)
+    await self.cluster.arun_for_item(_changecontext_command(self, domain))
+    ctx = _mapped_domain(self, await _acached_contexts(self.cluster), domain)
+    if ctx is not None:
+        return ctx
+    return await self.cluster.aget_context(self.cid)
+
+
+async def _astream_users(
+    self: OxContext, search: str | None = None
+) -> typing.AsyncIterator[OxUser]:
+    if self.is_fake():
+        for user in self.stream_users(search):
+            yield user
+        return
+    command = _listuser_command(self, search)
+    async with contextlib.aclosing(self.cluster.astream_csv(command)) as lines:
+        async for line in lines:
+            yield OxUser.read_from_csv(self, line)
+
+
+async def _afetch_users(self: OxContext) -> list[OxUser]:
+    async def fetch() -> list[OxUser]:
+        return [user async for user in self.astream_users()]
+
+    # The callers listing the users at the same time share one listuser
+    command = _cmd(_listuser_command(self))
+    age.observe(0)
+    return list(await self.cluster._flights.ado(command, fetch))
+
+
+async def _arefill_users(self: OxContext, index: UserIndex) -> None:
+    index.miss()
+    index.fill(await _afetch_users(self))
+
+
+async def _auser_index(self: OxContext) -> UserIndex | None:
+    index = _enabled_user_index(self)
+    if index is None:
+        return None
+    if index.is_fresh():
+        index.hit()
+    elif index.is_usable():
+        index.hit()
+
+        async def refill():
+            index.fill(await _afetch_users(self))
+
+        _arevalidate(index, f"{self.cluster.name}-{self.cid}", refill)
+    else:
+        await _arefill_users(self, index)
+    age.observe(index.age())
+    return index
+
+
+async def _arefresh_users(self: OxContext) -> list[OxUser]:
+    if self.is_fake():
+        return self.refresh_users()
+    users = await _afetch_users(self)
+    index = _enabled_user_index(self)
+    if index is not None:
+        index.fill(users)
+    return users
+
+
+async def _alist_users(self: OxContext) -> list[OxUser]:
+    if self.is_fake():
+        return self.list_users()
+    index = await _auser_index(self)
+    if index is not None:
+        return index.all()
+    return await _afetch_users(self)
+
+
+async def _alist_sorted_users(self: OxContext) -> list[OxUser]:
+    if self.is_fake():
+        return self.list_sorted_users()
+    index = await _auser_index(self)
+    if index is not None:
+        return index.all_sorted()
+    return sorted(await _afetch_users(self), key=OxUser.email_key)
+
+
+async def _asearch_user(self: OxContext, username: str) -> list[OxUser]:
+    if self.is_fake():
+        return self.search_user(username)
+    return [user async for user in self.astream_users(username)]
+
+
+async def _aget_user_by_name(self: OxContext, username: str) -> OxUser | None:
+    if self.is_fake():
+        return self.get_user_by_name(username)
+    index = await _auser_index(self)
+    if index is not None:
+        return await _alookup(
+            index, lambda: index.by_username.get(username), lambda: _arefill_users(self, index)
+        )
+    return _find_user(await self.asearch_user(username), username)
+
+
+async def _aget_user_by_email(self: OxContext, email: str) -> OxUser | None:
+    if self.is_fake():
+        return self.get_user_by_email(email)
+    index = await _auser_index(self)
+    if index is not None:
+        return await _alookup(
+            index, lambda: index.by_email.get(email), lambda: _arefill_users(self, index)
+        )
+    async with contextlib.aclosing(self.astream_users()) as users:
+        async for user in users:
+            if user.email == email:
+                return user
+    return None
+
+
+async def _acreate_user(
+    self: OxContext,
+    surName: str,
+    givenName: str,
+    displayName: str | None = None,
+    email: str | None = None,
+    username: str | None = None,
+    domain: str | None = None,
+) -> OxUser:
+    if self.is_fake():
+        return self.create_user(surName, givenName, displayName, email, username, domain)
+    (username, email, displayName) = _new_user_names(
+        surName, givenName, displayName, email, username, domain
+    )
+    await self.cluster.arun_for_item(
+        _createuser_command(self, username, givenName, surName, displayName, email)
+    )
+    return _created_user(self, await self.asearch_user(username), username)
+
+
+async def _acreate_users(self: OxContext, users: list[dict]) -> list[OxUser | Exception]:
+    if self.is_fake():
+        return self.create_users(users)
+    (results, commands) = _batch_commands(self, users)
+    statuses = []
+    listed = {}
+    if commands:
+        output = await self.cluster.arun_script(_batch_script(commands), self.cid)
+        statuses = _read_batch_output(output, len(commands))
+        listed = {user.username: user async for user in self.astream_users()}
+    return _batch_results(self, results, statuses, listed)
+
+
+async def _achange_user(
+    self: OxUser,
+    givenName: str | None = None,
+    surName: str | None = None,
+    displayName: str | None = None,
+) -> None:
+    if self.is_fake():
+        return self.change(givenName, surName, displayName)
+    command = _changeuser_command(self, givenName, surName, displayName)
+    await self.ctx.cluster.arun_for_item(command)
+    _changed_user(self, givenName, surName, displayName)
+
+
+async def _adelete_user(self: OxUser) -> None:
+    if self.is_fake():
+        return self.delete()
+    await self.ctx.cluster.arun_for_item(_deleteuser_command(self))
+    _deleted_user(self)
+
+
+OxCluster.apurge = _apurge
+OxCluster.astream_csv = _astream_csv
+OxCluster.arun_for_csv = _arun_for_csv
+OxCluster.arun_for_item = _arun_for_item
+OxCluster.arun_script = _arun_script
+
+OxCluster.astream_contexts = _astream_contexts
+OxCluster.alist_contexts = _alist_contexts
+OxCluster.arefresh_contexts = _arefresh_contexts
+OxCluster.aget_context = _aget_context
+OxCluster.aget_context_by_name = _aget_context_by_name
+OxCluster.aget_context_by_domain = _aget_context_by_domain
+OxCluster.acreate_context = _acreate_context
+OxCluster.aadd_mapping = _aadd_mapping
+
+OxContext.aadd_mapping = _actx_add_mapping
+OxContext.acreate_user = _acreate_user
+OxContext.acreate_users = _acreate_users
+OxContext.astream_users = _astream_users
+OxContext.alist_users = _alist_users
+OxContext.alist_sorted_users = _alist_sorted_users
+OxContext.arefresh_users = _arefresh_users
+OxContext.asearch_user = _asearch_user
+
+OxContext.aget_user_by_name = _aget_user_by_name
+OxContext.aget_user_by_email = _aget_user_by_email
+
+OxUser.achange = _achange_user
+OxUser.adelete = _adelete_user
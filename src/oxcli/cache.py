@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """What we listed on the cluster, fresh for `ttl` seconds after being
+    filled. With a `stale_limit` above the ttl, a snapshot which is no longer
+    fresh is still served, up to that age, while it is refreshed in background
+    (stale-while-revalidate): the requests do not wait for the listing."""
+
+    def __init__(self, ttl: int, stale_limit: int = 0):
+        self.ttl = ttl
+        self.stale_limit = stale_limit
+        self.lock = threading.Lock()
+        self.loaded_at: float | None = None
+        self.refreshing = False
+
+    def age(self) -> float | None:
+        if self.loaded_at is None:
+            return None
+        return time.monotonic() - self.loaded_at
+
+    def is_fresh(self) -> bool:
+        age = self.age()
+        return age is not None and age < self.ttl
+
+    def is_usable(self) -> bool:
+        """True when the snapshot, fresh or not, can still be served."""
+        age = self.age()
+        return age is not None and age < max(self.ttl, self.stale_limit)
+
+    def begin_refresh(self) -> bool:
+        """True when the caller must refresh the snapshot in background, False
+        when a refresh is already running."""
+        with self.lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+            return True
+
+    def end_refresh(self) -> None:
+        with self.lock:
+            self.refreshing = False
+
+
+class ContextCache(Snapshot):
+    """The contexts of a cluster, as we saw them the last time we listed them,
+    indexed by context id, by name, and by mapped domain. The cache is
+    considered fresh for `ttl` seconds after being filled. A ttl of 0 disables
+    the cache (every lookup lists the contexts on the cluster)."""
+
+    def __init__(self, ttl: int = 0, stale_limit: int = 0):
+        super().__init__(ttl, stale_limit)
+        self.by_id: dict = {}
+        self.by_name: dict = {}
+        self.by_domain: dict = {}
+
+    def is_enabled(self) -> bool:
+        return self.ttl > 0
+
+    def fill(self, contexts: list) -> None:
+        by_id = {}
+        by_name = {}
+        by_domain = {}
+        for ctx in contexts:
+            by_id[int(ctx.cid)] = ctx
+            by_name[ctx.name] = ctx
+            for domain in ctx.domains:
+                by_domain[domain] = ctx
+        with self.lock:
+            self.by_id = by_id
+            self.by_name = by_name
+            self.by_domain = by_domain
+            self.loaded_at = time.monotonic()
+        log.info(f"Context cache filled with {len(by_id)} contexts")
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.loaded_at = None
+
+    def all(self) -> list:
+        return list(self.by_id.values())
+
+    def stats(self) -> dict:
+        return {
+            "contexts": len(self.by_id),
+            "age": self.age(),
+        }
+
+    def get(self, cid: int):
+        return self.by_id.get(int(cid))
+
+    def get_by_name(self, name: str):
+        return self.by_name.get(name)
+
+    def get_by_domain(self, domain: str):
+        return self.by_domain.get(domain)
+
+    def add(self, ctx) -> None:
+        """Write-through, when we just created a context."""
+        with self.lock:
+            self.by_id[int(ctx.cid)] = ctx
+            self.by_name[ctx.name] = ctx
+            for domain in ctx.domains:
+                self.by_domain[domain] = ctx
+
+    def add_domain(self, cid: int, domain: str):
+        """Write-through, when we just mapped a domain on a context. Returns the
+        cached context, if any."""
+        with self.lock:
+            ctx = self.by_id.get(int(cid))
+            if ctx is None:
+                return None
+            ctx.domains.add(domain)
+            self.by_domain[domain] = ctx
+            return ctx
+
+
+class UserIndex(Snapshot):
+    """The users of one context, as we saw them the last time we listed them,
+    indexed by uid, by email and by username."""
+
+    def __init__(self, ttl: int, stale_limit: int = 0):
+        super().__init__(ttl, stale_limit)
+        self.last_used = time.monotonic()
+        self.by_uid: dict = {}
+        self.by_email: dict = {}
+        self.by_username: dict = {}
+        # The users sorted by email_key, computed when first asked after a change
+        self._sorted: list | None = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def hit(self) -> None:
+        self.hits += 1
+        self.last_used = time.monotonic()
+
+    def miss(self) -> None:
+        self.misses += 1
+        self.last_used = time.monotonic()
+
+    def fill(self, users: list) -> None:
+        by_uid = {}
+        by_email = {}
+        by_username = {}
+        for user in users:
+            by_uid[int(user.uid)] = user
+            by_email[user.email] = user
+            by_username[user.username] = user
+        with self.lock:
+            self.by_uid = by_uid
+            self.by_email = by_email
+            self.by_username = by_username
+            self._sorted = None
+            self.loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    def all(self) -> list:
+        return list(self.by_uid.values())
+
+    def all_sorted(self) -> list:
+        """The users ordered by their email_key, sorted once per snapshot (the
+        list is shared, do not change it)."""
+        with self.lock:
+            if self._sorted is None:
+                self._sorted = sorted(self.by_uid.values(), key=lambda user: user.email_key())
+            return self._sorted
+
+    def add(self, user) -> None:
+        with self.lock:
+            old = self.by_uid.get(int(user.uid))
+            if old is not None:
+                self.by_email.pop(old.email, None)
+                self.by_username.pop(old.username, None)
+            self.by_uid[int(user.uid)] = user
+            self.by_email[user.email] = user
+            self.by_username[user.username] = user
+            self._sorted = None
+
+    def remove(self, user) -> None:
+        with self.lock:
+            self.by_uid.pop(int(user.uid), None)
+            self.by_email.pop(user.email, None)
+            self.by_username.pop(user.username, None)
+            self._sorted = None
+
+
+class UserIndexes:
+    """All the user indexes of a cluster, by context id. The indexes are
+    filled lazily, on the first lookup in a context, and trusted for `ttl`
+    seconds. A ttl of 0 disables the indexes."""
+
+    def __init__(self, ttl: int = 0, stale_limit: int = 0):
+        self.ttl = ttl
+        self.stale_limit = stale_limit
+        self.lock = threading.Lock()
+        self.by_cid: dict[int, UserIndex] = {}
+
+    def is_enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, cid: int) -> UserIndex:
+        with self.lock:
+            index = self.by_cid.get(int(cid))
+            if index is None:
+                index = UserIndex(self.ttl, self.stale_limit)
+                self.by_cid[int(cid)] = index
+            return index
+
+    def items(self) -> list[tuple[int, UserIndex]]:
+        with self.lock:
+            return list(self.by_cid.items())
+
+    def drop(self, cid: int) -> None:
+        with self.lock:
+            self.by_cid.pop(int(cid), None)
+
+    def stats(self) -> dict:
+        indexes = [index for _, index in self.items()]
+        return {
+            "contexts": len(indexes),
+            "users": sum(len(index.by_uid) for index in indexes),
+            "hits": sum(index.hits for index in indexes),
+            "misses": sum(index.misses for index in indexes),
+            "refreshes": sum(index.refreshes for index in indexes),
+        }
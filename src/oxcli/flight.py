@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import threading
+import typing
+
+log = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Exception | None = None
+
+
+class Flights:
+    """Single-flight of the listing commands of a cluster: when the same
+    command (by its normalised text) is already running, the callers wait for
+    it and share its parsed result, instead of running it again. The sync
+    callers (threads) and the async ones (per event loop) share separately.
+
+    A change on the cluster (`forget`) makes the next callers run the command
+    again, instead of joining a listing which started before the change."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running: dict[str, _Call] = {}
+        self.arunning: dict[tuple, asyncio.Future] = {}
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: str, fetch: typing.Callable[[], typing.Any]) -> typing.Any:
+        with self.lock:
+            call = self.running.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.running[key] = call
+                self.executions += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fetch()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.running.get(key) is call:
+                    del self.running[key]
+            call.done.set()
+
+    async def ado(
+        self, key: str, fetch: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Any:
+        loop_key = (id(asyncio.get_running_loop()), key)
+        while (future := self.arunning.get(loop_key)) is not None:
+            self.shared += 1
+            try:
+                # A caller which goes away must not cancel the others
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                # The caller which ran it went away, we run it ourselves
+                self.shared -= 1
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may wait for it: do not complain about an exception never
+        # retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.arunning[loop_key] = future
+        self.executions += 1
+        try:
+            result = await fetch()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self.arunning.get(loop_key) is future:
+                del self.arunning[loop_key]
+
+    def forget(self) -> None:
+        with self.lock:
+            self.running = {}
+            self.arunning = {}
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "saved": self.shared,
+            "running": len(self.running) + len(self.arunning),
+        }
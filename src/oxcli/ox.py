@@ -1,11 +1,26 @@
+import collections
 import csv
 import logging
 import re
+import shlex
 import subprocess
+import threading
+import typing
 
 import pydantic
 
-from .setup import get_cluster_info
+from . import age
+from .cache import ContextCache, Snapshot, UserIndex, UserIndexes
+from .flight import Flights
+from .scheduler import Scheduler
+from .setup import (
+    get_cluster_info,
+    get_context_cache,
+    get_flights,
+    get_scheduler,
+    get_user_indexes,
+)
+from .transport import SshTransport
 
 class Fake:
     # For fake clusters
@@ -23,6 +38,11 @@ class OxCluster(pydantic.BaseModel):
     name: str = "INVALID"
     ssh_url: str | None = None
     ssh_args: list[str] = []
+    _transport: SshTransport | None = pydantic.PrivateAttr(default=None)
+    _contexts: ContextCache | None = pydantic.PrivateAttr(default=None)
+    _users: UserIndexes | None = pydantic.PrivateAttr(default=None)
+    _flights: Flights | None = pydantic.PrivateAttr(default=None)
+    _scheduler: Scheduler | None = pydantic.PrivateAttr(default=None)
 
     def url(self):
         return self.ssh_url
@@ -33,10 +53,15 @@ class OxCluster(pydantic.BaseModel):
     ):
         global fake
         super().__init__()
-        (name, ssh_url, ssh_args) = get_cluster_info(name)
+        (name, ssh_url, ssh_args, transport) = get_cluster_info(name)
         self.name = name
         self.ssh_url = ssh_url
         self.ssh_args = ssh_args
+        self._transport = transport
+        self._contexts = get_context_cache(name)
+        self._users = get_user_indexes(name)
+        self._flights = get_flights(name)
+        self._scheduler = get_scheduler(name)
         if ssh_url == "FAKE":
             if fake is None:
                 fake = Fake()
@@ -124,6 +149,12 @@ class OxUser(pydantic.BaseModel):
     def is_fake(self) -> bool:
         return self.ctx.is_fake()
 
+    def email_key(self) -> tuple:
+        """The order of the users: by the local part of their email, then by
+        domain (the order of the (username, domain) key of dovecot)."""
+        (username, _, domain) = self.email.rpartition("@")
+        return (username, domain)
+
 
 log = logging.getLogger("oxcli")
 
@@ -139,88 +170,227 @@ def _purge(self: OxCluster) -> None:
     log.info("Ox server is empty")
 
 
-clean_text = re.compile("^[a-zA-Z0-9/.=_-]+$")
+def _cmd(args: list[str]) -> str:
+    """The command line, for the remote shell: each argument is quoted, when
+    needed, so that the shell gives it as is to the command."""
+    return " ".join(shlex.quote(item) for item in args)
 
 
-def __cmd(args: list[str]) -> str:
-    clean = []
-    for item in args:
-        if clean_text.match(item) is not None:
-            clean.append(item)
-            continue
-        text = "'" + item.replace("'", "\\'") + "'"
-        clean.append(text)
-    full = " ".join(clean)
-    return full
+STDERR_LINES = 100
 
 
-def _run_for_csv(self: OxCluster, command: list[str]) -> list[str]:
+def _check_cluster(self: OxCluster) -> None:
     if self.ssh_url is None:
         raise Exception("Il faut configurer OxCluster")
     if self.is_fake():
         raise Exception("Il ne faut jamais appeler SSH sur un cluster FAKE")
-    file = subprocess.Popen(
-        ["ssh"] + self.ssh_args + [self.ssh_url, __cmd(command)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    reader = csv.DictReader(file.stdout)
-    data = []
-    for elem in reader:
-        data.append(elem)
-    file.wait()
+
+
+def _command_context(command: list[str]) -> int | None:
+    """The context a command works on, to run the writes on the same context
+    one at a time."""
+    for option in ["-c", "--contextid"]:
+        if option in command[:-1]:
+            value = command[command.index(option) + 1]
+            if value.isdigit():
+                return int(value)
+    return None
+
+
+def _drain(pipe, lines: collections.deque) -> None:
+    # Reads stderr while we read stdout: if nobody reads it, the command blocks
+    # as soon as the pipe buffer is full. Only the last lines are kept.
+    for line in pipe:
+        lines.append(line)
+    pipe.close()
+
+
+def _stream_csv(self: OxCluster, command: list[str]) -> typing.Iterator[dict]:
+    """Runs the command, and yields the csv lines of its output as they come,
+    without keeping them. If the caller stops early, the command is killed."""
+    _check_cluster(self)
+    with self._scheduler.slot():
+        file = subprocess.Popen(
+            self._transport.command(_cmd(command)),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        errors = collections.deque(maxlen=STDERR_LINES)
+        drain = threading.Thread(target=_drain, args=(file.stderr, errors), daemon=True)
+        drain.start()
+        count = 0
+        done = False
+        try:
+            for elem in csv.DictReader(file.stdout):
+                count += 1
+                yield elem
+            done = True
+        finally:
+            if not done:
+                file.kill()
+            file.stdout.close()
+            file.wait()
+            drain.join()
 
     if file.returncode != 0:
         log.error(f"Failed to call {command}")
-        log.error(file.stderr.read())
+        log.error("".join(errors))
         raise Exception("Failed to run ssh command")
 
-    log.info(f"We got {len(data)} csv lines from command")
-    return data
+    log.info(f"We got {count} csv lines from command")
+
+
+def _run_for_csv(self: OxCluster, command: list[str]) -> list[dict]:
+    """Runs the command for its csv lines. The same command, asked again while
+    it runs, is run once."""
+    return list(self._flights.do(_cmd(command), lambda: list(self.stream_csv(command))))
 
 
 def _run_for_item(self: OxCluster, command: list[str]) -> str:
-    if self.ssh_url is None:
-        raise Exception("Il faut configurer OxCluster")
-    if self.is_fake():
-        raise Exception("Il ne faut jamais appeler SSH sur un cluster FAKE")
-    file = subprocess.Popen(
-        ["ssh"] + self.ssh_args + [self.ssh_url, __cmd(command)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    file.wait()
+    _check_cluster(self)
+    with self._scheduler.slot(write=True, cid=_command_context(command)):
+        file = subprocess.Popen(
+            self._transport.command(_cmd(command)),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        (output, errors) = file.communicate()
+    # The listings which ran during the change must not be shared any more
+    self._flights.forget()
 
     if file.returncode != 0:
         log.error(f"Failed to call {command}")
-        log.error(file.stderr.read())
+        log.error(errors)
         raise Exception("Failed to run ssh command")
 
     log.info("Command success")
-    return file.stdout.read()
+    return output
+
+
+def _run_script(self: OxCluster, script: str, cid: int | None = None) -> str:
+    """Runs a shell script on the cluster, in a single ssh session. The script
+    goes on stdin, there is no limit on its size. `cid` is the context the
+    script changes, if any."""
+    _check_cluster(self)
+    with self._scheduler.slot(write=True, cid=cid):
+        file = subprocess.Popen(
+            self._transport.command("sh -s"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        (output, errors) = file.communicate(script)
+    self._flights.forget()
+
+    if file.returncode != 0:
+        log.error("Failed to run a script")
+        log.error(errors)
+        raise Exception("Failed to run ssh command")
 
+    log.info("Script success")
+    return output
 
-def _list_contexts(self: OxCluster) -> [OxContext]:
+
+def _listcontext_command(self: OxCluster) -> list[str]:
+    return [
+        "/opt/open-xchange/sbin/listcontext",
+        "-A",
+        self.master_username,
+        "-P",
+        self.master_password,
+        "--csv",
+    ]
+
+
+def _stream_contexts(self: OxCluster) -> typing.Iterator[OxContext]:
+    """Yields the contexts of the cluster as they are listed, never from the
+    cache."""
+    if self.is_fake():
+        yield from list(fake.by_id.values())
+        return
+    for line in self.stream_csv(_listcontext_command(self)):
+        yield OxContext.read_from_csv(self, line)
+
+
+def _fetch_contexts(self: OxCluster) -> list[OxContext]:
+    # The callers listing the contexts at the same time share one listcontext
+    command = _cmd(_listcontext_command(self))
+    age.observe(0)
+    return list(self._flights.do(command, lambda: list(self.stream_contexts())))
+
+
+def _revalidate(snapshot: Snapshot, what: str, refill: typing.Callable[[], None]):
+    """Refills a stale snapshot in a background thread, unless it is already
+    being refilled."""
+    if not snapshot.begin_refresh():
+        return
+
+    def run():
+        try:
+            refill()
+        except Exception as e:
+            log.error(f"Failed to refresh {what}: {e}")
+        finally:
+            snapshot.end_refresh()
+
+    threading.Thread(target=run, name=f"oxcli-revalidate-{what}", daemon=True).start()
+
+
+def _cached_contexts(self: OxCluster) -> ContextCache | None:
+    """Returns the context cache of the cluster, or None when the cache is
+    disabled. A stale cache, still usable, is returned as is, and refilled in
+    background."""
+    cache = self._contexts
+    if cache is None or not cache.is_enabled():
+        return None
+    if cache.is_fresh():
+        pass
+    elif cache.is_usable():
+        _revalidate(cache, self.name, lambda: _refill_contexts(self, cache))
+    else:
+        _refill_contexts(self, cache)
+    age.observe(cache.age())
+    return cache
+
+
+def _lookup(snapshot: Snapshot, lookup: typing.Callable, refill: typing.Callable[[], None]):
+    """Looks up in a snapshot. A miss in a stale snapshot is not trusted, what
+    we look for may have been created since: we wait for a new listing (it
+    joins the background refill, if any), and look again."""
+    found = lookup()
+    if found is None and not snapshot.is_fresh():
+        refill()
+        found = lookup()
+    return found
+
+
+def _refill_contexts(self: OxCluster, cache: ContextCache) -> None:
+    cache.fill(_fetch_contexts(self))
+
+
+def _refresh_contexts(self: OxCluster) -> list[OxContext]:
+    """Lists the contexts on the cluster, whatever the state of the cache,
+    and refills the cache."""
     if self.is_fake():
         return list(fake.by_id.values())
-    data = self.run_for_csv(
-        [
-            "/opt/open-xchange/sbin/listcontext",
-            "-A",
-            self.master_username,
-            "-P",
-            self.master_password,
-            "--csv",
-        ]
-    )
-    res = []
-    for line in data:
-        ctx = OxContext.read_from_csv(self, line)
-        res.append(ctx)
+    contexts = _fetch_contexts(self)
+    if self._contexts is not None and self._contexts.is_enabled():
+        self._contexts.fill(contexts)
+    return contexts
 
-    return res
+
+def _list_contexts(self: OxCluster) -> [OxContext]:
+    if self.is_fake():
+        return list(fake.by_id.values())
+    cache = _cached_contexts(self)
+    if cache is not None:
+        return cache.all()
+    return _fetch_contexts(self)
 
 
 def _get_context(self: OxCluster, cid: int) -> OxContext | None:
@@ -229,8 +399,13 @@ def _get_context(self: OxCluster, cid: int) -> OxContext | None:
         if cid in fake.by_id:
             return fake.by_id[cid]
         return None
-    all_contexts = self.list_contexts()
-    for ctx in all_contexts:
+    cache = _cached_contexts(self)
+    if cache is not None:
+        return _lookup(
+            cache, lambda: cache.get(cid), lambda: _refill_contexts(self, cache)
+        )
+    # The lookups at the same time share one listcontext
+    for ctx in _fetch_contexts(self):
         if ctx.cid == cid:
             return ctx
     return None
@@ -241,8 +416,13 @@ def _get_context_by_name(self: OxCluster, name: str) -> OxContext | None:
         if name in fake.by_name:
             return fake.by_name[name]
         return None
-    all_contexts = self.list_contexts()
-    for ctx in all_contexts:
+    cache = _cached_contexts(self)
+    if cache is not None:
+        return _lookup(
+            cache, lambda: cache.get_by_name(name), lambda: _refill_contexts(self, cache)
+        )
+    # The lookups at the same time share one listcontext
+    for ctx in _fetch_contexts(self):
         if ctx.name == name:
             return ctx
     return None
@@ -253,8 +433,13 @@ def _get_context_by_domain(self: OxCluster, domain: str) -> OxContext | None:
         if domain in fake.by_domain:
             return fake.by_domain[domain]
         return None
-    all_contexts = self.list_contexts()
-    for ctx in all_contexts:
+    cache = _cached_contexts(self)
+    if cache is not None:
+        return _lookup(
+            cache, lambda: cache.get_by_domain(domain), lambda: _refill_contexts(self, cache)
+        )
+    # The lookups at the same time share one listcontext
+    for ctx in _fetch_contexts(self):
         if domain in ctx.domains:
             return ctx
     return None
@@ -287,42 +472,46 @@ def __cmd_create_context(
         res.by_username["admin_user"] = user
         res.by_username.pop("oxadmin")
         return
-    self.run_for_item(
-        [
-            "/opt/open-xchange/sbin/createcontext",
-            "-A",
-            self.master_username,
-            "-P",
-            self.master_password,
-            "--contextid",
-            f"{cid}",
-            "--contextname",
-            name,
-            "--addmapping",
-            domain,
-            "--quota",
-            "1024",
-            "--access-combination-name=groupware_standard",
-            "--language=fr_FR",
-            "--username",
-            self.admin_username,
-            "--password",
-            self.admin_password,
-            "--displayname",
-            "Context Admin",
-            "--givenname",
-            "Admin",
-            "--surname",
-            "Context",
-            "--email",
-            f"oxadmin@{domain}",
-        ]
-    )
+    self.run_for_item(_createcontext_command(self, cid, name, domain))
 
-def _create_context(
-    self: OxCluster, cid: int | None, name: str, domain: str
-) -> OxContext:
-    all_contexts = self.list_contexts()
+
+def _createcontext_command(self: OxCluster, cid: int, name: str, domain: str) -> list[str]:
+    return [
+        "/opt/open-xchange/sbin/createcontext",
+        "-A",
+        self.master_username,
+        "-P",
+        self.master_password,
+        "--contextid",
+        f"{cid}",
+        "--contextname",
+        name,
+        "--addmapping",
+        domain,
+        "--quota",
+        "1024",
+        "--access-combination-name=groupware_standard",
+        "--language=fr_FR",
+        "--username",
+        self.admin_username,
+        "--password",
+        self.admin_password,
+        "--displayname",
+        "Context Admin",
+        "--givenname",
+        "Admin",
+        "--surname",
+        "Context",
+        "--email",
+        f"oxadmin@{domain}",
+    ]
+
+
+def _new_context_id(
+    all_contexts: list[OxContext], cid: int | None, name: str, domain: str
+) -> int:
+    """Checks the new context does not collide with the existing ones, and
+    chooses its id when none is provided."""
     max_id = 0
     for ctx in all_contexts:
         if cid is not None and ctx.cid == cid:
@@ -337,7 +526,30 @@ def _create_context(
             max_id = ctx.cid
     if cid is None:
         cid = max_id + 1
+    return cid
+
+
+def _created_context(
+    self: OxCluster, cache: ContextCache | None, cid: int, name: str, domain: str
+) -> OxContext | None:
+    """When the cache is enabled, puts the context we just created in it and
+    returns it: the command did not fail, so the context exists, no need to
+    list the contexts again to find it."""
+    if cache is None:
+        return None
+    ctx = OxContext(cid=cid, name=name, domains=[domain], cluster=self)
+    cache.add(ctx)
+    return ctx
+
+
+def _create_context(
+    self: OxCluster, cid: int | None, name: str, domain: str
+) -> OxContext:
+    cid = _new_context_id(self.list_contexts(), cid, name, domain)
     __cmd_create_context(self, cid, name, domain)
+    ctx = _created_context(self, _cached_contexts(self), cid, name, domain)
+    if ctx is not None:
+        return ctx
     ctx = self.get_context(cid)
     if ctx is None:
         raise Exception(
@@ -372,22 +584,42 @@ def __add_mapping(self: OxContext, domain: str) -> OxContext:
         fake.by_domain[domain] = self
         self.domains.add(domain)
         return self
-    self.cluster.run_for_item(
-        [
-            "/opt/open-xchange/sbin/changecontext",
-            "-A",
-            self.cluster.master_username,
-            "-P",
-            self.cluster.master_password,
-            "--contextid",
-            f"{self.cid}",
-            "--addmapping",
-            domain,
-        ]
-    )
+    self.cluster.run_for_item(_changecontext_command(self, domain))
+    ctx = _mapped_domain(self, _cached_contexts(self.cluster), domain)
+    if ctx is not None:
+        return ctx
     return self.cluster.get_context(self.cid)
 
 
+def _changecontext_command(self: OxContext, domain: str) -> list[str]:
+    return [
+        "/opt/open-xchange/sbin/changecontext",
+        "-A",
+        self.cluster.master_username,
+        "-P",
+        self.cluster.master_password,
+        "--contextid",
+        f"{self.cid}",
+        "--addmapping",
+        domain,
+    ]
+
+
+def _mapped_domain(
+    self: OxContext, cache: ContextCache | None, domain: str
+) -> OxContext | None:
+    """When the cache is enabled, records in it the domain we just mapped on
+    the context, and returns the up to date context."""
+    if cache is None:
+        return None
+    self.domains.add(domain)
+    ctx = cache.add_domain(self.cid, domain)
+    if ctx is None:
+        cache.add(self)
+        ctx = self
+    return ctx
+
+
 def _username_exists(self: OxContext, username: str) -> bool:
     if self.is_fake():
         if username in self.by_username:
@@ -458,42 +690,55 @@ def __cmd_create_user(
         self.by_displayname[displayName] = user
         return
     self.cluster.run_for_item(
-        [
-            "/opt/open-xchange/sbin/createuser",
-            "-A",
-            self.cluster.admin_username,
-            "-P",
-            self.cluster.admin_password,
-            "-c",
-            f"{self.cid}",
-            "--username",
-            username,
-            "--password",
-            "useless",
-            "--givenname",
-            givenName,
-            "--surname",
-            surName,
-            "--displayname",
-            displayName,
-            "--email",
-            email,
-            "--language",
-            "fr_FR",
-            "--timezone",
-            "Europe/Paris",
-        ]
+        _createuser_command(self, username, givenName, surName, displayName, email)
     )
 
-def _create_user(
+
+def _createuser_command(
     self: OxContext,
+    username: str,
+    givenName: str,
+    surName: str,
+    displayName: str,
+    email: str,
+) -> list[str]:
+    return [
+        "/opt/open-xchange/sbin/createuser",
+        "-A",
+        self.cluster.admin_username,
+        "-P",
+        self.cluster.admin_password,
+        "-c",
+        f"{self.cid}",
+        "--username",
+        username,
+        "--password",
+        "useless",
+        "--givenname",
+        givenName,
+        "--surname",
+        surName,
+        "--displayname",
+        displayName,
+        "--email",
+        email,
+        "--language",
+        "fr_FR",
+        "--timezone",
+        "Europe/Paris",
+    ]
+
+
+def _new_user_names(
     surName: str,
     givenName: str,
     displayName: str | None = None,
     email: str | None = None,
     username: str | None = None,
     domain: str | None = None,
-) -> OxUser:
+) -> tuple[str, str, str]:
+    """Checks the names provided for a new user, returns its username, its
+    email and its display name."""
     if email is None and username is not None and domain is not None:
         email = username + "@" + domain
     elif username is None and domain is None and email is not None:
@@ -506,6 +751,33 @@ def _create_user(
         displayName = " ".join([givenName, surName])
     if displayName is None:
         raise Exception("displayName is mandatory")
+    return (username, email, displayName)
+
+
+def _created_user(self: OxContext, users: list[OxUser], username: str) -> OxUser:
+    """Finds the user we just created in the result of a search, and puts it
+    in the user index."""
+    user = _find_user(users, username)
+    if user is None:
+        raise Exception("user seems created, but fail to get it")
+    index = _loaded_user_index(self)
+    if index is not None:
+        index.add(user)
+    return user
+
+
+def _create_user(
+    self: OxContext,
+    surName: str,
+    givenName: str,
+    displayName: str | None = None,
+    email: str | None = None,
+    username: str | None = None,
+    domain: str | None = None,
+) -> OxUser:
+    (username, email, displayName) = _new_user_names(
+        surName, givenName, displayName, email, username, domain
+    )
     __cmd_create_user(self,
         username=username,
         givenName=givenName,
@@ -513,32 +785,228 @@ def _create_user(
         displayName=displayName,
         email=email
     )
-    user = self.get_user_by_name(username)
-    if user is None:
-        raise Exception("user seems created, but fail to get it")
-    return user
+    # Even with an index, we need to ask for the new user: we don't know its uid
+    return _created_user(self, self.search_user(username), username)
+
+
+BATCH_MARK = "@@dimail@@"
+# The marker, at the end of a line: the output of the command before it may
+# not end with a newline
+BATCH_MARK_LINE = re.compile(f"^(.*){BATCH_MARK} (\\d+) (\\d+)$")
+
+
+def _batch_commands(
+    self: OxContext, users: list[dict]
+) -> tuple[list[str | Exception], list[list[str]]]:
+    """The createuser commands for a batch of users (given as the keyword
+    arguments of create_user). Returns, for each user, its username, or the
+    Exception if its names are not valid, and the commands of the valid ones."""
+    results = []
+    commands = []
+    for user in users:
+        try:
+            (username, email, displayName) = _new_user_names(**user)
+        except Exception as e:
+            results.append(e)
+            continue
+        results.append(username)
+        commands.append(
+            _createuser_command(
+                self, username, user["givenName"], user["surName"], displayName, email
+            )
+        )
+    return (results, commands)
+
+
+def _batch_script(commands: list[list[str]]) -> str:
+    """A shell script running all the commands, one after the other, each one
+    followed by a marker line with its index and its exit status. The commands
+    must not read their stdin, it is the script itself."""
+    lines = []
+    for i, command in enumerate(commands):
+        lines.append(f'{_cmd(command)} </dev/null 2>&1; echo "{BATCH_MARK} {i} $?"')
+    return "\n".join(lines) + "\n"
+
+
+def _read_batch_output(output: str, count: int) -> list[str | None]:
+    """For each command of a batch script, None when it succeeded, or its
+    output when it failed."""
+    statuses = ["The command was not run"] * count
+    pending = []
+    for line in output.splitlines():
+        mark = BATCH_MARK_LINE.match(line)
+        if mark is None:
+            pending.append(line)
+            continue
+        (before, i, status) = mark.groups()
+        pending.append(before)
+        text = "\n".join(pending).strip()
+        statuses[int(i)] = None if status == "0" else text or f"exit status {status}"
+        pending = []
+    return statuses
+
+
+def _batch_results(
+    self: OxContext,
+    results: list[str | Exception],
+    statuses: list[str | None],
+    listed: dict[str, OxUser],
+) -> list[OxUser | Exception]:
+    index = _loaded_user_index(self)
+    statuses = iter(statuses)
+    final = []
+    for result in results:
+        if isinstance(result, Exception):
+            final.append(result)
+            continue
+        status = next(statuses)
+        if status is not None:
+            final.append(Exception(status))
+            continue
+        user = listed.get(result)
+        if user is None:
+            final.append(Exception("user seems created, but fail to get it"))
+            continue
+        if index is not None:
+            index.add(user)
+        final.append(user)
+    return final
+
+
+def _create_users(self: OxContext, users: list[dict]) -> list[OxUser | Exception]:
+    """Creates many users at once: all the createuser commands run in a single
+    ssh session, and then we list the users of the context once. `users` are
+    the keyword arguments of create_user. Returns, for each user, the new
+    OxUser, or the Exception explaining why it was not created."""
+    if self.is_fake():
+        final = []
+        for user in users:
+            try:
+                final.append(self.create_user(**user))
+            except Exception as e:
+                final.append(e)
+        return final
+    (results, commands) = _batch_commands(self, users)
+    statuses = []
+    listed = {}
+    if commands:
+        output = self.cluster.run_script(_batch_script(commands), self.cid)
+        statuses = _read_batch_output(output, len(commands))
+        listed = {user.username: user for user in self.stream_users()}
+    return _batch_results(self, results, statuses, listed)
+
+
+def _listuser_command(self: OxContext, search: str | None = None) -> list[str]:
+    command = [
+        "/opt/open-xchange/sbin/listuser",
+        "-A",
+        self.cluster.admin_username,
+        "-P",
+        self.cluster.admin_password,
+        "-c",
+        f"{self.cid}",
+    ]
+    if search is not None:
+        command.extend(["-s", search])
+    command.append("--csv")
+    return command
+
+
+def _read_users(self: OxContext, data: typing.Iterable[dict]) -> typing.Iterator[OxUser]:
+    for line in data:
+        yield OxUser.read_from_csv(self, line)
+
+
+def _stream_users(self: OxContext, search: str | None = None) -> typing.Iterator[OxUser]:
+    """Yields the users of the context (or the ones matching `search`) as they
+    are listed, never from the index. Memory stays bounded whatever the size
+    of the context."""
+    if self.is_fake():
+        if search is None:
+            yield from list(self.by_id.values())
+        elif search in self.by_username:
+            yield self.by_username[search]
+        return
+    yield from _read_users(self, self.cluster.stream_csv(_listuser_command(self, search)))
+
+
+def _fetch_users(self: OxContext) -> list[OxUser]:
+    # The callers listing the users at the same time share one listuser
+    command = _cmd(_listuser_command(self))
+    age.observe(0)
+    return list(self.cluster._flights.do(command, lambda: list(self.stream_users())))
+
+
+def _enabled_user_index(self: OxContext) -> UserIndex | None:
+    indexes = self.cluster._users
+    if self.is_fake() or indexes is None or not indexes.is_enabled():
+        return None
+    return indexes.get(self.cid)
+
+
+def _user_index(self: OxContext) -> UserIndex | None:
+    """Returns the user index of the context, filled, or None when the indexes
+    are disabled. A stale index, still usable, is returned as is, and refilled
+    in background."""
+    index = _enabled_user_index(self)
+    if index is None:
+        return None
+    if index.is_fresh():
+        index.hit()
+    elif index.is_usable():
+        index.hit()
+        what = f"{self.cluster.name}-{self.cid}"
+        _revalidate(index, what, lambda: index.fill(_fetch_users(self)))
+    else:
+        _refill_users(self, index)
+    age.observe(index.age())
+    return index
+
+
+def _refill_users(self: OxContext, index: UserIndex) -> None:
+    index.miss()
+    index.fill(_fetch_users(self))
+
+
+def _loaded_user_index(self: OxContext) -> UserIndex | None:
+    """Returns the user index of the context, if it is enabled and filled, so
+    that we can update it after a change. Never lists the users."""
+    index = _enabled_user_index(self)
+    if index is None or index.loaded_at is None:
+        return None
+    return index
+
+
+def _refresh_users(self: OxContext) -> list[OxUser]:
+    """Lists the users on the cluster, whatever the state of the index, and
+    refills the index."""
+    if self.is_fake():
+        return list(self.by_id.values())
+    users = _fetch_users(self)
+    index = _enabled_user_index(self)
+    if index is not None:
+        index.fill(users)
+    return users
 
 
 def _list_users(self: OxContext) -> list[OxUser]:
     if self.is_fake():
         return list(self.by_id.values())
-    data = self.cluster.run_for_csv(
-        [
-            "/opt/open-xchange/sbin/listuser",
-            "-A",
-            self.cluster.admin_username,
-            "-P",
-            self.cluster.admin_password,
-            "-c",
-            f"{self.cid}",
-            "--csv",
-        ]
-    )
-    res = []
-    for line in data:
-        user = OxUser.read_from_csv(self, line)
-        res.append(user)
-    return res
+    index = _user_index(self)
+    if index is not None:
+        return index.all()
+    return _fetch_users(self)
+
+
+def _list_sorted_users(self: OxContext) -> list[OxUser]:
+    """The users, ordered by OxUser.email_key. With the user index, the users
+    are sorted once per snapshot of the index."""
+    if self.is_fake():
+        return sorted(self.by_id.values(), key=OxUser.email_key)
+    index = _user_index(self)
+    if index is not None:
+        return index.all_sorted()
+    return sorted(_fetch_users(self), key=OxUser.email_key)
 
 
 def _search_user(self: OxContext, username: str) -> list[OxUser]:
@@ -546,25 +1014,14 @@ def _search_user(self: OxContext, username: str) -> list[OxUser]:
         if username in self.by_username:
             return [ self.by_username[username] ]
         return []
-    data = self.cluster.run_for_csv(
-        [
-            "/opt/open-xchange/sbin/listuser",
-            "-A",
-            self.cluster.admin_username,
-            "-P",
-            self.cluster.admin_password,
-            "-c",
-            f"{self.cid}",
-            "-s",
-            username,
-            "--csv",
-        ]
-    )
-    res = []
-    for line in data:
-        user = OxUser.read_from_csv(self, line)
-        res.append(user)
-    return res
+    return list(self.stream_users(username))
+
+
+def _find_user(users: typing.Iterable[OxUser], username: str) -> OxUser | None:
+    for user in users:
+        if user.username == username:
+            return user
+    return None
 
 
 def _get_user_by_name(self: OxContext, username: str) -> OxUser | None:
@@ -572,11 +1029,12 @@ def _get_user_by_name(self: OxContext, username: str) -> OxUser | None:
         if username in self.by_username:
             return self.by_username[username]
         return None
-    all_users = self.search_user(username)
-    for user in all_users:
-        if user.username == username:
-            return user
-    return None
+    index = _user_index(self)
+    if index is not None:
+        return _lookup(
+            index, lambda: index.by_username.get(username), lambda: _refill_users(self, index)
+        )
+    return _find_user(self.search_user(username), username)
 
 
 def _get_user_by_email(self: OxContext, email: str) -> OxUser | None:
@@ -584,8 +1042,16 @@ def _get_user_by_email(self: OxContext, email: str) -> OxUser | None:
         if email in self.by_email:
             return self.by_email[email]
         return None
-    all_users = self.list_users()
-    for user in all_users:
+    index = _user_index(self)
+    if index is not None:
+        return _lookup(
+            index, lambda: index.by_email.get(email), lambda: _refill_users(self, index)
+        )
+    return _find_user_by_email(self.stream_users(), email)
+
+
+def _find_user_by_email(users: typing.Iterable[OxUser], email: str) -> OxUser | None:
+    for user in users:
         if user.email == email:
             return user
     return None
@@ -607,6 +1073,17 @@ def _change_user(
             self.displayName = displayName
             self.ctx.by_displayname[displayName] = self
         return
+    command = _changeuser_command(self, givenName, surName, displayName)
+    _ = self.ctx.cluster.run_for_item(command)
+    _changed_user(self, givenName, surName, displayName)
+
+
+def _changeuser_command(
+    self: OxUser,
+    givenName: str | None = None,
+    surName: str | None = None,
+    displayName: str | None = None,
+) -> list[str]:
     command = [
         "/opt/open-xchange/sbin/changeuser",
         "-A",
@@ -624,7 +1101,25 @@ def _change_user(
         command.extend(["--surname", surName])
     if displayName is not None:
         command.extend(["--displayname", displayName])
-    _ = self.ctx.cluster.run_for_item(command)
+    return command
+
+
+def _changed_user(
+    self: OxUser,
+    givenName: str | None = None,
+    surName: str | None = None,
+    displayName: str | None = None,
+) -> None:
+    """Once the change is done in OX, updates the user and the user index."""
+    if givenName is not None:
+        self.givenName = givenName
+    if surName is not None:
+        self.surName = surName
+    if displayName is not None:
+        self.displayName = displayName
+    index = _loaded_user_index(self.ctx)
+    if index is not None:
+        index.add(self)
 
 
 def _delete_user(
@@ -636,7 +1131,12 @@ def _delete_user(
         self.ctx.by_displayname.pop(self.displayName)
         self.ctx.by_email.pop(self.email)
         return
-    command = [
+    _ = self.ctx.cluster.run_for_item(_deleteuser_command(self))
+    _deleted_user(self)
+
+
+def _deleteuser_command(self: OxUser) -> list[str]:
+    return [
         "/opt/open-xchange/sbin/deleteuser",
         "-A",
         self.ctx.cluster.admin_username,
@@ -647,13 +1147,23 @@ def _delete_user(
         "-u",
         self.username,
     ]
-    _ = self.ctx.cluster.run_for_item(command)
+
+
+def _deleted_user(self: OxUser) -> None:
+    """Once the user is deleted in OX, removes it from the user index."""
+    index = _loaded_user_index(self.ctx)
+    if index is not None:
+        index.remove(self)
 
 OxCluster.purge = _purge
+OxCluster.stream_csv = _stream_csv
 OxCluster.run_for_csv = _run_for_csv
 OxCluster.run_for_item = _run_for_item
+OxCluster.run_script = _run_script
 
+OxCluster.stream_contexts = _stream_contexts
 OxCluster.list_contexts = _list_contexts
+OxCluster.refresh_contexts = _refresh_contexts
 OxCluster.get_context = _get_context
 OxCluster.get_context_by_name = _get_context_by_name
 OxCluster.get_context_by_domain = _get_context_by_domain
@@ -662,7 +1172,11 @@ OxCluster.add_mapping = _add_mapping
 
 OxContext.add_mapping = __add_mapping
 OxContext.create_user = _create_user
+OxContext.create_users = _create_users
+OxContext.stream_users = _stream_users
 OxContext.list_users = _list_users
+OxContext.list_sorted_users = _list_sorted_users
+OxContext.refresh_users = _refresh_users
 OxContext.search_user = _search_user
 
 OxContext.get_user_by_name = _get_user_by_name
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+
+from .ox import OxCluster
+from .setup import get_user_indexes, list_clusters
+
+log = logging.getLogger(__name__)
+
+# An index nobody looked at for that many ttls is dropped, instead of being
+# refreshed forever.
+IDLE_TTLS = 10
+
+refreshers: list["Refresher"] = []
+
+
+class Refresher(threading.Thread):
+    """Refreshes, in background, the user indexes of a cluster, before they
+    expire, so that the requests do not have to list the users."""
+
+    def __init__(self, name: str, ttl: int):
+        super().__init__(name=f"oxcli-refresh-{name}", daemon=True)
+        self.cluster_name = name
+        self.ttl = ttl
+        self.stopping = threading.Event()
+
+    def run(self):
+        interval = max(self.ttl / 2, 1)
+        while not self.stopping.wait(interval):
+            try:
+                self.refresh_once()
+            except Exception as e:
+                log.error(f"Failed to refresh the user indexes of {self.cluster_name}: {e}")
+
+    def refresh_once(self):
+        cluster = OxCluster(self.cluster_name)
+        for cid, index in cluster._users.items():
+            if time.monotonic() - index.last_used > IDLE_TTLS * self.ttl:
+                log.info(f"Dropping the idle user index of context {cid}")
+                cluster._users.drop(cid)
+                continue
+            age = index.age()
+            if age is None or age < self.ttl / 2:
+                # Never filled (nobody looked for a user yet), or still fresh
+                continue
+            ctx = cluster.get_context(cid)
+            if ctx is None:
+                log.info(f"Context {cid} disappeared, dropping its user index")
+                cluster._users.drop(cid)
+                continue
+            ctx.refresh_users()
+            log.info(f"Refreshed the user index of context {cid}")
+
+    def stop(self):
+        self.stopping.set()
+
+
+def start_refresh():
+    """Starts a background refresher for each cluster with user indexes."""
+    for name in list_clusters():
+        indexes = get_user_indexes(name)
+        if not indexes.is_enabled():
+            continue
+        refresher = Refresher(name, indexes.ttl)
+        refresher.start()
+        refreshers.append(refresher)
+
+
+def stop_refresh():
+    while refreshers:
+        refresher = refreshers.pop()
+        refresher.stop()
+        refresher.join()
@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import contextlib
+import threading
+import time
+import typing
+
+
+class _Waiter:
+    def __init__(self, write: bool, cid: int | None, wake: typing.Callable[[], None]):
+        self.write = write
+        self.cid = cid
+        self.wake = wake
+        self.queued_at = time.monotonic()
+        self.granted = False
+
+
+class Scheduler:
+    """Decides when the ssh commands of a cluster run. At most `limit`
+    commands run at the same time (no limit when it is 0), the others wait in
+    line. The reads (the listings) go before the writes, but no more than
+    `read_burst` of them in a row while a write waits: the writes are never
+    starved by a steady flow of listings. The writes on the same context run
+    one at a time, in the order they came: two createuser on one context never
+    collide. The sync callers (threads) and the async ones share the same
+    slots."""
+
+    def __init__(self, limit: int = 0, read_burst: int = 4):
+        self.limit = limit
+        self.read_burst = read_burst
+        # The reads which went before a waiting write, since the last write
+        self.reads_in_a_row = 0
+        self.lock = threading.Lock()
+        self.running = 0
+        # The contexts with a write running
+        self.busy: set[int] = set()
+        self.reads: collections.deque[_Waiter] = collections.deque()
+        self.writes: collections.deque[_Waiter] = collections.deque()
+        self.commands = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _next(self) -> _Waiter | None:
+        write = None
+        for waiter in self.writes:
+            if waiter.cid is None or waiter.cid not in self.busy:
+                write = waiter
+                break
+        if write is None:
+            self.reads_in_a_row = 0
+            return self.reads.popleft() if self.reads else None
+        if self.reads and self.reads_in_a_row < self.read_burst:
+            self.reads_in_a_row += 1
+            return self.reads.popleft()
+        self.reads_in_a_row = 0
+        self.writes.remove(write)
+        return write
+
+    def _dispatch(self) -> None:
+        # Called with the lock held
+        while self.limit <= 0 or self.running < self.limit:
+            waiter = self._next()
+            if waiter is None:
+                return
+            self.running += 1
+            if waiter.write and waiter.cid is not None:
+                self.busy.add(waiter.cid)
+            waiter.granted = True
+            wait = time.monotonic() - waiter.queued_at
+            self.commands += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+            waiter.wake()
+
+    def _enqueue(self, waiter: _Waiter) -> None:
+        with self.lock:
+            (self.writes if waiter.write else self.reads).append(waiter)
+            self._dispatch()
+            if not waiter.granted:
+                self.waited += 1
+
+    def _release(self, waiter: _Waiter) -> None:
+        with self.lock:
+            self.running -= 1
+            if waiter.write and waiter.cid is not None:
+                self.busy.discard(waiter.cid)
+            self._dispatch()
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """The waiter went away: leaves the line, or gives its slot back if it
+        got one in the meantime."""
+        with self.lock:
+            if not waiter.granted:
+                (self.writes if waiter.write else self.reads).remove(waiter)
+                return
+        self._release(waiter)
+
+    @contextlib.contextmanager
+    def slot(self, write: bool = False, cid: int | None = None) -> typing.Iterator[None]:
+        """Waits for the right to run a command, for the duration of the
+        block. `cid` is the context a write changes."""
+        granted = threading.Event()
+        waiter = _Waiter(write, cid, granted.set)
+        self._enqueue(waiter)
+        granted.wait()
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    @contextlib.asynccontextmanager
+    async def aslot(
+        self, write: bool = False, cid: int | None = None
+    ) -> typing.AsyncIterator[None]:
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            # The slot may be given by another thread
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        waiter = _Waiter(write, cid, wake)
+        self._enqueue(waiter)
+        try:
+            await granted
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "running": self.running,
+                "queued_reads": len(self.reads),
+                "queued_writes": len(self.writes),
+                "commands": self.commands,
+                "waited": self.waited,
+                "wait_time": self.wait_time,
+                "max_wait": self.max_wait,
+            }
@@ -1,3 +1,8 @@
+from .cache import ContextCache, UserIndexes
+from .flight import Flights
+from .scheduler import Scheduler
+from .transport import SshTransport
+
 default_cluster = None
 clusters = {}
 
@@ -35,7 +40,24 @@ def declare_cluster(
     name: str,
     ssh_url: str,
     ssh_args: list[str] = [],
+    ssh_pool: int = 0,
+    ssh_persist: int = 600,
+    context_ttl: int = 0,
+    user_ttl: int = 0,
+    stale_limit: int = 0,
+    max_commands: int = 0,
 ):
+    """Declares a cluster. With `ssh_pool` > 0, we keep that many ssh
+    connections open to the cluster (for `ssh_persist` seconds after their
+    last use), and the commands are multiplexed on them. With `context_ttl` > 0,
+    the list of the contexts of the cluster is cached for that many seconds.
+    With `user_ttl` > 0, the users of each context are indexed in memory, and
+    the index is trusted for that many seconds. With `stale_limit` above the
+    ttls, a cached listing older than its ttl is still served, up to that age,
+    while it is refreshed in background. The same listing, asked again
+    while it runs, is run once (see flight.Flights). With `max_commands` > 0,
+    at most that many ssh commands run at the same time on the cluster (see
+    scheduler.Scheduler)."""
     global clusters
     if name in clusters:
         raise Exception(f"Cluster {name} already declared")
@@ -43,6 +65,11 @@ def declare_cluster(
     clusters[name] = {
         "url": ssh_url,
         "args": ssh_args,
+        "transport": SshTransport(ssh_url, ssh_args, ssh_pool, ssh_persist),
+        "contexts": ContextCache(context_ttl, stale_limit),
+        "users": UserIndexes(user_ttl, stale_limit),
+        "flights": Flights(),
+        "scheduler": Scheduler(max_commands),
     }
 
 
@@ -64,4 +91,68 @@ def get_cluster_info(name: str | None = None):
     if name not in clusters:
         raise Exception(f"The cluster {name} does not exist")
 
-    return (name, clusters[name]["url"], clusters[name]["args"])
+    return (
+        name,
+        clusters[name]["url"],
+        clusters[name]["args"],
+        clusters[name]["transport"],
+    )
+
+
+def get_context_cache(name: str) -> ContextCache:
+    if name not in clusters:
+        raise Exception(f"The cluster {name} does not exist")
+
+    return clusters[name]["contexts"]
+
+
+def get_user_indexes(name: str) -> UserIndexes:
+    if name not in clusters:
+        raise Exception(f"The cluster {name} does not exist")
+
+    return clusters[name]["users"]
+
+
+def get_flights(name: str) -> Flights:
+    if name not in clusters:
+        raise Exception(f"The cluster {name} does not exist")
+
+    return clusters[name]["flights"]
+
+
+def get_scheduler(name: str) -> Scheduler:
+    if name not in clusters:
+        raise Exception(f"The cluster {name} does not exist")
+
+    return clusters[name]["scheduler"]
+
+
+def list_clusters() -> list[str]:
+    return list(clusters.keys())
+
+
+def get_cluster_stats() -> dict:
+    """What our caches know about each cluster, for the metrics."""
+    return {
+        name: {
+            "contexts": cluster["contexts"].stats(),
+            "users": cluster["users"].stats(),
+            "flights": cluster["flights"].stats(),
+            "scheduler": cluster["scheduler"].stats(),
+        }
+        for name, cluster in clusters.items()
+    }
+
+
+def warm_clusters():
+    """Opens the persistent ssh connections of all the declared clusters, in
+    background."""
+    for cluster in clusters.values():
+        if cluster["url"] != "FAKE":
+            cluster["transport"].start_warm()
+
+
+def close_clusters():
+    """Closes the persistent ssh connections of all the declared clusters."""
+    for cluster in clusters.values():
+        cluster["transport"].close()
@@ -1,3 +1,5 @@
+import subprocess
+
 import pytest
 
 from .. import oxcli
@@ -20,19 +22,70 @@ def test_setup():
     assert "Cluster essai already declared" in str(e.value)
 
     with pytest.raises(Exception) as e:
-        name, url, args = oxcli.get_cluster_info()
+        name, url, args, transport = oxcli.get_cluster_info()
         print(f"J'ai trouve le cluster {name} sur l'url {url}")
     assert "no default" in str(e.value)
 
-    name, url, args = oxcli.get_cluster_info("essai")
+    name, url, args, transport = oxcli.get_cluster_info("essai")
     assert name == "essai"
     assert url == "url"
+    assert not transport.is_multiplexed()
+    assert transport.command("ls") == ["ssh", "url", "ls"]
 
     oxcli.set_default_cluster("essai")
-    name, url, args = oxcli.get_cluster_info()
+    name, url, args, transport = oxcli.get_cluster_info()
     assert name == "essai"
     assert url == "url"
 
+    oxcli.declare_cluster("pooled", "url", ["-p", "22"], ssh_pool=2, ssh_persist=60)
+    name, url, args, transport = oxcli.get_cluster_info("pooled")
+    assert transport.is_multiplexed()
+    # We do not have a real ssh server here, so we pretend the masters are
+    # already running.
+    transport.ensure_master = lambda slot: None
+    first = transport.command("ls")
+    second = transport.command("ls")
+    third = transport.command("ls")
+    assert first[:3] == ["ssh", "-p", "22"]
+    assert first[-2:] == ["url", "ls"]
+    assert "ControlMaster=no" in first
+    assert f"ControlPath={transport.control_path(0)}" in first
+    assert f"ControlPath={transport.control_path(1)}" in second
+    assert f"ControlPath={transport.control_path(0)}" in third
+    transport.close()
+    assert transport.control_dir is None
+
+    oxcli.end_test_clusters()
+
+
+def test_master_retry(monkeypatch):
+    oxcli.begin_test_clusters()
+    oxcli.declare_cluster("down", "url", [], ssh_pool=1)
+    transport = oxcli.get_cluster_info("down")[3]
+    runs = []
+
+    def run(command, **kwargs):
+        runs.append(command)
+        return subprocess.CompletedProcess(command, 255)
+
+    monkeypatch.setattr(oxcli.transport.subprocess, "run", run)
+
+    # The master fails to open: the commands connect directly, and we do not
+    # try again on each command
+    first = transport.command("ls")
+    transport.command("ls")
+    assert len(runs) == 1
+    assert "ControlMaster=no" in first
+    assert transport.retry_delay[0] == oxcli.transport.RETRY_MIN
+
+    # After the delay, we try again, and wait twice as long after a new failure
+    transport.retry_at[0] = 0
+    transport.command("ls")
+    assert len(runs) == 2
+    assert transport.retry_delay[0] == 2 * oxcli.transport.RETRY_MIN
+
+    transport.close()
+
     oxcli.end_test_clusters()
 
 
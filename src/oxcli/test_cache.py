@@ -0,0 +1,533 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import fastapi
+import fastapi.testclient
+import pytest
+
+from .. import oxcli
+
+# Ces tests n'ont pas besoin d'un vrai cluster OX: on remplace les commandes
+# ssh par des réponses toutes faites, et on compte les appels.
+
+
+class Commands:
+    def __init__(self):
+        self.contexts = [
+            {"id": "1", "name": "dimail", "lmappings": "1,dimail,example.com"},
+            {"id": "2", "name": "ctx2", "lmappings": "2,ctx2,other.org,tutu.net"},
+        ]
+        self.users = [
+            self.user(2, "admin_user", "oxadmin@example.com"),
+            self.user(3, "toto", "toto@example.com"),
+        ]
+        self.calls = []
+
+    def user(self, uid, username, email):
+        return {
+            "Id": f"{uid}",
+            "Name": username,
+            "PrimaryEmail": email,
+            "Given_name": "Given",
+            "Sur_name": "Sur",
+            "Display_name": f"Given Sur {uid}",
+        }
+
+    def arg(self, command, option):
+        return command[command.index(option) + 1]
+
+    def run_for_csv(self, cluster, command):
+        self.calls.append(command[0])
+        if command[0].endswith("/listcontext"):
+            return [dict(line) for line in self.contexts]
+        if command[0].endswith("/listuser"):
+            if "-s" in command:
+                name = self.arg(command, "-s")
+                return [dict(line) for line in self.users if line["Name"] == name]
+            return [dict(line) for line in self.users]
+        raise Exception(f"Unexpected command {command}")
+
+    def run_for_item(self, cluster, command):
+        self.calls.append(command[0])
+        if command[0].endswith("/createcontext"):
+            cid = command[command.index("--contextid") + 1]
+            name = command[command.index("--contextname") + 1]
+            domain = command[command.index("--addmapping") + 1]
+            self.contexts.append({"id": cid, "name": name, "lmappings": f"{cid},{name},{domain}"})
+            return ""
+        if command[0].endswith("/changecontext"):
+            cid = command[command.index("--contextid") + 1]
+            domain = command[command.index("--addmapping") + 1]
+            for line in self.contexts:
+                if line["id"] == cid:
+                    line["lmappings"] += f",{domain}"
+            return ""
+        if command[0].endswith("/createuser"):
+            uid = max(int(line["Id"]) for line in self.users) + 1
+            self.users.append(
+                self.user(uid, self.arg(command, "--username"), self.arg(command, "--email"))
+            )
+            return ""
+        if command[0].endswith("/changeuser"):
+            for line in self.users:
+                if line["Name"] == self.arg(command, "-u"):
+                    line["Display_name"] = self.arg(command, "--displayname")
+            return ""
+        if command[0].endswith("/deleteuser"):
+            name = self.arg(command, "-u")
+            self.users = [line for line in self.users if line["Name"] != name]
+            return ""
+        raise Exception(f"Unexpected command {command}")
+
+
+@pytest.fixture(scope="function")
+def commands(monkeypatch):
+    oxcli.begin_test_clusters()
+    oxcli.declare_cluster("cached", "ssh://nowhere", [], context_ttl=60, user_ttl=60)
+    oxcli.declare_cluster("uncached", "ssh://nowhere", [])
+    cmds = Commands()
+    monkeypatch.setattr(
+        oxcli.OxCluster, "stream_csv", lambda self, command: iter(cmds.run_for_csv(self, command))
+    )
+    monkeypatch.setattr(
+        oxcli.OxCluster, "run_for_item", lambda self, command: cmds.run_for_item(self, command)
+    )
+    yield cmds
+    oxcli.end_test_clusters()
+
+
+def test_context_cache(commands):
+    cluster = oxcli.OxCluster("cached")
+
+    ctx = cluster.get_context_by_domain("tutu.net")
+    assert ctx.cid == 2
+    assert commands.calls == ["/opt/open-xchange/sbin/listcontext"]
+
+    # Everything else comes from the cache, without any ssh call
+    assert cluster.get_context(1).name == "dimail"
+    assert cluster.get_context_by_name("ctx2").cid == 2
+    assert cluster.get_context_by_domain("other.org").cid == 2
+    assert cluster.get_context_by_domain("unknown.org") is None
+    assert len(cluster.list_contexts()) == 2
+    assert len(commands.calls) == 1
+
+    # The cache is per cluster, not per OxCluster object
+    other = oxcli.OxCluster("cached")
+    assert other.get_context_by_domain("example.com").cid == 1
+    assert len(commands.calls) == 1
+
+    # Creating a context updates the cache, no need to list the contexts again
+    ctx = cluster.create_context(None, "new", "new.fr")
+    assert ctx.cid == 3
+    assert commands.calls[1:] == ["/opt/open-xchange/sbin/createcontext"]
+    assert cluster.get_context_by_domain("new.fr") == ctx
+    assert cluster.get_context_by_name("new") == ctx
+
+    # Same thing when mapping a new domain
+    ctx = cluster.get_context(1).add_mapping("added.fr")
+    assert ctx.domains == {"example.com", "added.fr"}
+    assert commands.calls[2:] == ["/opt/open-xchange/sbin/changecontext"]
+    assert cluster.get_context_by_domain("added.fr").cid == 1
+    assert len(commands.calls) == 3
+
+    # Someone else changes the cluster behind our back, we see it when we
+    # ask for a refresh
+    commands.contexts.append({"id": "9", "name": "behind", "lmappings": "9,behind,back.fr"})
+    assert cluster.get_context_by_domain("back.fr") is None
+    contexts = cluster.refresh_contexts()
+    assert len(contexts) == 4
+    assert cluster.get_context_by_domain("back.fr").cid == 9
+    assert len(commands.calls) == 4
+
+    # or when the ttl expires
+    cluster._contexts.loaded_at -= 61
+    assert cluster.get_context_by_domain("back.fr").cid == 9
+    assert len(commands.calls) == 5
+
+
+def test_without_context_cache(commands):
+    cluster = oxcli.OxCluster("uncached")
+
+    assert cluster.get_context_by_domain("tutu.net").cid == 2
+    assert cluster.get_context(1).name == "dimail"
+    assert cluster.get_context_by_name("nope") is None
+    assert len(commands.calls) == 3
+
+
+def test_user_index(commands):
+    cluster = oxcli.OxCluster("cached")
+    ctx = cluster.get_context(1)
+    indexes = oxcli.get_user_indexes("cached")
+    commands.calls = []
+
+    # The first lookup fills the index, the next ones are answered from it
+    assert ctx.get_user_by_email("toto@example.com").uid == 3
+    assert commands.calls == ["/opt/open-xchange/sbin/listuser"]
+    assert ctx.get_user_by_name("admin_user").uid == 2
+    assert ctx.get_user_by_email("nobody@example.com") is None
+    assert len(ctx.list_users()) == 2
+    assert len(commands.calls) == 1
+    assert indexes.stats() == {
+        "contexts": 1,
+        "users": 2,
+        "hits": 3,
+        "misses": 1,
+        "refreshes": 1,
+    }
+
+    # The users sorted by email are sorted once for this snapshot
+    sorted_users = ctx.list_sorted_users()
+    assert [u.email_key() for u in sorted_users] == sorted(u.email_key() for u in ctx.list_users())
+    assert ctx.list_sorted_users() is sorted_users
+
+    # Creating a user asks for the new user only, and puts it in the index
+    user = ctx.create_user(givenName="Given", surName="Sur", username="titi", domain="example.com")
+    assert user.uid == 4
+    assert commands.calls[1:] == [
+        "/opt/open-xchange/sbin/createuser",
+        "/opt/open-xchange/sbin/listuser",
+    ]
+    assert ctx.get_user_by_email("titi@example.com") == user
+    assert user in ctx.list_sorted_users()
+
+    # Changing a user updates the index
+    user.change(displayName="Coin coin")
+    assert ctx.get_user_by_name("titi").displayName == "Coin coin"
+
+    # Deleting a user removes it from the index
+    user.delete()
+    assert ctx.get_user_by_email("titi@example.com") is None
+    assert ctx.get_user_by_name("titi") is None
+    assert [u.email for u in ctx.list_sorted_users()] == [
+        "oxadmin@example.com",
+        "toto@example.com",
+    ]
+    assert commands.calls[3:] == [
+        "/opt/open-xchange/sbin/changeuser",
+        "/opt/open-xchange/sbin/deleteuser",
+    ]
+
+    # The background refresher lists again the indexes that are about to expire
+    refresher = oxcli.refresh.Refresher("cached", 60)
+    refresher.refresh_once()
+    assert len(commands.calls) == 5
+    indexes.get(1).loaded_at -= 31
+    refresher.refresh_once()
+    assert commands.calls[5:] == ["/opt/open-xchange/sbin/listuser"]
+    assert indexes.stats()["refreshes"] == 2
+
+    # and forgets the ones nobody uses
+    indexes.get(1).last_used -= 601
+    refresher.refresh_once()
+    assert indexes.stats()["contexts"] == 0
+
+
+def test_stale_while_revalidate(commands, monkeypatch):
+    oxcli.declare_cluster(
+        "stale", "ssh://nowhere", [], context_ttl=60, user_ttl=60, stale_limit=300
+    )
+    cluster = oxcli.OxCluster("stale")
+    cache = cluster._contexts
+    ages = oxcli.age.Ages()
+    monkeypatch.setattr(oxcli.age, "current", contextvars.ContextVar("test", default=ages))
+    # The listings wait for us to release them
+    release = threading.Event()
+    release.set()
+
+    def stream_csv(self, command):
+        release.wait()
+        return iter(commands.run_for_csv(self, command))
+
+    monkeypatch.setattr(oxcli.OxCluster, "stream_csv", stream_csv)
+
+    assert cluster.get_context_by_domain("example.com").cid == 1
+    assert len(commands.calls) == 1
+    assert ages.oldest < 1
+
+    # Past the ttl, the lookup does not wait: it is answered from the old
+    # snapshot, which is refreshed in background, once
+    commands.contexts.append({"id": "9", "name": "behind", "lmappings": "9,behind,back.fr"})
+    cache.loaded_at -= 61
+    release.clear()
+    assert cluster.get_context_by_domain("example.com").cid == 1
+    assert cluster.get_context_by_name("dimail").cid == 1
+    assert cache.refreshing
+    assert ages.oldest >= 61
+
+    # But a lookup which finds nothing in the old snapshot does not trust it:
+    # it waits for the listing (the one running in background)
+    while cluster._flights.stats()["running"] == 0:
+        time.sleep(0.01)
+    found = []
+    lookup = threading.Thread(target=lambda: found.append(cluster.get_context_by_domain("back.fr")))
+    lookup.start()
+    time.sleep(0.05)
+    assert found == []
+    release.set()
+    lookup.join()
+    assert found[0].cid == 9
+    while cache.refreshing:
+        time.sleep(0.01)
+    assert len(commands.calls) == 2
+    assert cache.age() < 1
+
+    # Past the stale limit, the lookup waits for a new listing
+    commands.contexts.pop()
+    cache.loaded_at -= 301
+    assert cluster.get_context_by_domain("back.fr") is None
+    assert len(commands.calls) == 3
+    assert not cache.refreshing
+
+    # Same thing for the users, with the async API
+    async def stream_csv(self, command):
+        for line in commands.run_for_csv(self, command):
+            yield line
+
+    monkeypatch.setattr(oxcli.OxCluster, "astream_csv", stream_csv)
+
+    async def lookups():
+        ctx = await cluster.aget_context(1)
+        index = cluster._users.get(1)
+        assert (await ctx.aget_user_by_name("toto")).uid == 3
+        commands.users.append(commands.user(5, "tutu", "tutu@example.com"))
+        index.loaded_at -= 61
+        assert (await ctx.aget_user_by_name("toto")).uid == 3
+        assert len(oxcli.aox.revalidations) == 1
+        assert await ctx.aget_user_by_email("tutu@example.com") is not None
+        await asyncio.gather(*oxcli.aox.revalidations)
+        assert (await ctx.aget_user_by_name("tutu")).uid == 5
+        assert await ctx.aget_user_by_name("nobody") is None
+
+    asyncio.run(lookups())
+    # The first listing, the one of the miss, the one in background
+    assert commands.calls[3:] == ["/opt/open-xchange/sbin/listuser"] * 3
+
+
+def test_data_age_header():
+    app = fastapi.FastAPI()
+    app.add_middleware(oxcli.age.DataAgeMiddleware)
+
+    @app.get("/ox")
+    def with_ox():
+        oxcli.age.observe(12.7)
+        oxcli.age.observe(3)
+        return {}
+
+    @app.get("/no-ox")
+    def without_ox():
+        return {}
+
+    client = fastapi.testclient.TestClient(app)
+    assert client.get("/ox").headers["X-OX-Data-Age"] == "12"
+    assert "X-OX-Data-Age" not in client.get("/no-ox").headers
+
+
+def test_async_api(commands, monkeypatch):
+    cluster = oxcli.OxCluster("uncached")
+    csv = 'id,name,lmappings\\n1,dimail,"1,dimail,example.com"\\n'
+    monkeypatch.setattr(
+        cluster._transport, "command", lambda remote: ["sh", "-c", f"sleep 0.3; printf '{csv}'"]
+    )
+
+    async def lookups():
+        start = time.monotonic()
+        contexts = await asyncio.gather(
+            *[cluster.aget_context_by_domain("example.com") for _ in range(5)]
+        )
+        return contexts, time.monotonic() - start
+
+    contexts, elapsed = asyncio.run(lookups())
+    assert [ctx.cid for ctx in contexts] == [1] * 5
+    # The five lookups shared one listcontext, they did not wait for each other
+    assert elapsed < 1.2
+    assert cluster._flights.stats() == {"executions": 1, "saved": 4, "running": 0}
+
+    # Without the subprocesses, the async methods go through the same
+    # helpers as the sync ones
+    monkeypatch.undo()
+    cmds = Commands()
+
+    async def stream_csv(self, command):
+        for line in cmds.run_for_csv(self, command):
+            yield line
+
+    async def run_for_item(self, command):
+        return cmds.run_for_item(self, command)
+
+    monkeypatch.setattr(oxcli.OxCluster, "astream_csv", stream_csv)
+    monkeypatch.setattr(oxcli.OxCluster, "arun_for_item", run_for_item)
+
+    async def scenario():
+        cached = oxcli.OxCluster("cached")
+        ctx = await cached.aget_context_by_name("dimail")
+        user = await ctx.acreate_user(
+            givenName="Given", surName="Sur", username="titi", domain="example.com"
+        )
+        assert await ctx.aget_user_by_email("titi@example.com") == user
+        await user.achange(displayName="Coin coin")
+        assert (await ctx.aget_user_by_name("titi")).displayName == "Coin coin"
+        await user.adelete()
+        assert await ctx.aget_user_by_name("titi") is None
+        assert len(await ctx.alist_users()) == 2
+
+    asyncio.run(scenario())
+    assert cmds.calls == [
+        "/opt/open-xchange/sbin/listcontext",
+        "/opt/open-xchange/sbin/createuser",
+        "/opt/open-xchange/sbin/listuser",
+        "/opt/open-xchange/sbin/listuser",
+        "/opt/open-xchange/sbin/changeuser",
+        "/opt/open-xchange/sbin/deleteuser",
+    ]
+
+
+def test_flights():
+    flights = oxcli.Flights()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def listing():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return ["toto"]
+
+    # The callers which come while the listing runs wait for it, and get its
+    # result
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("list", listing)))
+    leader.start()
+    started.wait()
+    followers = [
+        threading.Thread(target=lambda: results.append(flights.do("list", listing)))
+        for _ in range(3)
+    ]
+    for thread in followers:
+        thread.start()
+    while flights.shared < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join()
+    assert results == [["toto"]] * 4
+    assert len(calls) == 1
+
+    # After a change on the cluster, a new caller does not join the listing
+    # which was running
+    async def change():
+        release.clear()
+
+        async def alisting():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return ["titi"]
+
+        first = asyncio.create_task(flights.ado("list", alisting))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flights.ado("list", alisting))
+        await asyncio.sleep(0)
+        flights.forget()
+        third = asyncio.create_task(flights.ado("list", alisting))
+        return await asyncio.gather(first, second, third)
+
+    assert asyncio.run(change()) == [["titi"]] * 3
+    assert len(calls) == 3
+    assert flights.stats() == {"executions": 3, "saved": 4, "running": 0}
+
+
+def test_scheduler():
+    scheduler = oxcli.Scheduler(1)
+    order = []
+
+    def wait_queued(reads, writes):
+        while True:
+            stats = scheduler.stats()
+            if (stats["queued_reads"], stats["queued_writes"]) == (reads, writes):
+                return
+            time.sleep(0.01)
+
+    def run(name, **kwargs):
+        with scheduler.slot(**kwargs):
+            order.append(name)
+
+    # One command at a time: the others wait in line, the reads first, then
+    # the writes in the order they came
+    first = scheduler.slot()
+    first.__enter__()
+    threads = []
+    for name, kwargs, queued in [
+        ("w1", {"write": True, "cid": 1}, (0, 1)),
+        ("w1 again", {"write": True, "cid": 1}, (0, 2)),
+        ("w2", {"write": True, "cid": 2}, (0, 3)),
+        ("read", {}, (1, 3)),
+    ]:
+        thread = threading.Thread(target=run, args=(name,), kwargs=kwargs)
+        thread.start()
+        threads.append(thread)
+        wait_queued(*queued)
+    assert scheduler.stats()["running"] == 1
+    first.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+    assert order == ["read", "w1", "w1 again", "w2"]
+    stats = scheduler.stats()
+    assert (stats["running"], stats["commands"], stats["waited"]) == (0, 5, 4)
+    assert stats["max_wait"] > 0
+
+    # Without a limit, only the writes on the same context wait for each other
+    scheduler = oxcli.Scheduler(0)
+    order = []
+
+    async def writes():
+        async def write(name, cid):
+            async with scheduler.aslot(write=True, cid=cid):
+                order.append(name)
+                await asyncio.sleep(0.05)
+
+        # A write which gives up leaves the line
+        async with scheduler.aslot(write=True, cid=1):
+            gone = asyncio.create_task(write("gone", 1))
+            await asyncio.sleep(0.01)
+            gone.cancel()
+            await asyncio.gather(gone, return_exceptions=True)
+            assert scheduler.stats()["queued_writes"] == 0
+        await asyncio.gather(write("a", 1), write("b", 1), write("c", 2))
+
+    asyncio.run(writes())
+    assert order == ["a", "c", "b"]
+    assert scheduler.stats()["running"] == 0
+
+
+def test_scheduler_read_load():
+    # The readers keep the only slot busy, one listing after the other: the
+    # write still goes after a few of them, not after all of them
+    scheduler = oxcli.Scheduler(1, read_burst=4)
+    order = []
+
+    def reader():
+        for _ in range(40):
+            with scheduler.slot():
+                order.append("read")
+                time.sleep(0.001)
+
+    def writer():
+        with scheduler.slot(write=True, cid=1):
+            order.append("write")
+
+    readers = [threading.Thread(target=reader) for _ in range(3)]
+    for thread in readers:
+        thread.start()
+    while len(order) < 10:
+        time.sleep(0.001)
+    write = threading.Thread(target=writer)
+    write.start()
+    while scheduler.stats()["queued_writes"] == 0 and "write" not in order:
+        time.sleep(0.0001)
+    queued_after = len(order)
+    for thread in [*readers, write]:
+        thread.join()
+    assert len(order) == 121
+    assert order.index("write") <= queued_after + 4 + 1
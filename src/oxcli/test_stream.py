@@ -0,0 +1,178 @@
+import asyncio
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pytest
+
+from .. import oxcli
+
+# Une fausse commande ssh, qui écrit un gros listing csv (et du bruit sur
+# stderr, pour vérifier qu'on ne bloque pas quand le pipe est plein).
+LISTING = """
+import sys
+print("Id,Name,PrimaryEmail,Given_name,Sur_name,Display_name")
+for i in range(1, {count} + 1):
+    print(f'{{i}},user{{i}},user{{i}}@example.com,Given,Sur,"Sur, Given {{i}}"')
+    if i % 1000 == 0:
+        print("x" * 100, file=sys.stderr)
+sys.exit({status})
+"""
+
+
+def listing(count: int, status: int = 0) -> list[str]:
+    return [sys.executable, "-c", LISTING.format(count=count, status=status)]
+
+
+@pytest.fixture(scope="function")
+def cluster():
+    oxcli.begin_test_clusters()
+    oxcli.declare_cluster("stream", "ssh://nowhere", [])
+    cluster = oxcli.OxCluster("stream")
+    ctx = oxcli.OxContext(cid=1, name="ctx", domains=["example.com"], cluster=cluster)
+    yield cluster, ctx
+    oxcli.end_test_clusters()
+
+
+def test_stream_users(cluster, monkeypatch):
+    cluster, ctx = cluster
+    monkeypatch.setattr(cluster._transport, "command", lambda remote: listing(200_000))
+
+    tracemalloc.start()
+    count = 0
+    for user in ctx.stream_users():
+        count += 1
+        last = user
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert count == 200_000
+    assert last.email == "user200000@example.com"
+    assert last.displayName == "Sur, Given 200000"
+    # Only a few users live at the same time, whatever the size of the listing
+    assert peak < 5 * 1024 * 1024
+
+    # Stopping early kills the command, and finds the user
+    assert ctx.get_user_by_email("user10@example.com").uid == 10
+
+
+def test_stream_errors(cluster, monkeypatch):
+    cluster, ctx = cluster
+    monkeypatch.setattr(cluster._transport, "command", lambda remote: listing(5000, 1))
+    with pytest.raises(Exception, match="Failed to run ssh command"):
+        ctx.list_users()
+
+    # Lots of output, without any csv reader: used to deadlock on a full pipe
+    monkeypatch.setattr(cluster._transport, "command", lambda remote: listing(50_000))
+    assert len(cluster.run_for_item(["whatever"])) > 1024 * 1024
+
+
+def test_astream_users(cluster, monkeypatch):
+    cluster, ctx = cluster
+    monkeypatch.setattr(cluster._transport, "command", lambda remote: listing(200_000))
+
+    async def read_all():
+        count = 0
+        async for user in ctx.astream_users():
+            count += 1
+            last = user
+        return count, last
+
+    (count, last) = asyncio.run(read_all())
+    assert count == 200_000
+    assert last.displayName == "Sur, Given 200000"
+
+    user = asyncio.run(ctx.aget_user_by_email("user10@example.com"))
+    assert user.uid == 10
+
+    monkeypatch.setattr(cluster._transport, "command", lambda remote: listing(5000, 1))
+    with pytest.raises(Exception, match="Failed to run ssh command"):
+        asyncio.run(ctx.alist_users())
+
+
+def test_ssh_master_off_the_loop(monkeypatch):
+    oxcli.begin_test_clusters()
+    oxcli.declare_cluster("pooled", "ssh://nowhere", [], ssh_pool=1)
+    cluster = oxcli.OxCluster("pooled")
+    ctx = oxcli.OxContext(cid=1, name="ctx", domains=["example.com"], cluster=cluster)
+
+    # Opening the master is slow: the event loop keeps running meanwhile
+    def command(remote):
+        time.sleep(0.3)
+        return listing(3)
+
+    monkeypatch.setattr(cluster._transport, "command", command)
+
+    async def list_and_tick():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        users = await ctx.alist_users()
+        ticker.cancel()
+        return users, ticks
+
+    (users, ticks) = asyncio.run(list_and_tick())
+    assert len(users) == 3
+    assert ticks > 10
+    oxcli.end_test_clusters()
+
+
+def test_create_users(cluster, monkeypatch):
+    cluster, ctx = cluster
+
+    # The remote shell runs locally, and createuser is replaced by 'true',
+    # except for the user 'bad', where it fails.
+    def command(remote):
+        if remote == "sh -s":
+            fake = (
+                "sed -e 's|^/opt/open-xchange/sbin/createuser .*--username bad .*2>&1;|"
+                "echo User bad is not welcome </dev/null 2>\\&1; false;|' "
+                "-e 's|^/opt/open-xchange/sbin/createuser |true |' | sh"
+            )
+            return ["sh", "-c", fake]
+        return listing(3)
+
+    monkeypatch.setattr(cluster._transport, "command", command)
+    users = [
+        {"givenName": "Jeanne", "surName": "D'Arc", "username": "user1", "domain": "example.com"},
+        {"givenName": "Given", "surName": "Sur", "username": "bad", "domain": "example.com"},
+        {"givenName": "Given", "surName": "Sur", "username": "user2", "domain": "example.com"},
+        {"givenName": "Given", "surName": "Sur"},
+        {"givenName": "Given", "surName": "Sur", "username": "lost", "domain": "example.com"},
+    ]
+    for results in [ctx.create_users(users), asyncio.run(ctx.acreate_users(users))]:
+        assert results[0].uid == 1
+        assert str(results[1]) == "User bad is not welcome"
+        assert results[2].email == "user2@example.com"
+        assert "Please provide either the 'email'" in str(results[3])
+        assert str(results[4]) == "user seems created, but fail to get it"
+
+
+def test_batch_quoting():
+    # The arguments reach the commands as they are, whatever they hold
+    names = ["Jeanne D'Arc", "l'un et l'autre", 'say "hi"', "$(echo pwned) `x` ; rm -rf /"]
+    script = oxcli.ox._batch_script([["printf", "%s\\n", name] for name in names])
+    res = subprocess.run(["sh", "-s"], input=script, capture_output=True, text=True)
+    assert res.returncode == 0
+    assert oxcli.ox._read_batch_output(res.stdout, len(names)) == [None] * len(names)
+    lines = [line for line in res.stdout.splitlines() if not line.startswith(oxcli.ox.BATCH_MARK)]
+    assert lines == names
+
+
+def test_batch_output_without_newline():
+    # The output of a command may not end with a newline: its marker is then
+    # on the same line, and it still counts
+    mark = oxcli.ox.BATCH_MARK
+    output = f"created user 7{mark} 0 0\nok\n{mark} 1 0\noops{mark} 2 1\n"
+    assert oxcli.ox._read_batch_output(output, 3) == [None, None, "oops"]
+
+    script = oxcli.ox._batch_script([["printf", "no newline"], ["sh", "-c", "printf bad; false"]])
+    res = subprocess.run(["sh", "-s"], input=script, capture_output=True, text=True)
+    assert oxcli.ox._read_batch_output(res.stdout, 2) == [None, "bad"]
@@ -0,0 +1,155 @@
+import itertools
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# When a master connection fails to open, we try again after RETRY_MIN
+# seconds, then twice as long after each new failure, up to RETRY_MAX. In the
+# meantime, the commands connect directly.
+RETRY_MIN = 5
+RETRY_MAX = 300
+
+
+class SshTransport:
+    """How we talk to an OX cluster over ssh. When `pool_size` is 0, every
+    command forks a brand new ssh connection (and pays for the full TCP, key
+    exchange and auth handshake). Otherwise, we keep `pool_size` persistent
+    master connections open (OpenSSH ControlMaster), and each command is run
+    as a new channel multiplexed on one of those masters, in round robin."""
+
+    def __init__(
+        self,
+        ssh_url: str,
+        ssh_args: list[str] = [],
+        pool_size: int = 0,
+        persist: int = 600,
+    ):
+        self.ssh_url = ssh_url
+        self.ssh_args = list(ssh_args)
+        self.pool_size = pool_size
+        self.persist = persist
+        self.control_dir: str | None = None
+        self.lock = threading.Lock()
+        self.slot_locks = [threading.Lock() for _ in range(pool_size)]
+        self.retry_at = [0.0] * pool_size
+        self.retry_delay = [0] * pool_size
+        self.slots = itertools.cycle(range(max(pool_size, 1)))
+
+    def is_multiplexed(self) -> bool:
+        return self.pool_size > 0
+
+    def control_path(self, slot: int) -> str:
+        # Unix socket paths are limited to about 100 chars, mkdtemp in /tmp
+        # keeps us far below that.
+        with self.lock:
+            if self.control_dir is None:
+                self.control_dir = tempfile.mkdtemp(prefix="dimail-ox-")
+        return f"{self.control_dir}/{slot}"
+
+    def ensure_master(self, slot: int) -> None:
+        """Opens the master connection for this slot, unless it is already
+        running. The master goes in background (-f) once authenticated, with
+        its stdio closed, so that it never holds our pipes open.
+
+        Never waits for someone else opening it, and does not try again too
+        soon after a failure: the command connects directly instead."""
+        path = self.control_path(slot)
+        if os.path.exists(path) or time.monotonic() < self.retry_at[slot]:
+            return
+        if not self.slot_locks[slot].acquire(blocking=False):
+            return
+        try:
+            if os.path.exists(path):
+                return
+            log.info(f"Opening persistent ssh connection #{slot} to {self.ssh_url}")
+            res = subprocess.run(
+                ["ssh"]
+                + self.ssh_args
+                + [
+                    "-o",
+                    "ControlMaster=yes",
+                    "-o",
+                    f"ControlPath={path}",
+                    "-o",
+                    f"ControlPersist={self.persist}",
+                    "-N",
+                    "-f",
+                    self.ssh_url,
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            if res.returncode != 0:
+                # Not fatal: the commands will connect directly.
+                delay = min(max(self.retry_delay[slot] * 2, RETRY_MIN), RETRY_MAX)
+                self.retry_delay[slot] = delay
+                self.retry_at[slot] = time.monotonic() + delay
+                log.error(
+                    f"Failed to open persistent ssh connection #{slot} to {self.ssh_url}, "
+                    f"trying again in {delay}s"
+                )
+            else:
+                self.retry_delay[slot] = 0
+        finally:
+            self.slot_locks[slot].release()
+
+    def warm(self) -> None:
+        """Opens all the master connections now, instead of on first use."""
+        for slot in range(self.pool_size):
+            self.ensure_master(slot)
+
+    def start_warm(self) -> None:
+        """Opens the master connections in background: the handshakes do not
+        delay the startup, and the first commands do not pay for them."""
+        if not self.is_multiplexed():
+            return
+        threading.Thread(
+            target=self.warm, name=f"oxcli-warm-{self.ssh_url}", daemon=True
+        ).start()
+
+    def command(self, remote: str) -> list[str]:
+        """The full command line to run `remote` on the cluster."""
+        if not self.is_multiplexed():
+            return ["ssh"] + self.ssh_args + [self.ssh_url, remote]
+        with self.lock:
+            slot = next(self.slots)
+        self.ensure_master(slot)
+        # ControlMaster=no: if the master died in the meantime, ssh falls back
+        # to a direct connection instead of becoming a master itself.
+        return (
+            ["ssh"]
+            + self.ssh_args
+            + [
+                "-o",
+                "ControlMaster=no",
+                "-o",
+                f"ControlPath={self.control_path(slot)}",
+                self.ssh_url,
+                remote,
+            ]
+        )
+
+    def close(self) -> None:
+        """Asks all the master connections to exit, and cleans up the sockets."""
+        if self.control_dir is None:
+            return
+        for slot in range(self.pool_size):
+            path = self.control_path(slot)
+            if not os.path.exists(path):
+                continue
+            subprocess.run(
+                ["ssh", "-o", f"ControlPath={path}", "-O", "exit", self.ssh_url],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+        log.info(f"Closed the persistent ssh connections to {self.ssh_url}")
@@ -1,5 +1,5 @@
 # ruff: noqa: E402
-from . import aliases, allows, domains, mailboxes, users
+from . import aliases, allows, domains, mailboxes, system, users
 
 from .get_token import login_for_access_token
 
@@ -9,6 +9,7 @@ __useless__ = [
     allows.get_allows,
     domains.get_domain,
     mailboxes.get_mailboxes,
+    system.post_ox_refresh,
     users.get_user,
 ]
 
@@ -1,10 +1,14 @@
 # ruff: noqa: E402
 from .get_alias import get_alias
+from .get_aliases_export import get_aliases_export
 from .post_alias import post_alias
+from .post_aliases_bulk import post_aliases_bulk
 from .delete_alias import delete_alias
 
 __all__ = [
     delete_alias,
     get_alias,
+    get_aliases_export,
     post_alias,
+    post_aliases_bulk,
 ]
@@ -29,13 +29,13 @@ async def delete_alias(
     name = user_name + "@" + domain_name
     if destination == "all":
         log.info(f"On demande la suppression de toutes les destinations pour {name}")
-        count = sql_postfix.delete_aliases_by_name(db, name)
+        count = await sql_postfix.adelete_aliases_by_name(db, name)
         if count == 0:
             raise fastapi.HTTPException(status_code=404, detail="Not found")
         return None
 
     log.info("On supprime un alias exact")
-    count = sql_postfix.delete_alias(db, name, destination)
+    count = await sql_postfix.adelete_alias(db, name, destination)
     if count == 0:
         log.info("Cet alias n'existe pas")
         raise fastapi.HTTPException(status_code=404, detail="Not found")
@@ -1,16 +1,35 @@
 import logging
+import typing
 
 import fastapi
 
 from ... import auth, sql_postfix, web_models
-from .. import dependencies, routers
+from .. import dependencies, ndjson, routers
 
 
-@routers.aliases.get("/", description="Gets an exact alias")
+async def stream_aliases(domain_name: str) -> typing.AsyncIterator[web_models.Alias]:
+    maker = sql_postfix.get_amaker()
+    db = maker()
+    try:
+        async for alias in sql_postfix.astream_aliases_by_domain(db, domain_name):
+            yield web_models.Alias.from_db(alias)
+    finally:
+        await db.close()
+
+
+@routers.aliases.get(
+    "/",
+    description="Gets an exact alias, or all the aliases of the domain (paged, the "
+    "next page is in the X-Next-Cursor header, or all of them streamed as ndjson "
+    "with Accept: application/x-ndjson)",
+    responses=ndjson.RESPONSES,
+)
 async def get_alias(
+    request: fastapi.Request,
     domain_name: str,
     user: auth.DependsTokenUser,
     db: dependencies.DependsPostfixDb,
+    page: dependencies.DependsPage,
     user_name: str = "",
     destination: str = "",
 ) -> list[web_models.Alias]:
@@ -23,7 +42,12 @@ async def get_alias(
 
     if user_name == "" and destination == "":
         log.info("Pas de user_name, pas de destination, on cherche tous les alias de domain_name")
-        db_aliases = sql_postfix.get_aliases_by_domain(db, domain_name)
+        if ndjson.wanted(request):
+            return ndjson.response(stream_aliases(domain_name))
+        db_aliases = await sql_postfix.aget_aliases_by_domain(
+            db, domain_name, limit=page.limit + 1, after=page.after(2)
+        )
+        db_aliases = page.cut(db_aliases, lambda alias: (alias.alias, alias.destination))
         return [web_models.Alias.from_db(x) for x in db_aliases]
 
     if user_name == "":
@@ -35,11 +59,11 @@ async def get_alias(
     name = user_name + "@" + domain_name
     if destination == "":
         log.info("Pas de destination, on cherche toutes les destinations pour une adresse mail")
-        db_aliases = sql_postfix.get_aliases_by_name(db, name)
+        db_aliases = await sql_postfix.aget_aliases_by_name(db, name)
         return [web_models.Alias.from_db(x) for x in db_aliases]
 
     log.info("On cherche un alias exact")
-    db_alias = sql_postfix.get_alias(db, name, destination)
+    db_alias = await sql_postfix.aget_alias(db, name, destination)
     if db_alias is None:
         log.info("Cet alias n'existe pas")
         raise fastapi.HTTPException(status_code=404, detail="Alias not found")
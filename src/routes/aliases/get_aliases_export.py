@@ -0,0 +1,59 @@
+import csv
+import io
+import logging
+import typing
+
+import fastapi
+import fastapi.responses
+
+from ... import auth, sql_postfix, utils
+from .. import routers
+
+# We send the csv by pieces of about that size
+EXPORT_BUFFER = 64 * 1024
+
+
+async def export_aliases(domain_name: str) -> typing.AsyncIterator[str]:
+    # The response is streamed after the dependencies are closed, so we need
+    # our own session, closed when the stream ends (or is interrupted).
+    maker = sql_postfix.get_amaker()
+    db = maker()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(["user_name", "destination"])
+        async for alias in sql_postfix.astream_aliases_by_domain(db, domain_name):
+            (username, _) = utils.split_email(alias.alias)
+            writer.writerow([username, alias.destination])
+            if buffer.tell() > EXPORT_BUFFER:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        await db.close()
+
+
+@routers.aliases.get(
+    ":export",
+    description="Exports all the aliases of the domain, as csv, with the same "
+    "columns as the bulk import.",
+    response_class=fastapi.responses.StreamingResponse,
+    responses={200: {"content": {"text/csv": {}}}},
+)
+async def get_aliases_export(
+    domain_name: str,
+    user: auth.DependsTokenUser,
+) -> fastapi.responses.StreamingResponse:
+    log = logging.getLogger(__name__)
+
+    perms = user.get_creds()
+    if not perms.can_read(domain_name):
+        log.info(f"Cet utilisateur n'a pas les droits sur le domaine {domain_name}")
+        raise fastapi.HTTPException(status_code=403, detail="Permission denied")
+
+    return fastapi.responses.StreamingResponse(
+        export_aliases(domain_name),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{domain_name}-aliases.csv"'},
+    )
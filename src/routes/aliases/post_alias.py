@@ -21,11 +21,11 @@ async def post_alias(
         raise fastapi.HTTPException(status_code=403, detail="Permission denied")
 
     name = alias.user_name + "@" + domain_name
-    db_alias = sql_postfix.get_alias(db, name, alias.destination)
+    db_alias = await sql_postfix.aget_alias(db, name, alias.destination)
     if db_alias is not None:
         log.info("Cet alias existe deja")
         raise fastapi.HTTPException(status_code=409, detail="Alias already exists")
 
-    db_alias = sql_postfix.create_alias(db, domain_name, alias.user_name, alias.destination)
+    db_alias = await sql_postfix.acreate_alias(db, domain_name, alias.user_name, alias.destination)
 
     return web_models.Alias.from_db(db_alias)
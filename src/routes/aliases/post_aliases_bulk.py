@@ -0,0 +1,77 @@
+import logging
+
+import fastapi
+import fastapi.exceptions
+import pydantic
+
+from ... import auth, sql_postfix, web_models
+from .. import dependencies, routers
+
+aliases_adapter = pydantic.TypeAdapter(list[web_models.CreateAlias])
+
+
+@routers.aliases.post(
+    ":bulk",
+    description="Creates many aliases in postfix, given as a json list of "
+    "aliases, or as csv (Content-Type: text/csv) with a 'user_name,destination' "
+    "header. The result of each alias is given in the same order as the request.",
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/CreateAlias"},
+                    },
+                },
+                "text/csv": {"schema": {"type": "string"}},
+            },
+            "required": True,
+        },
+    },
+)
+async def post_aliases_bulk(
+    request: fastapi.Request,
+    user: auth.DependsTokenUser,
+    db: dependencies.DependsPostfixDb,
+    domain_name: str,
+) -> list[web_models.BulkAliasResult]:
+    log = logging.getLogger(__name__)
+
+    perms = user.get_creds()
+    if not perms.can_read(domain_name):
+        log.info(f"Cet utilisateur n'a pas les droits sur le domaine {domain_name}")
+        raise fastapi.HTTPException(status_code=403, detail="Permission denied")
+
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("text/csv"):
+            aliases = web_models.CreateAlias.list_from_csv(body.decode())
+        else:
+            aliases = aliases_adapter.validate_json(body)
+    except pydantic.ValidationError as e:
+        raise fastapi.exceptions.RequestValidationError(e.errors(include_url=False))
+
+    log.info(f"Creating {len(aliases)} aliases in domain {domain_name}")
+    created = await sql_postfix.acreate_aliases(
+        db, domain_name, [(alias.user_name, alias.destination) for alias in aliases]
+    )
+    if created is None:
+        log.error(f"Failed to create the aliases in domain {domain_name}")
+        created = [None] * len(aliases)
+
+    results = []
+    for alias, is_new in zip(aliases, created):
+        result = web_models.BulkAliasResult(
+            user_name=alias.user_name,
+            destination=alias.destination,
+            status=web_models.BatchStatus.Created,
+        )
+        if is_new is None:
+            result.status = web_models.BatchStatus.Failed
+            result.detail = "Failed to create the aliases"
+        elif not is_new:
+            result.status = web_models.BatchStatus.Conflict
+            result.detail = "Alias already exists"
+        results.append(result)
+    return results
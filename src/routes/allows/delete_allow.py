@@ -13,19 +13,19 @@ async def delete_allow(
 ) -> None:
     """Remove user ownership of a domain."""
 
-    user_db = sql_api.get_user(db, user_name)
+    user_db = await sql_api.aget_user(db, user_name)
     if user_db is None:
         raise fastapi.HTTPException(status_code=404, detail="User not found")
 
-    domain_db = sql_api.get_domain(db, domain_name)
+    domain_db = await sql_api.aget_domain(db, domain_name)
     if domain_db is None:
         raise fastapi.HTTPException(status_code=404, detail="Domain not found")
 
-    allowed_db = sql_api.get_allowed(db, user_name, domain_name)
+    allowed_db = await sql_api.aget_allowed(db, user_name, domain_name)
     if allowed_db is None:
         raise fastapi.HTTPException(
             status_code=404,
             detail="Queried user does not have permissions for this domain.",
         )
 
-    return sql_api.deny_domain_for_user(db, user=user_name, domain=domain_name)
+    return await sql_api.adeny_domain_for_user(db, user=user_name, domain=domain_name)
@@ -6,8 +6,12 @@ from .. import dependencies, routers
 async def get_allows(
     db: dependencies.DependsApiDb,
     user: auth.DependsBasicAdmin,
+    page: dependencies.DependsPage,
     username: str = "",
     domain: str = "",
 ) -> list[web_models.Allowed]:
-    allows = sql_api.get_allows(db, username, domain)
+    allows = await sql_api.aget_allows(
+        db, username, domain, limit=page.limit + 1, after=page.after(2)
+    )
+    allows = page.cut(allows, lambda allow: (allow.user, allow.domain))
     return [web_models.Allowed.from_db(allow) for allow in allows]
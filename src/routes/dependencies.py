@@ -1,54 +1,123 @@
 import typing
 
-from .. import sql_dovecot, sql_postfix, sql_api
+from .. import config, sql_dovecot, sql_postfix, sql_api, utils, web_models
 
 import fastapi.security
-import sqlalchemy.orm as orm
+import sqlalchemy.ext.asyncio as sa_async
 
 
-def depends_api_db():
-    """Dependency for fastapi that creates an orm session and yields it. Ensures
-    the session is closed at the end."""
-    maker = sql_api.get_maker()
+# The same dependency as the auth, so that the route gets the session the auth
+# already used.
+depends_api_db = sql_api.get_db
+
+DependsApiDb = typing.Annotated[sa_async.AsyncSession, fastapi.Depends(depends_api_db)]
+
+
+async def depends_dovecot_db():
+    """Dependency for fastapi that creates an async orm session and yields it.
+    Ensures the session is closed at the end."""
+    maker = sql_dovecot.get_amaker()
     db = maker()
     # En cas d'erreur, on va lever une exception (404, 403, etc), or il faudra
     # quand meme fermer la connexion a la base de données
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
-DependsApiDb = typing.Annotated[orm.Session, fastapi.Depends(depends_api_db)]
+DependsDovecotDb = typing.Annotated[sa_async.AsyncSession, fastapi.Depends(depends_dovecot_db)]
 
 
-def depends_dovecot_db():
-    """Dependency for fastapi that creates an orm session and yields it. Ensures
-    the session is closed at the end."""
-    maker = sql_dovecot.get_maker()
+async def depends_postfix_db():
+    """Dependency for fastapi that creates an async orm session and yields it.
+    Ensures the session is closed at the end."""
+    maker = sql_postfix.get_amaker()
     db = maker()
     # En cas d'erreur, on va lever une exception (404, 403, etc), or il faudra
     # quand meme fermer la connexion a la base de données
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
 
 
-DependsDovecotDb = typing.Annotated[typing.Any, fastapi.Depends(depends_dovecot_db)]
+DependsPostfixDb = typing.Annotated[sa_async.AsyncSession, fastapi.Depends(depends_postfix_db)]
 
 
-def depends_postfix_db():
-    """Dependency for fastapi that creates an orm session and yields it. Ensures
-    the session is closed at the end."""
-    maker = sql_postfix.get_maker()
-    db = maker()
-    # En cas d'erreur, on va lever une exception (404, 403, etc), or il faudra
-    # quand meme fermer la connexion a la base de données
+class Page:
+    """The page asked to a listing route: at most `limit` items, after the key
+    in the cursor (None for the first page). The route asks the crud for one
+    more item, to know if there is a next page, then `cut` the items and sends
+    the cursor of the next page in the X-Next-Cursor header."""
+
+    def __init__(self, response: fastapi.Response, limit: int, cursor: str):
+        self.response = response
+        self.limit = limit
+        self.cursor = cursor
+        self.headers: dict[str, str] = {}
+
+    def after(self, size: int) -> tuple | None:
+        """The key in the cursor, of `size` parts."""
+        if self.cursor == "":
+            return None
+        try:
+            return utils.cursor.decode(self.cursor, size)
+        except Exception:
+            raise fastapi.HTTPException(status_code=400, detail="Invalid cursor")
+
+    def next(self, key: tuple) -> None:
+        """Sets the cursor of the next page. The routes which return their own
+        response send the `headers` themselves."""
+        self.headers["X-Next-Cursor"] = utils.cursor.encode(key)
+        self.response.headers.update(self.headers)
+
+    def cut(self, items: list, key: typing.Callable) -> list:
+        if len(items) > self.limit:
+            items = items[: self.limit]
+            self.next(key(items[-1]))
+        return items
+
+
+def depends_page(
+    response: fastapi.Response,
+    limit: typing.Annotated[int | None, fastapi.Query(ge=1)] = None,
+    cursor: str = "",
+) -> Page:
+    """Dependency for fastapi reading the page asked: `limit` defaults to
+    `page_size` and can not go beyond `max_page_size`, `cursor` is the
+    X-Next-Cursor of the previous page."""
+    if limit is None:
+        limit = config.settings.page_size
+    return Page(response, min(limit, config.settings.max_page_size), cursor)
+
+
+DependsPage = typing.Annotated[Page, fastapi.Depends(depends_page)]
+
+
+def depends_mailbox_fields(
+    fields: typing.Annotated[
+        str,
+        fastapi.Query(
+            description="The fields of the mailboxes to send, separated by commas, "
+            f"among {', '.join(web_models.MailboxField)}. Defaults to "
+            f"{','.join(web_models.Mailbox.DEFAULT_FIELDS)}. Without "
+            f"{', '.join(sorted(web_models.Mailbox.OX_FIELDS))}, OX is not asked at all "
+            "(and the mailboxes known only by OX are not sent).",
+            examples=["email,active"],
+        ),
+    ] = "",
+) -> list[web_models.MailboxField]:
+    """Dependency for fastapi reading the fields of the mailboxes the client
+    wants."""
+    if fields == "":
+        return web_models.Mailbox.DEFAULT_FIELDS
     try:
-        yield db
-    finally:
-        db.close()
+        return [web_models.MailboxField(field.strip()) for field in fields.split(",")]
+    except ValueError as e:
+        raise fastapi.HTTPException(status_code=422, detail=f"Invalid fields: {e}")
 
 
-DependsPostfixDb = typing.Annotated[typing.Any, fastapi.Depends(depends_postfix_db)]
+DependsMailboxFields = typing.Annotated[
+    list[web_models.MailboxField], fastapi.Depends(depends_mailbox_fields)
+]
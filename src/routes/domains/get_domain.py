@@ -15,7 +15,7 @@ async def get_domain(
     log = logging.getLogger(__name__)
     perms = user.get_creds()
 
-    domain_db = sql_api.get_domain(db, domain_name)
+    domain_db = await sql_api.aget_domain(db, domain_name)
     if domain_db is None:
         log.info(f"Domain {domain_name} not found.")
         raise fastapi.HTTPException(status_code=404, detail="Domain not found")
@@ -1,11 +1,36 @@
+import typing
+
+import fastapi
+
 from ... import auth, sql_api, web_models
-from .. import dependencies, routers
+from .. import dependencies, ndjson, routers
+
 
+async def stream_domains() -> typing.AsyncIterator[web_models.Domain]:
+    maker = sql_api.get_amaker()
+    db = maker()
+    try:
+        async for domain in sql_api.astream_domains(db):
+            yield web_models.Domain.from_db(domain)
+    finally:
+        await db.close()
 
-@routers.domains.get("/")
+
+@routers.domains.get(
+    "/",
+    description="Gets the domains, paged (the next page is in the X-Next-Cursor "
+    "header), or all of them streamed as ndjson (with Accept: application/x-ndjson)",
+    responses=ndjson.RESPONSES,
+)
 async def get_domains(
+    request: fastapi.Request,
     db: dependencies.DependsApiDb,
     user: auth.DependsBasicAdmin,
+    page: dependencies.DependsPage,
 ) -> list[web_models.Domain]:
-    domains = sql_api.get_domains(db)
+    if ndjson.wanted(request):
+        return ndjson.response(stream_domains())
+
+    domains = await sql_api.aget_domains(db, limit=page.limit + 1, after=page.after(1))
+    domains = page.cut(domains, lambda domain: (domain.name,))
     return [web_models.Domain.from_db(domain) for domain in domains]
@@ -15,13 +15,13 @@ async def post_domain(
             status_code=409, detail="OX context name is mandatory for mailbox feature"
         )
 
-    domain_db = sql_api.get_domain(db, domain.name)
+    domain_db = await sql_api.aget_domain(db, domain.name)
     if domain_db is not None:
         raise fastapi.HTTPException(status_code=409, detail="Domain already exists")
 
     if "webmail" in domain.features:
         ox_cluster = oxcli.OxCluster()
-        ctx = ox_cluster.get_context_by_domain(domain.name)
+        ctx = await ox_cluster.aget_context_by_domain(domain.name)
         if ctx is not None and ctx.name != domain.context_name:
             raise fastapi.HTTPException(
                 status_code=409,
@@ -29,13 +29,13 @@ async def post_domain(
             )
 
         if ctx is None:
-            ctx = ox_cluster.get_context_by_name(domain.context_name)
+            ctx = await ox_cluster.aget_context_by_name(domain.context_name)
             if ctx is None:
-                ctx = ox_cluster.create_context(None, domain.context_name, domain.name)
+                ctx = await ox_cluster.acreate_context(None, domain.context_name, domain.name)
             else:
-                ctx.add_mapping(domain.name)
+                await ctx.aadd_mapping(domain.name)
 
-    domain_db = sql_api.create_domain(
+    domain_db = await sql_api.acreate_domain(
         db,
         name=domain.name,
         features=domain.features,
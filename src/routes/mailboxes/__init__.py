@@ -1,9 +1,11 @@
 # ruff: noqa: E402
+from . import reconcile
 from .delete_mailbox import delete_mailbox
 from .get_mailboxes import get_mailboxes
 from .get_mailbox import get_mailbox
 from .patch_mailbox import patch_mailbox
 from .post_mailbox import post_mailbox
+from .post_mailboxes_batch import post_mailboxes_batch
 
 __all__ = [
     delete_mailbox,
@@ -11,4 +13,6 @@ __all__ = [
     get_mailbox,
     patch_mailbox,
     post_mailbox,
+    post_mailboxes_batch,
+    reconcile,
 ]
@@ -23,7 +23,7 @@ async def delete_mailbox(
         log.info(f"Permission denied on domain {domain_name} for current user")
         raise fastapi.HTTPException(status_code=403, detail="Permission denied")
 
-    domain_db = sql_api.get_domain(api, domain_name)
+    domain_db = await sql_api.aget_domain(api, domain_name)
     if domain_db is None:
         log.info(f"Domain not found in database {domain_name}")
         raise fastapi.HTTPException(status_code=404, detail="Domain not found")
@@ -35,7 +35,7 @@ async def delete_mailbox(
             detail="Feature 'mailbox' not available on the domain"
         )
 
-    db_user = sql_dovecot.get_user(imap, user_name, domain_name)
+    db_user = await sql_dovecot.aget_user(imap, user_name, domain_name)
     if db_user is None:
         log.info(f"La boite {user_name} n'existe pas pour le domain {domain_name}")
         raise fastapi.HTTPException(status_code=404, detail="Mailbox not found")
@@ -43,20 +43,21 @@ async def delete_mailbox(
     ox_user = None
     if "webmail" in domain_db.features:
         ox_cluster = oxcli.OxCluster()
-        ctx = ox_cluster.get_context_by_domain(domain_name)
+        ctx = await ox_cluster.aget_context_by_domain(domain_name)
 
         if ctx is None:
             log.info("Aucun contexte ne gère le domaine chez OX")
             raise fastapi.HTTPException(status_code=404, detail="Domain not found in open-xchange")
 
-        ox_user = ctx.get_user_by_email(email)
+        ox_user = await ctx.aget_user_by_email(email)
 
         if ox_user is None:
             log.info("Le contexte OX ne connait pas cet email")
             raise fastapi.HTTPException(status_code=404, detail="Mailbox not found in open-xchange")
 
-    sql_dovecot.delete_user(imap, user_name, domain_name)
+    await sql_dovecot.adelete_user(imap, user_name, domain_name)
     if "webmail" in domain_db.features:
-        ox_user.delete()
+        await ox_user.adelete()
+    await sql_api.amark_mailboxes_changed(api, domain_name)
     return None
 
@@ -2,21 +2,41 @@ import logging
 
 import fastapi
 
-from ... import auth, oxcli, sql_api, sql_dovecot, web_models
+from ... import auth, oxcli, sql_api, sql_dovecot, utils, web_models
 from .. import dependencies, routers
 
 # uuid_re = re.compile("^[0-9a-f-]{32,36}$")
 
 
+async def get_ox_user(domain_name: str, email: str, with_webmail: bool) -> oxcli.OxUser | None:
+    log = logging.getLogger(__name__)
+    ox_cluster = oxcli.OxCluster()
+    ctx = await ox_cluster.aget_context_by_domain(domain_name)
+
+    if with_webmail and ctx is None:
+        log.info("Aucun contexte ne gère le domaine chez OX (ce n'est pas normal)")
+    if not with_webmail and ctx:
+        log.info("Il y a un context pour ce domaine chez OX (ce n'est pas normal)")
+
+    if ctx is None:
+        return None
+    return await ctx.aget_user_by_email(email)
+
+
 @routers.mailboxes.get(
     "/{user_name}",
     responses={
         200: {"description": "Get a mailbox from their e-mail"},
         403: {"description": "Permission denied"},
         404: {"description": "Mailbox not found"},
+        504: {"description": "The mailbox is not in the source which answered in time"},
         422: {"description": "Email address is not well formed"},
     },
-    description="Fetch a mailbox <user_name> in domain <domain_name> (<user_name>@<domain_name>)",
+    description="Fetch a mailbox <user_name> in domain <domain_name> (<user_name>@<domain_name>). "
+    "Only the `fields` asked for are sent. The status comes from the last "
+    "reconciliation of OX and dovecot when it is up to date and OX is not needed "
+    "for the other fields.",
+    response_model=web_models.Mailbox,
 )
 async def get_mailbox(
     user_name: str,
@@ -24,8 +44,9 @@ async def get_mailbox(
     user: auth.DependsTokenUser,
     imap: dependencies.DependsDovecotDb,
     api: dependencies.DependsApiDb,
+    fields: dependencies.DependsMailboxFields,
     # alias_db: typing.Annotated[typing.Any, fastapi.Depends(sql_alias.get_alias_db)],
-) -> web_models.Mailbox:
+):
     log = logging.getLogger(__name__)
     email = f"{user_name}@{domain_name}"
     log.info(f"Nous cherchons qui est {email}")
@@ -36,7 +57,7 @@ async def get_mailbox(
         log.info(f"Permission denied on domain {domain_name} for current user")
         raise fastapi.HTTPException(status_code=403, detail="Permission denied")
 
-    db_domain = sql_api.get_domain(api, domain_name)
+    db_domain = await sql_api.aget_domain(api, domain_name)
     if db_domain is None:
         log.info(f"Le domaine {domain_name} n'existe pas dans la base API")
         raise fastapi.HTTPException(status_code=404, detail="Domain not found")
@@ -45,28 +66,47 @@ async def get_mailbox(
     if "webmail" in db_domain.features:
         with_webmail = True
 
-    ox_cluster = oxcli.OxCluster()
-    ctx = ox_cluster.get_context_by_domain(domain_name)
-
-    if with_webmail and ctx is None:
-        log.info("Aucun contexte ne gère le domaine chez OX (ce n'est pas normal)")
-    if not with_webmail and ctx:
-        log.info("Il y a un context pour ce domaine chez OX (ce n'est pas normal)")
-
-    ox_user = None
-    if ctx:
-        ox_user = ctx.get_user_by_email(email)
+    # The mailbox_state answers without OX when it is up to date and has all
+    # the fields (a mailbox it does not know may be new, we ask)
+    if db_domain.has_fresh_state() and set(fields) <= web_models.Mailbox.STATE_FIELDS:
+        state = await sql_api.aget_mailbox_state(api, email)
+        if state is not None:
+            return fastapi.responses.JSONResponse(
+                web_models.Mailbox.from_state(state).dump(fields)
+            )
 
-    if with_webmail and ox_user is None:
-        log.info("Le contexte OX ne connait pas cet email")
-    if not with_webmail and ox_user:
-        log.info("Le contexte OX connait cet email (ce n'est pas normal)")
+    # OX and dovecot are asked at the same time, OX only when the client
+    # wants some field from OX
+    with_ox = bool(set(fields) & web_models.Mailbox.OX_FIELDS)
+    lookups = {"imap": sql_dovecot.aget_user(imap, user_name, domain_name)}
+    if with_ox:
+        lookups["ox"] = get_ox_user(domain_name, email, with_webmail)
+    found = await utils.fanout.gather(**lookups)
+    missing = [source for source, value in found.items() if value is utils.fanout.MISSING]
+    if missing:
+        log.info(f"Pas de réponse à temps de {', '.join(missing)}")
+        found = {source: None if value is utils.fanout.MISSING else value
+                 for source, value in found.items()}
+    ox_user = found.get("ox")
+    db_user = found["imap"]
 
-    db_user = sql_dovecot.get_user(imap, user_name, domain_name)
-    if db_user is None:
+    if with_ox and "ox" not in missing:
+        if with_webmail and ox_user is None:
+            log.info("Le contexte OX ne connait pas cet email")
+        if not with_webmail and ox_user:
+            log.info("Le contexte OX connait cet email (ce n'est pas normal)")
+    if "imap" not in missing and db_user is None:
         log.info("La base dovecot ne contient pas cette adresse.")
 
     if db_user is None and ox_user is None:
+        if missing:
+            # The mailbox may be in the source which did not answer
+            raise fastapi.HTTPException(status_code=504, detail="Mailbox lookup timed out")
         raise fastapi.HTTPException(status_code=404, detail="Mailbox not found")
 
-    return web_models.Mailbox.from_both_users(ox_user, db_user, with_webmail)
+    if missing or not with_ox:
+        # We only know half of the story
+        mailbox = web_models.Mailbox.from_partial_users(ox_user, db_user, email)
+    else:
+        mailbox = web_models.Mailbox.from_both_users(ox_user, db_user, with_webmail)
+    return fastapi.responses.JSONResponse(mailbox.dump(fields))
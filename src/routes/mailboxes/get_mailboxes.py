@@ -1,26 +1,75 @@
+import bisect
 import logging
+import typing
 
 import fastapi
 
-from ... import auth, oxcli, sql_api, sql_dovecot, web_models
-from .. import dependencies, routers
+from ... import auth, oxcli, sql_api, sql_dovecot, utils, web_models
+from .. import dependencies, ndjson, routers
+from . import reconcile
+from .join import get_ox_users, join_users, name_states
+
+
+async def stream_mailboxes(
+    ox_users: list[oxcli.OxUser], domain_name: str, with_webmail: bool, partial: bool
+) -> typing.AsyncIterator[web_models.Mailbox]:
+    """The dovecot users are streamed from the database, in order, and joined
+    with the sorted OX users as they come."""
+    maker = sql_dovecot.get_amaker()
+    db = maker()
+    try:
+        db_users = sql_dovecot.astream_users(db, domain_name)
+        async for _, mailbox in join_users(ox_users, db_users, with_webmail, partial):
+            yield mailbox
+    finally:
+        await db.close()
+
+
+async def stream_states(
+    ox_users: list[oxcli.OxUser], domain_name: str, status: str | None
+) -> typing.AsyncIterator[web_models.Mailbox]:
+    """The states of the domain are streamed from the database, in order, and
+    named with the sorted OX users as they come."""
+    maker = sql_api.get_amaker()
+    db = maker()
+    try:
+        states = sql_api.astream_mailbox_states(db, domain_name, status)
+        async for mailbox in name_states(ox_users, states):
+            yield mailbox
+    finally:
+        await db.close()
 
 
 @routers.mailboxes.get(
     "/",
     responses={
-        200: {"description": "Get users from query request"},
+        200: {
+            "description": "Get users from query request",
+            "content": {ndjson.MEDIA_TYPE: {}},
+        },
         403: {"description": "Permission denied, insuficient permissions to perform the request"},
         404: {"description": "No users matched the query"},
+        504: {"description": "Neither OX nor dovecot answered in time"},
     },
+    description="Gets the mailboxes of the domain, paged (the next page is in the "
+    "X-Next-Cursor header), or all of them streamed as ndjson (with Accept: "
+    "application/x-ndjson). Only the `fields` asked for are sent. The status "
+    "comes from the last reconciliation of OX and dovecot when it is up to date "
+    "and OX is not needed for the other fields, or when filtering by `status`.",
+    response_model=list[web_models.Mailbox],
 )
 async def get_mailboxes(
+    request: fastapi.Request,
     imap: dependencies.DependsDovecotDb,
     api: dependencies.DependsApiDb,
     user: auth.DependsTokenUser,
+    page: dependencies.DependsPage,
+    fields: dependencies.DependsMailboxFields,
     domain_name: str,
-    #  page_size: int = 20,
-    #  page_number: int = 0,
+    status: typing.Annotated[
+        web_models.MailboxStatus | None,
+        fastapi.Query(description="Only the mailboxes with this status"),
+    ] = None,
 ):
     log = logging.getLogger(__name__)
     log.info(f"Searching mailboxes in domain {domain_name}\n")
@@ -30,7 +79,7 @@ async def get_mailboxes(
     if not perms.can_read(domain_name):
         raise fastapi.HTTPException(status_code=403, detail="Permission denied")
 
-    db_domain = sql_api.get_domain(api, domain_name)
+    db_domain = await sql_api.aget_domain(api, domain_name)
     if db_domain is None:
         raise fastapi.HTTPException(status_code=404, detail="Domain not found")
 
@@ -38,31 +87,105 @@ async def get_mailboxes(
     if "webmail" in db_domain.features:
         with_webmail = True
 
-    # Find the expected domain
-    ox_cluster = oxcli.OxCluster()
-    ctx = ox_cluster.get_context_by_domain(domain_name)
-    if with_webmail and ctx is None:
-        log.info(f"Le domaine {domain_name} est inconnu du cluster OX (ce n'est pas normal)")
-    if not with_webmail and ctx:
-        log.info(f"Le domaine {domain_name} est connu du cluster OX (ce n'est pas normal)")
+    # The mailbox_state answers without OX when it is up to date and has all
+    # the fields. A status filter always reads it: it is reconciled first when
+    # outdated.
+    fresh = db_domain.has_fresh_state()
+    if status is not None and not fresh:
+        log.info(f"Reconciliation des boites de {domain_name} pour filtrer leur statut")
+        counts = await utils.fanout.within("ox", reconcile.areconcile_domain(domain_name))
+        if counts is utils.fanout.MISSING:
+            raise fastapi.HTTPException(status_code=504, detail="Mailbox status lookup timed out")
+    if status is not None or (fresh and set(fields) <= web_models.Mailbox.STATE_FIELDS):
+        return await get_mailboxes_from_state(
+            request, api, page, fields, domain_name, with_webmail, status
+        )
 
-    ox_users = []
-    if ctx:
-        ox_users = ctx.list_users()
+    # When the client wants no field from OX, we do not ask OX at all
+    with_ox = bool(set(fields) & web_models.Mailbox.OX_FIELDS)
+
+    if ndjson.wanted(request):
+        # The dovecot users are streamed, only OX can time out
+        ox_users = []
+        if with_ox:
+            ox_users = await utils.fanout.within("ox", get_ox_users(domain_name, with_webmail))
+        partial = not with_ox or ox_users is utils.fanout.MISSING
+        if ox_users is utils.fanout.MISSING:
+            ox_users = []
+        return ndjson.response(
+            stream_mailboxes(ox_users, domain_name, with_webmail, partial), include=set(fields)
+        )
 
-    db_users = sql_dovecot.get_users(imap, domain_name)
+    # The OX and dovecot users are asked at the same time, and paged in
+    # lockstep, by (username, domain): each side gives its first limit + 1
+    # users after the cursor, the page is the first limit addresses of both.
+    after = page.after(2)
+    lookups = {
+        "imap": sql_dovecot.aget_users(imap, domain_name, limit=page.limit + 1, after=after),
+    }
+    if with_ox:
+        lookups["ox"] = get_ox_users(domain_name, with_webmail)
+    found = await utils.fanout.gather(**lookups)
+    missing = [source for source, value in found.items() if value is utils.fanout.MISSING]
+    if len(missing) == len(found):
+        raise fastapi.HTTPException(status_code=504, detail="No answer from OX nor dovecot")
+    if missing:
+        log.info(f"Pas de réponse à temps de {', '.join(missing)}")
+        found = {source: [] if value is utils.fanout.MISSING else value
+                 for source, value in found.items()}
+    partial = bool(missing) or not with_ox
 
-    emails = set([user.email for user in ox_users] + [user.email() for user in db_users])
-    ox_users_dict = {user.email: user for user in ox_users}
-    db_users_dict = {user.email(): user for user in db_users}
+    ox_users = found.get("ox", [])
+    start = 0
+    if after is not None:
+        start = bisect.bisect_right(ox_users, after, key=oxcli.OxUser.email_key)
+    ox_users = ox_users[start : start + page.limit + 1]
 
-    my_mailboxes = [
-        web_models.Mailbox.from_both_users(
-            ox_users_dict.get(email),
-            db_users_dict.get(email),
-            with_webmail,
-        )
-        for email in emails
+    mailboxes = [
+        item async for item in join_users(ox_users, found["imap"], with_webmail, partial)
     ]
+    mailboxes = page.cut(mailboxes[: page.limit + 1], lambda item: item[0])
+    return fastapi.responses.JSONResponse(
+        [mailbox.dump(fields) for (_, mailbox) in mailboxes],
+        headers=page.headers,
+    )
+
+
+async def get_mailboxes_from_state(
+    request: fastapi.Request,
+    api: dependencies.DependsApiDb,
+    page: dependencies.Page,
+    fields: list[web_models.MailboxField],
+    domain_name: str,
+    with_webmail: bool,
+    status: web_models.MailboxStatus | None,
+):
+    """The mailboxes from the mailbox_state, OX is only asked for the names."""
+    log = logging.getLogger(__name__)
+    ox_users = []
+    if set(fields) & (web_models.Mailbox.OX_FIELDS - {web_models.MailboxField.Status}):
+        ox_users = await utils.fanout.within("ox", get_ox_users(domain_name, with_webmail))
+        if ox_users is utils.fanout.MISSING:
+            log.info("Pas de réponse à temps de ox, les noms sont inconnus")
+            ox_users = []
+
+    if ndjson.wanted(request):
+        return ndjson.response(
+            stream_states(ox_users, domain_name, status), include=set(fields)
+        )
 
-    return my_mailboxes
+    after = page.after(2)
+    states = await sql_api.aget_mailbox_states(
+        api, domain_name, status, limit=page.limit + 1, after=after
+    )
+    states = page.cut(states, sql_api.DBMailboxState.key)
+    if states:
+        # Only the OX users of the page
+        start = bisect.bisect_left(ox_users, states[0].key(), key=oxcli.OxUser.email_key)
+        end = bisect.bisect_right(ox_users, states[-1].key(), key=oxcli.OxUser.email_key)
+        ox_users = ox_users[start:end]
+    mailboxes = [mailbox async for mailbox in name_states(ox_users, states)]
+    return fastapi.responses.JSONResponse(
+        [mailbox.dump(fields) for mailbox in mailboxes],
+        headers=page.headers,
+    )
@@ -0,0 +1,58 @@
+"""Joins the users of OX and of dovecot into mailboxes, for the listings and
+for the reconciliation of the mailbox_state."""
+import logging
+import typing
+
+from ... import oxcli, sql_api, sql_dovecot, utils, web_models
+
+
+def imap_key(db_user: sql_dovecot.ImapUser) -> tuple:
+    return (db_user.username, db_user.domain)
+
+
+async def join_users(
+    ox_users: list[oxcli.OxUser],
+    db_users: typing.Iterable | typing.AsyncIterable,
+    with_webmail: bool,
+    partial: bool = False,
+) -> typing.AsyncIterator[tuple]:
+    """The OX and dovecot users, both sorted by (username, domain), joined on
+    their address. Yields (key, mailbox). When OX or dovecot did not answer,
+    or was not asked (`partial`), the status of the mailboxes is unknown."""
+    async for key, ox_user, db_user in utils.merge.amerge_join(
+        ox_users, db_users, oxcli.OxUser.email_key, imap_key
+    ):
+        if partial:
+            mailbox = web_models.Mailbox.from_partial_users(ox_user, db_user, "@".join(key))
+        else:
+            mailbox = web_models.Mailbox.from_both_users(ox_user, db_user, with_webmail)
+        yield (key, mailbox)
+
+
+async def get_ox_users(domain_name: str, with_webmail: bool) -> list[oxcli.OxUser]:
+    """The OX users of the context of the domain, sorted once per snapshot of
+    the user index."""
+    log = logging.getLogger(__name__)
+    ox_cluster = oxcli.OxCluster()
+    ctx = await ox_cluster.aget_context_by_domain(domain_name)
+    if with_webmail and ctx is None:
+        log.info(f"Le domaine {domain_name} est inconnu du cluster OX (ce n'est pas normal)")
+    if not with_webmail and ctx:
+        log.info(f"Le domaine {domain_name} est connu du cluster OX (ce n'est pas normal)")
+
+    if ctx is None:
+        return []
+    return await ctx.alist_sorted_users()
+
+
+async def name_states(
+    ox_users: list[oxcli.OxUser],
+    states: typing.Iterable | typing.AsyncIterable,
+) -> typing.AsyncIterator[web_models.Mailbox]:
+    """The mailboxes of the stored states, with their names from the OX users,
+    both sorted by (username, domain)."""
+    async for _, ox_user, state in utils.merge.amerge_join(
+        ox_users, states, oxcli.OxUser.email_key, sql_api.DBMailboxState.key
+    ):
+        if state is not None:
+            yield web_models.Mailbox.from_state(state, ox_user)
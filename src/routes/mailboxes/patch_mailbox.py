@@ -5,7 +5,12 @@ import fastapi
 from ... import auth, oxcli, sql_api, sql_dovecot, web_models
 from .. import dependencies, routers
 
-@routers.mailboxes.patch("/{user_name}", status_code=200)
+@routers.mailboxes.patch(
+    "/{user_name}",
+    status_code=200,
+    # Like GET, without `fields`: the default ones
+    response_model_exclude={web_models.MailboxField.Active},
+)
 async def patch_mailbox(
     domain_name: str,
     user_name: str,
@@ -26,7 +31,7 @@ async def patch_mailbox(
         log.info(f"Permission denied on domain {domain_name} for current user")
         raise fastapi.HTTPException(status_code=403, detail="Permission denied")
 
-    domain_db = sql_api.get_domain(api, domain_name)
+    domain_db = await sql_api.aget_domain(api, domain_name)
     if domain_db is None:
         log.info(f"Domain not found in database {domain_name}")
         raise fastapi.HTTPException(status_code=404, detail="Domain not found")
@@ -36,7 +41,7 @@ async def patch_mailbox(
             log.info(f"Permission denied on target domain {updates.domain} for current user")
             raise fastapi.HTTPException(status_code=403, detail="Permission denied")
 
-        new_domain_db = sql_api.get_domain(api, updates.domain)
+        new_domain_db = await sql_api.aget_domain(api, updates.domain)
         if new_domain_db is None:
             log.info(f"Target domain not found in database {updates.domain}")
             raise fastapi.HTTPException(status_code=404, detail="Target domain not found")
@@ -51,7 +56,7 @@ async def patch_mailbox(
             detail="Feature 'mailbox' not available on the domain"
         )
 
-    db_user = sql_dovecot.get_user(imap, user_name, domain_name)
+    db_user = await sql_dovecot.aget_user(imap, user_name, domain_name)
     if db_user is None:
         log.info(f"La boite {user_name} n'existe pas pour le domain {domain_name}")
         raise fastapi.HTTPException(status_code=404, detail="Mailbox not found")
@@ -63,13 +68,13 @@ async def patch_mailbox(
     ox_user = None
     if "webmail" in domain_db.features:
         ox_cluster = oxcli.OxCluster()
-        ctx = ox_cluster.get_context_by_domain(domain_name)
+        ctx = await ox_cluster.aget_context_by_domain(domain_name)
 
         if ctx is None:
             log.info("Aucun contexte ne gère le domaine chez OX")
             raise fastapi.HTTPException(status_code=404, detail="Domain not found in open-xchange")
 
-        ox_user = ctx.get_user_by_email(email)
+        ox_user = await ctx.aget_user_by_email(email)
 
         if ox_user is None:
             log.info("Le contexte OX ne connait pas cet email")
@@ -85,8 +90,8 @@ async def patch_mailbox(
         if updates.displayName is not None:
             changes["displayName"] = updates.displayName
 
-        ox_user.change(**changes)
-        ox_user = ctx.get_user_by_email(email)
+        await ox_user.achange(**changes)
+        ox_user = await ctx.aget_user_by_email(email)
 
     return web_models.Mailbox.from_both_users(ox_user, db_user, "webmail" in domain_db.features)
 
@@ -4,7 +4,7 @@ import uuid
 
 import fastapi
 
-from ... import auth, oxcli, sql_api, sql_dovecot, web_models
+from ... import auth, oxcli, sql_api, sql_dovecot, utils, web_models
 from .. import dependencies, routers
 
 
@@ -28,23 +28,28 @@ async def post_mailbox(
         log.info(f"Cet utilisateur ne peut pas traiter le domaine {domain_name}")
         raise fastapi.HTTPException(status_code=403, detail="Permisison denied")
 
-    domain = sql_api.get_domain(db_api, domain_name)
+    # Hashed first: when the hashing pool is saturated (503), nothing is
+    # created yet, in OX or in dovecot
+    password = secrets.token_urlsafe(12)
+    hashed = await utils.hashing.ahash_password(password)
+
+    domain = await sql_api.aget_domain(db_api, domain_name)
     if domain.has_feature(web_models.Feature.Webmail):
         ox_cluster = oxcli.OxCluster()
-        ctx = ox_cluster.get_context_by_domain(domain_name)
+        ctx = await ox_cluster.aget_context_by_domain(domain_name)
         if ctx is None:
             log.error(f"Le domaine {domain_name} est inconnu du cluster OX")
             raise Exception("Le domaine est connu de la base API, mais pas de OX")
 
-        ctx.create_user(
+        await ctx.acreate_user(
             givenName=mailbox.givenName,
             surName=mailbox.surName,
             username=user_name,
             domain=domain_name,
         )
 
-    password = secrets.token_urlsafe(12)
-    imap_user = sql_dovecot.create_user(db, user_name, domain_name, password)
+    imap_user = await sql_dovecot.acreate_user(db, user_name, domain_name, hashed)
+    await sql_api.amark_mailboxes_changed(db_api, domain_name)
 
     return web_models.NewMailbox(
         email=imap_user.username + "@" + imap_user.domain,
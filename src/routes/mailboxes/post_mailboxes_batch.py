@@ -0,0 +1,115 @@
+import logging
+import secrets
+import uuid
+
+import fastapi
+
+from ... import auth, oxcli, sql_api, sql_dovecot, utils, web_models
+from .. import dependencies, routers
+
+
+@routers.mailboxes.post(
+    ":batch",
+    description="Create many mailboxes in dovecot and OX, with a single OX "
+    "session and a single dovecot transaction. The result of each item is "
+    "given in the same order as the request.",
+    status_code=200,
+)
+async def post_mailboxes_batch(
+    mailboxes: list[web_models.BatchMailbox],
+    user: auth.DependsTokenUser,
+    db: dependencies.DependsDovecotDb,
+    db_api: dependencies.DependsApiDb,
+    domain_name: str,
+) -> list[web_models.BatchMailboxResult]:
+    log = logging.getLogger(__name__)
+
+    perms = user.get_creds()
+    if not perms.can_read(domain_name):
+        log.info(f"Cet utilisateur ne peut pas traiter le domaine {domain_name}")
+        raise fastapi.HTTPException(status_code=403, detail="Permisison denied")
+
+    domain = await sql_api.aget_domain(db_api, domain_name)
+    if domain is None:
+        raise fastapi.HTTPException(status_code=404, detail="Domain not found")
+
+    results = [
+        web_models.BatchMailboxResult(
+            user_name=mailbox.user_name, status=web_models.BatchStatus.Created
+        )
+        for mailbox in mailboxes
+    ]
+
+    seen = set()
+    for result in results:
+        if result.user_name in seen:
+            result.status = web_models.BatchStatus.Conflict
+            result.detail = "Mailbox given twice in the batch"
+        seen.add(result.user_name)
+
+    existing = await sql_dovecot.aget_existing_usernames(db, domain_name, list(seen))
+    for result in results:
+        if result.status == web_models.BatchStatus.Created and result.user_name in existing:
+            result.status = web_models.BatchStatus.Conflict
+            result.detail = "Mailbox already exists"
+
+    todo = [
+        (mailbox, result)
+        for (mailbox, result) in zip(mailboxes, results)
+        if result.status == web_models.BatchStatus.Created
+    ]
+    log.info(f"Creating {len(todo)} mailboxes in domain {domain_name}")
+
+    # Hashed first: when the hashing pool is saturated (503), nothing is
+    # created yet, in OX or in dovecot
+    passwords = {mailbox.user_name: secrets.token_urlsafe(12) for (mailbox, _) in todo}
+    hashes = dict(
+        zip(passwords.keys(), await utils.hashing.ahash_passwords(list(passwords.values())))
+    )
+
+    ox_created = False
+    if todo and domain.has_feature(web_models.Feature.Webmail):
+        ox_cluster = oxcli.OxCluster()
+        ctx = await ox_cluster.aget_context_by_domain(domain_name)
+        if ctx is None:
+            log.error(f"Le domaine {domain_name} est inconnu du cluster OX")
+            raise Exception("Le domaine est connu de la base API, mais pas de OX")
+
+        ox_users = await ctx.acreate_users(
+            [
+                {
+                    "givenName": mailbox.givenName,
+                    "surName": mailbox.surName,
+                    "username": mailbox.user_name,
+                    "domain": domain_name,
+                }
+                for (mailbox, _) in todo
+            ]
+        )
+        for (_, result), ox_user in zip(todo, ox_users):
+            if isinstance(ox_user, Exception):
+                log.info(f"Failed to create {result.user_name} in OX: {ox_user}")
+                result.status = web_models.BatchStatus.Failed
+                result.detail = str(ox_user)
+        todo = [(mailbox, result) for (mailbox, result) in todo if result.detail is None]
+        ox_created = True
+
+    imap_users = await sql_dovecot.acreate_users(
+        db, domain_name, [(result.user_name, hashes[result.user_name]) for (_, result) in todo]
+    )
+    await sql_api.amark_mailboxes_changed(db_api, domain_name)
+    if imap_users is None:
+        for _, result in todo:
+            result.status = web_models.BatchStatus.Failed
+            result.detail = "Failed to create the mailbox in dovecot"
+            if ox_created:
+                result.detail += " (the OX user is created)"
+        return results
+
+    for _, result in todo:
+        result.mailbox = web_models.NewMailbox(
+            email=result.user_name + "@" + domain_name,
+            password=passwords[result.user_name],
+            uuid=uuid.uuid4(),
+        )
+    return results
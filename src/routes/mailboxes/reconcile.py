@@ -0,0 +1,138 @@
+"""Keeps the mailbox_state table (sql_api.DBMailboxState) up to date: a
+background task reconciles, one domain at a time, the users of OX and of
+dovecot, and stores the status of each mailbox, writing only the ones which
+changed.
+
+A domain is reconciled again when its state is older than
+mailbox_state_interval, or when its mailboxes were changed through the API
+(until then, the routes do not use its state)."""
+import asyncio
+import datetime
+import logging
+
+from ... import oxcli, sql_api, sql_dovecot, utils, web_models
+from .join import get_ox_users, imap_key
+
+log = logging.getLogger(__name__)
+
+reconcilers: list["Reconciler"] = []
+reconciled: dict[str, int] = {"domains": 0, "added": 0, "updated": 0, "removed": 0, "failed": 0}
+
+
+def make_state(
+    key: tuple,
+    ox_user: oxcli.OxUser | None,
+    db_user: sql_dovecot.ImapUser | None,
+    with_webmail: bool,
+    checked_at: datetime.datetime,
+) -> sql_api.DBMailboxState:
+    mailbox = web_models.Mailbox.from_both_users(ox_user, db_user, with_webmail)
+    return sql_api.DBMailboxState(
+        email="@".join(key),
+        username=key[0],
+        domain=key[1],
+        ox_uid=ox_user.uid if ox_user else None,
+        in_dovecot=db_user is not None,
+        active=mailbox.active,
+        status=str(mailbox.status),
+        updated_at=checked_at,
+    )
+
+
+async def areconcile_domain(domain_name: str) -> dict[str, int]:
+    """Reconciles the mailbox_state of a domain with OX and dovecot. Returns
+    how many states were added, updated and removed."""
+    checked_at = sql_api.mailbox_state.now()
+    api = sql_api.get_amaker()()
+    imap = sql_dovecot.get_amaker()()
+    try:
+        db_domain = await sql_api.aget_domain(api, domain_name)
+        if db_domain is None:
+            raise Exception(f"Domain {domain_name} not found")
+        with_webmail = "webmail" in db_domain.features
+
+        ox_users = await get_ox_users(domain_name, with_webmail)
+        db_users = sql_dovecot.astream_users(imap, domain_name)
+        states = (
+            make_state(key, ox_user, db_user, with_webmail, checked_at)
+            async for key, ox_user, db_user in utils.merge.amerge_join(
+                ox_users, db_users, oxcli.OxUser.email_key, imap_key
+            )
+        )
+        counts = await sql_api.areplace_mailbox_states(api, domain_name, states)
+        await sql_api.aset_state_checked(api, domain_name, checked_at)
+    finally:
+        await imap.close()
+        await api.close()
+
+    log.info(f"Reconciled the mailboxes of {domain_name}: {counts}")
+    reconciled["domains"] += 1
+    for name, count in counts.items():
+        reconciled[name] += count
+    return counts
+
+
+class Reconciler:
+    """Reconciles, in background, the domains whose mailbox_state is outdated,
+    the oldest first."""
+
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.task: asyncio.Task | None = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(max(self.interval / 10, 1))
+            try:
+                await self.reconcile_once()
+            except Exception as e:
+                log.error(f"Failed to list the domains to reconcile: {e}")
+
+    async def reconcile_once(self):
+        checked_before = (
+            sql_api.mailbox_state.now() - datetime.timedelta(seconds=self.interval)
+        )
+        api = sql_api.get_amaker()()
+        try:
+            domain_names = await sql_api.aget_domains_to_reconcile(api, checked_before)
+        finally:
+            await api.close()
+        for domain_name in domain_names:
+            try:
+                await areconcile_domain(domain_name)
+            except Exception as e:
+                reconciled["failed"] += 1
+                log.error(f"Failed to reconcile the mailboxes of {domain_name}: {e}")
+
+    def start(self):
+        self.task = asyncio.create_task(self.run(), name="mailbox-state-reconcile")
+
+    async def astop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+def start_reconcile(interval: int):
+    """Starts the background reconciliation, every `interval` seconds at most
+    for each domain, 0 to disable it. Must be called from the event loop of the
+    app."""
+    if not interval:
+        return
+    reconciler = Reconciler(interval)
+    reconciler.start()
+    reconcilers.append(reconciler)
+
+
+async def astop_reconcile():
+    while reconcilers:
+        await reconcilers.pop().astop()
+
+
+def stats() -> dict:
+    return {
+        "reconciled": reconciled,
+        "running": len(reconcilers) > 0,
+    }
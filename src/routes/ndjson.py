@@ -0,0 +1,50 @@
+"""The large listings can be streamed as ndjson (one json object per line),
+when the client asks for it with `Accept: application/x-ndjson`: the items are
+sent as they are read from the databases (and from OX), the listing is never
+all in memory."""
+import contextlib
+import typing
+
+import fastapi
+import fastapi.responses
+import pydantic
+
+MEDIA_TYPE = "application/x-ndjson"
+
+# We send the lines by pieces of about that size
+BUFFER = 64 * 1024
+
+# For the `responses` of the routes, in the openapi
+RESPONSES = {200: {"content": {MEDIA_TYPE: {}}}}
+
+
+def wanted(request: fastapi.Request) -> bool:
+    return MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def lines(
+    items: typing.AsyncIterator[pydantic.BaseModel], include: set | None = None
+) -> typing.AsyncIterator[str]:
+    # Closing the lines (when the client goes away) closes the items, and the
+    # sessions they use.
+    async with contextlib.aclosing(items):
+        buffer = []
+        size = 0
+        async for item in items:
+            line = item.model_dump_json(include=include) + "\n"
+            buffer.append(line)
+            size += len(line)
+            if size > BUFFER:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        yield "".join(buffer)
+
+
+def response(
+    items: typing.AsyncIterator[pydantic.BaseModel], include: set | None = None
+) -> fastapi.responses.StreamingResponse:
+    """The items are read as the response is sent, after the dependencies of the
+    route are closed: they need their own sessions. Only the fields in `include`
+    are sent, when given."""
+    return fastapi.responses.StreamingResponse(lines(items, include), media_type=MEDIA_TYPE)
@@ -32,3 +32,8 @@ allows = fastapi.APIRouter(
     tags=["admin allows"],
 )
 
+
+system = fastapi.APIRouter(
+    prefix="/system",
+    tags=["admin system"],
+)
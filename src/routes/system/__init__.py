@@ -0,0 +1,12 @@
+# ruff: noqa: E402
+from .get_drift import get_drift
+from .get_metrics import get_metrics
+from .post_drift import post_drift
+from .post_ox_refresh import post_ox_refresh
+
+__all__ = [
+    get_drift,
+    get_metrics,
+    post_drift,
+    post_ox_refresh,
+]
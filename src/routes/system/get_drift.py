@@ -0,0 +1,33 @@
+import typing
+
+import fastapi
+
+from ... import auth, drift, web_models
+from .. import ndjson, routers
+
+
+async def stream_drifts(
+    drifts: list[web_models.Drift],
+) -> typing.AsyncIterator[web_models.Drift]:
+    for item in drifts:
+        yield item
+
+
+@routers.system.get(
+    "/drift",
+    responses={
+        200: {"content": {ndjson.MEDIA_TYPE: {}}},
+        404: {"description": "No drift report yet"},
+    },
+    description="The last drift report (see POST /system/drift): its summary, or "
+    "all its drifts as ndjson (with Accept: application/x-ndjson)",
+)
+async def get_drift(
+    request: fastapi.Request,
+    user: auth.DependsBasicAdmin,
+) -> web_models.DriftReport:
+    if drift.report.last_report is None:
+        raise fastapi.HTTPException(status_code=404, detail="No drift report yet")
+    if ndjson.wanted(request):
+        return ndjson.response(stream_drifts(drift.report.last_drifts))
+    return drift.report.last_report
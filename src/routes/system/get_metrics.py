@@ -0,0 +1,27 @@
+from ... import auth, oxcli, sql_api, sql_dovecot, sql_postfix, utils
+from .. import mailboxes, routers
+
+
+@routers.system.get(
+    "/metrics",
+    description="Internal counters: what our OX caches hold, hits and misses, "
+    "the OX listings run and the ones saved by sharing them, "
+    "the load of the password hashing pool, the db sessions which hold a "
+    "connection (by provenance), the connection pools of the databases, the "
+    "lookups which timed out, and the reconciliation of the mailbox states",
+)
+async def get_metrics(
+    user: auth.DependsBasicAdmin,
+) -> dict:
+    return {
+        "ox": oxcli.get_cluster_stats(),
+        "hashing": utils.hashing.stats(),
+        "sessions": utils.provenance.stats(),
+        "lookups": utils.fanout.stats(),
+        "mailbox_state": mailboxes.reconcile.stats(),
+        "db": {
+            "api": utils.pool.stats(sql_api.get_amaker().kw["bind"]),
+            "imap": utils.pool.stats(sql_dovecot.get_amaker().kw["bind"]),
+            "postfix": utils.pool.stats(sql_postfix.get_amaker().kw["bind"]),
+        },
+    }
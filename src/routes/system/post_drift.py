@@ -0,0 +1,27 @@
+import logging
+
+import fastapi
+
+from ... import auth, config, drift, web_models
+from .. import routers
+
+
+@routers.system.post(
+    "/drift",
+    responses={
+        409: {"description": "A drift report is already running"},
+    },
+    description="Computes the drift between OX and dovecot on the whole cluster: "
+    "the users only in OX, the mailboxes only in dovecot (on the domains with the "
+    "webmail), and the addresses whose OX username is not the dovecot one. The "
+    "report is kept until the next run, see GET /system/drift",
+)
+async def post_drift(
+    user: auth.DependsBasicAdmin,
+) -> web_models.DriftReport:
+    log = logging.getLogger(__name__)
+    log.info("Computing the drift between OX and dovecot")
+    try:
+        return await drift.arun(config.settings.drift_parallel)
+    except drift.AlreadyRunning as e:
+        raise fastapi.HTTPException(status_code=409, detail=str(e))
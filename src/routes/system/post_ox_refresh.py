@@ -0,0 +1,18 @@
+import logging
+
+from ... import auth, oxcli, web_models
+from .. import routers
+
+
+@routers.system.post(
+    "/ox/refresh",
+    description="Forgets what we know about the OX contexts, and lists them again",
+)
+async def post_ox_refresh(
+    user: auth.DependsBasicAdmin,
+) -> list[web_models.Context]:
+    log = logging.getLogger(__name__)
+    ox_cluster = oxcli.OxCluster()
+    log.info(f"Refreshing the contexts of the OX cluster {ox_cluster.name}")
+    contexts = await ox_cluster.arefresh_contexts()
+    return [web_models.Context.from_ox(ctx) for ctx in contexts]
@@ -1,6 +1,8 @@
+import json
+
 import fastapi.testclient
 
-from .. import sql_api
+from .. import auth, sql_api
 
 
 def test_users__create(db_api, ox_cluster, client, log):
@@ -150,6 +152,82 @@ def test__update_a_user(log, client, admin):
     assert response.status_code == fastapi.status.HTTP_200_OK
 
 
+def test_users__creds_cache(db_api_session, log, client, admin, monkeypatch):
+    """With the credentials cache, argon2 is run once per credentials, and a
+    changed or revoked password is not accepted anymore."""
+    verified = []
+    averify_password = sql_api.DBUser.averify_password
+
+    async def counting_averify_password(self, password: str):
+        verified.append(self.name)
+        return await averify_password(self, password)
+
+    monkeypatch.setattr(sql_api.DBUser, "averify_password", counting_averify_password)
+    auth.creds_cache.configure(ttl=60)
+    try:
+        response = client.post(
+            "/users/",
+            json={"name": "script", "password": "old", "is_admin": True},
+            auth=(admin["user"], admin["password"]),
+        )
+        assert response.status_code == fastapi.status.HTTP_201_CREATED
+        verified.clear()
+
+        for _ in range(3):
+            response = client.get("/users/", auth=("script", "old"))
+            assert response.status_code == fastapi.status.HTTP_200_OK
+        assert verified == ["script"]
+
+        # A wrong password is always checked, and never cached
+        for _ in range(2):
+            response = client.get("/users/", auth=("script", "wrong"))
+            assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+        assert verified == ["script"] * 3
+
+        # Password rotation through the API
+        response = client.patch(
+            "/users/script",
+            json={"password": "new"},
+            auth=(admin["user"], admin["password"]),
+        )
+        assert response.status_code == fastapi.status.HTTP_200_OK
+        response = client.get("/users/", auth=("script", "old"))
+        assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+        response = client.get("/users/", auth=("script", "new"))
+        assert response.status_code == fastapi.status.HTTP_200_OK
+
+        # Password changed behind our back (e.g. by another process of the
+        # API): the cached entry does not match the hash in the db anymore
+        sql_api.update_user_password(db_api_session, "script", "newer")
+        response = client.get("/users/", auth=("script", "new"))
+        assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+        response = client.get("/users/", auth=("script", "newer"))
+        assert response.status_code == fastapi.status.HTTP_200_OK
+
+        # Not an admin anymore
+        response = client.patch(
+            "/users/script",
+            json={"is_admin": False},
+            auth=(admin["user"], admin["password"]),
+        )
+        assert response.status_code == fastapi.status.HTTP_200_OK
+        response = client.get("/users/", auth=("script", "newer"))
+        assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+        # Revocation
+        response = client.get("/token/", auth=("script", "newer"))
+        assert response.status_code == fastapi.status.HTTP_200_OK
+        response = client.delete("/users/script", auth=(admin["user"], admin["password"]))
+        assert response.status_code == fastapi.status.HTTP_204_NO_CONTENT
+        response = client.get("/token/", auth=("script", "newer"))
+        assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+        assert auth.creds_cache.cache.entries.keys() == {
+            auth.creds_cache.cache.digest(admin["user"], admin["password"])
+        }
+    finally:
+        auth.creds_cache.configure()
+
+
 def test_delete_user(db_api_session, log, client, admin):
     """Check that we can delete a user and that it will remove all the
     associated allows."""
@@ -381,6 +459,57 @@ def test_allows__create_allows(db_api_session, log, client):
     assert len(client.get("/allows/", auth=auth).json()) == 1
 
 
+def test_listings__pages(db_api_session, log, client):
+    """The listings are paged, the cursor of the next page is in a header."""
+    auth = ("admin", "admin_password")
+    sql_api.create_user(db_api_session, name=auth[0], password=auth[1], is_admin=True)
+    sql_api.create_user(db_api_session, name="user", password="password", is_admin=False)
+    names = [f"domain-{i}" for i in range(5)]
+    for name in names:
+        sql_api.create_domain(db_api_session, name=name, features=[])
+        sql_api.allow_domain_for_user(db_api_session, user="user", domain=name)
+
+    def get_all(url: str, limit: int) -> list:
+        items = []
+        cursor = ""
+        while True:
+            response = client.get(url, params={"limit": limit, "cursor": cursor}, auth=auth)
+            assert response.status_code == fastapi.status.HTTP_200_OK
+            assert len(response.json()) <= limit
+            items += response.json()
+            if "X-Next-Cursor" not in response.headers:
+                return items
+            cursor = response.headers["X-Next-Cursor"]
+
+    # A full page, without cursor
+    response = client.get("/domains/", auth=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert "X-Next-Cursor" not in response.headers
+    assert [domain["name"] for domain in response.json()] == names
+
+    for limit in [1, 2, 5]:
+        assert [domain["name"] for domain in get_all("/domains/", limit)] == names
+        assert [allow["domain"] for allow in get_all("/allows/", limit)] == names
+        assert [user["name"] for user in get_all("/users/", limit)] == ["admin", "user"]
+
+    # All the domains at once, as ndjson
+    response = client.get("/domains/", headers={"Accept": "application/x-ndjson"}, auth=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line)["name"] for line in lines] == names
+
+    # A cursor from another listing, or not a cursor at all
+    response = client.get("/domains/", params={"limit": 1}, auth=auth)
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/allows/", params={"cursor": cursor}, auth=auth)
+    assert response.status_code == fastapi.status.HTTP_400_BAD_REQUEST
+    response = client.get("/users/", params={"cursor": "nope"}, auth=auth)
+    assert response.status_code == fastapi.status.HTTP_400_BAD_REQUEST
+    response = client.get("/users/", params={"limit": 0}, auth=auth)
+    assert response.status_code == fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
 def test_allows__delete_allows(db_api_session, log, client):
     """Delete "allows" object."""
 
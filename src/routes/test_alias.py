@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 import fastapi
@@ -157,6 +159,15 @@ def test_alias__creates_and_fetch_an_alias(
     assert response.status_code == fastapi.status.HTTP_200_OK
     assert len(response.json()) == 3
 
+    # The same, streamed as ndjson
+    streamed = client.get(
+        f"/domains/{domain_name}/aliases/",
+        headers={"Authorization": f"Bearer {token}", "Accept": "application/x-ndjson"},
+    )
+    assert streamed.status_code == fastapi.status.HTTP_200_OK
+    assert streamed.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in streamed.text.splitlines()] == response.json()
+
     # We fetch the alias having 2 destinations and check the destinations
     # are correct
     response = client.get(
@@ -210,3 +221,109 @@ def test_alias__creates_and_fetch_an_alias(
     )
     assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
 
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "virgin_user",
+    ["virgin:empty"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_mail",
+    ["tutu.net"],
+    indirect=True,
+)
+def test_alias__bulk_import_and_export(
+        client,
+        normal_user,
+        virgin_user,
+        domain_mail,
+        db_postfix
+    ):
+    token = normal_user["token"]
+    virgin_token = virgin_user["token"]
+    domain_name = domain_mail["name"]
+
+    # The virgin user cannot import aliases
+    response = client.post(
+        f"/domains/{domain_name}/aliases:bulk",
+        json=[{"user_name": "from", "destination": "to@example.com"}],
+        headers={"Authorization": f"Bearer {virgin_token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+    # We import aliases as json, one of them is given twice
+    response = client.post(
+        f"/domains/{domain_name}/aliases:bulk",
+        json=[
+            {"user_name": "from", "destination": "to@example.com"},
+            {"user_name": "from", "destination": "other@example.com"},
+            {"user_name": "from", "destination": "to@example.com"},
+        ],
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert [res["status"] for res in response.json()] == ["created", "created", "conflict"]
+
+    # Then as csv, one of them already exists
+    response = client.post(
+        f"/domains/{domain_name}/aliases:bulk",
+        content="user_name,destination\nfrom,to@example.com\nsupport,\"a@example.com\"\n",
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "text/csv"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == [
+        {
+            "user_name": "from",
+            "destination": "to@example.com",
+            "status": "conflict",
+            "detail": "Alias already exists",
+        },
+        {
+            "user_name": "support",
+            "destination": "a@example.com",
+            "status": "created",
+            "detail": None,
+        },
+    ]
+
+    # A csv without the right columns is refused
+    response = client.post(
+        f"/domains/{domain_name}/aliases:bulk",
+        content="name,to\nfrom,to@example.com\n",
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "text/csv"},
+    )
+    assert response.status_code == fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    # The aliases are really there
+    response = client.get(
+        f"/domains/{domain_name}/aliases/",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert len(response.json()) == 3
+
+    # The export gives them back as csv, in the format of the import
+    response = client.get(
+        f"/domains/{domain_name}/aliases:export",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.text == (
+        "user_name,destination\n"
+        "from,other@example.com\n"
+        "from,to@example.com\n"
+        "support,a@example.com\n"
+    )
+
+    response = client.get(
+        f"/domains/{domain_name}/aliases:export",
+        headers={"Authorization": f"Bearer {virgin_token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
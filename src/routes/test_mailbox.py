@@ -1,7 +1,10 @@
+import asyncio
+import json
+
 import fastapi.testclient
 import pytest
 
-from .. import sql_dovecot
+from .. import oxcli, sql_dovecot, utils
 
 
 # Dans la première serie de tests, on travaille sur un domaine avec le webmail.
@@ -460,3 +463,409 @@ def test_without_mail(client, admin_token, domain, db_dovecot_session):
     )
     assert response.status_code == fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY
 
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "virgin_user",
+    ["bidi:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_web",
+    ["tutu.net:dimail"],
+    indirect=True,
+)
+def test_batch(client, normal_user, virgin_user, domain_web, db_dovecot_session, monkeypatch):
+    token = normal_user["token"]
+    virgin_token = virgin_user["token"]
+    domain_name = domain_web["name"]
+
+    def item(user_name):
+        return {
+            "user_name": user_name,
+            "givenName": "Test",
+            "surName": user_name.capitalize(),
+            "displayName": f"Test {user_name}",
+        }
+
+    # Le virgin_user ne peut pas créer de mailbox -> forbidden
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes:batch",
+        json=[item("un")],
+        headers={"Authorization": f"Bearer {virgin_token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+    # Une boite existe déjà, une autre est en double dans la demande
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/deja",
+        json={"givenName": "Test", "surName": "Deja", "displayName": "Test deja"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes:batch",
+        json=[item("un"), item("deja"), item("deux"), item("un")],
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    got = response.json()
+    assert [(res["user_name"], res["status"]) for res in got] == [
+        ("un", "created"),
+        ("deja", "conflict"),
+        ("deux", "created"),
+        ("un", "conflict"),
+    ]
+    assert got[1]["detail"] == "Mailbox already exists"
+    assert got[3]["mailbox"] is None
+
+    # Les boites créées sont en imap (avec leur mot de passe) et dans OX
+    for res in [got[0], got[2]]:
+        assert res["mailbox"]["email"] == f"{res['user_name']}@{domain_name}"
+        imap_user = sql_dovecot.get_user(db_dovecot_session, res["user_name"], domain_name)
+        assert imap_user.check_password(res["mailbox"]["password"])
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/deux",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json()["status"] == "ok"
+    assert response.json()["surName"] == "Deux"
+
+    # La liste des boites, page par page (OX et dovecot avancent ensemble)
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert "X-Next-Cursor" not in response.headers
+    response_full = response
+    emails = [mailbox["email"] for mailbox in response.json()]
+    # (le contexte OX a aussi son oxadmin)
+    assert set(emails) >= {f"{name}@{domain_name}" for name in ["deja", "deux", "un"]}
+    assert len(emails) > 2
+    # triées par nom, puis par domaine
+    assert emails == sorted(emails, key=lambda email: email.rpartition("@")[::2])
+
+    paged = []
+    cursor = ""
+    while True:
+        response = client.get(
+            f"/domains/{domain_name}/mailboxes/",
+            params={"limit": 2, "cursor": cursor},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == fastapi.status.HTTP_200_OK
+        assert len(response.json()) <= 2
+        paged += [mailbox["email"] for mailbox in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        cursor = response.headers["X-Next-Cursor"]
+    assert paged == emails
+
+    # Ou toutes les boites d'un coup, en ndjson
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/",
+        headers={"Authorization": f"Bearer {token}", "Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    streamed = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(mailbox["email"] for mailbox in streamed) == sorted(emails)
+    assert {mailbox["email"]: mailbox for mailbox in streamed} == {
+        mailbox["email"]: mailbox for mailbox in response_full.json()
+    }
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/",
+        params={"cursor": "pas un curseur"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_400_BAD_REQUEST
+
+    # Le pool de hachage est saturé -> 503, et rien n'est créé dans OX
+    ctx = oxcli.OxCluster().get_context_by_domain(domain_name)
+    monkeypatch.setattr(utils.hashing.hasher, "max_pending", 0)
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes:batch",
+        json=[item("trois")],
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_503_SERVICE_UNAVAILABLE
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/quatre",
+        json={"givenName": "Test", "surName": "Quatre", "displayName": "Test quatre"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_503_SERVICE_UNAVAILABLE
+    assert ctx.get_user_by_name("trois") is None
+    assert ctx.get_user_by_name("quatre") is None
+    monkeypatch.undo()
+
+    # La transaction dovecot échoue -> chaque boite est en échec
+    async def failed(*args):
+        return None
+
+    monkeypatch.setattr(sql_dovecot, "acreate_users", failed)
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes:batch",
+        json=[item("trois"), item("deja")],
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    got = response.json()
+    assert [(res["user_name"], res["status"]) for res in got] == [
+        ("trois", "failed"),
+        ("deja", "conflict"),
+    ]
+    assert got[0]["detail"] == "Failed to create the mailbox in dovecot (the OX user is created)"
+    assert got[0]["mailbox"] is None
+    monkeypatch.undo()
+
+    # Sur un domaine inconnu -> forbidden (seul un admin aurait un not found)
+    response = client.post(
+        "/domains/unknown.org/mailboxes:batch",
+        json=[item("un")],
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_web",
+    ["tutu.net:dimail"],
+    indirect=True,
+)
+def test_lookup_timeouts(client, normal_user, domain_web, db_dovecot_session, monkeypatch):
+    token = normal_user["token"]
+    domain_name = domain_web["name"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/lent",
+        json={"givenName": "Test", "surName": "Lent", "displayName": "Test lent"},
+        headers=auth,
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+
+    # OX est trop lent : on répond avec dovecot seul, en statut inconnu
+    async def slow_ox(*args, **kwargs):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(utils.fanout, "timeouts", {"ox": 0.05, "imap": 0})
+    monkeypatch.setattr(oxcli.OxContext, "aget_user_by_email", slow_ox)
+    monkeypatch.setattr(oxcli.OxContext, "alist_sorted_users", slow_ox)
+
+    response = client.get(f"/domains/{domain_name}/mailboxes/lent", headers=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json()["status"] == "unknown"
+    assert response.json()["email"] == f"lent@{domain_name}"
+
+    # Une boite que dovecot ne connait pas est peut-être chez OX
+    response = client.get(f"/domains/{domain_name}/mailboxes/personne", headers=auth)
+    assert response.status_code == fastapi.status.HTTP_504_GATEWAY_TIMEOUT
+
+    response = client.get(f"/domains/{domain_name}/mailboxes/", headers=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert [(mailbox["email"], mailbox["status"]) for mailbox in response.json()] == [
+        (f"lent@{domain_name}", "unknown"),
+    ]
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/",
+        headers=auth | {"Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert [json.loads(line)["status"] for line in response.text.splitlines()] == ["unknown"]
+
+    assert utils.fanout.timed_out["ox"] >= 4
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_web",
+    ["tutu.net:dimail"],
+    indirect=True,
+)
+def test_fields(client, normal_user, domain_web, db_dovecot_session, monkeypatch):
+    token = normal_user["token"]
+    domain_name = domain_web["name"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/choix",
+        json={"givenName": "Test", "surName": "Choix", "displayName": "Test Choix"},
+        headers=auth,
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+
+    # Par défaut, pas de champ 'active'
+    response = client.get(f"/domains/{domain_name}/mailboxes/choix", headers=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert "active" not in response.json()
+    assert response.json()["displayName"] == "Test Choix"
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/choix?fields=email,displayName,active", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == {
+        "email": f"choix@{domain_name}",
+        "displayName": "Test Choix",
+        "active": True,
+    }
+
+    # Sans champ venant d'OX, on ne demande rien à OX
+    async def no_ox(*args, **kwargs):
+        raise Exception("OX should not be asked")
+
+    monkeypatch.setattr(oxcli.OxCluster, "aget_context_by_domain", no_ox)
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/choix?fields=email,active", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == {"email": f"choix@{domain_name}", "active": True}
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/personne?fields=email", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/?fields=email,active", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == [{"email": f"choix@{domain_name}", "active": True}]
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/?fields=email,type",
+        headers=auth | {"Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"type": "mailbox", "email": f"choix@{domain_name}"},
+    ]
+
+    # Un champ qui n'existe pas
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/choix?fields=email,password", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_web",
+    ["tutu.net:dimail"],
+    indirect=True,
+)
+def test_mailbox_state(client, normal_user, domain_web, db_dovecot_session, monkeypatch):
+    token = normal_user["token"]
+    domain_name = domain_web["name"]
+    auth = {"Authorization": f"Bearer {token}"}
+
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/etat",
+        json={"givenName": "Test", "surName": "Etat", "displayName": "Test Etat"},
+        headers=auth,
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+
+    # Une boite dans dovecot, mais pas chez OX : elle est cassée
+    sql_dovecot.create_user(db_dovecot_session, "cassee", domain_name, "toto")
+
+    # Le filtre sur le statut réconcilie le domaine, puis lit mailbox_state
+    # (oxadmin est chez OX, mais pas dans dovecot)
+    response = client.get(f"/domains/{domain_name}/mailboxes/?status=broken", headers=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert [(mailbox["email"], mailbox["status"]) for mailbox in response.json()] == [
+        (f"cassee@{domain_name}", "broken"),
+        (f"oxadmin@{domain_name}", "broken"),
+    ]
+
+    response = client.get(f"/domains/{domain_name}/mailboxes/?status=ok", headers=auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == [
+        {
+            "type": "mailbox",
+            "status": "ok",
+            "email": f"etat@{domain_name}",
+            "givenName": "Test",
+            "surName": "Etat",
+            "displayName": "Test Etat",
+        },
+    ]
+
+    # Tant que l'état est à jour, le statut se lit sans demander à OX
+    async def no_ox(*args, **kwargs):
+        raise Exception("OX should not be asked")
+
+    monkeypatch.setattr(oxcli.OxCluster, "aget_context_by_domain", no_ox)
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/?fields=email,status&limit=1", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == [{"email": f"cassee@{domain_name}", "status": "broken"}]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/?fields=email,status&limit=1&cursor={cursor}",
+        headers=auth,
+    )
+    assert response.json() == [{"email": f"etat@{domain_name}", "status": "ok"}]
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/?status=broken&fields=email,active",
+        headers=auth | {"Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"email": f"cassee@{domain_name}", "active": True},
+        {"email": f"oxadmin@{domain_name}", "active": None},
+    ]
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/cassee?fields=email,status", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == {"email": f"cassee@{domain_name}", "status": "broken"}
+
+    # Une boite créée par l'API rend l'état périmé, jusqu'à la prochaine
+    # réconciliation
+    monkeypatch.undo()
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/nouvelle",
+        json={"givenName": "Test", "surName": "Nouvelle", "displayName": "Test Nouvelle"},
+        headers=auth,
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/?status=ok&fields=email", headers=auth
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == [
+        {"email": f"etat@{domain_name}"},
+        {"email": f"nouvelle@{domain_name}"},
+    ]
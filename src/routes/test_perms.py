@@ -1,10 +1,14 @@
+import collections
+
 import pytest
 
 import fastapi
 import jwt
+import sqlalchemy as sa
 import datetime
+import time
 
-from .. import config
+from .. import auth, config, sql_api, sql_dovecot, sql_postfix
 
 
 @pytest.mark.parametrize(
@@ -137,3 +141,206 @@ def test_weird_tokens(db_api, db_dovecot, log, client, normal_user, domain_mail)
     assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
 
 
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_mail",
+    ["tutu.net"],
+    indirect=True,
+)
+def test_jwt_claims(db_api, db_dovecot, log, client, admin, normal_user, domain_mail, monkeypatch):
+    domain_name = domain_mail["name"]
+    old_token = normal_user["token"]
+
+    users_read = []
+    aget_user = sql_api.aget_user
+
+    async def counting_aget_user(db, user_name):
+        users_read.append(user_name)
+        return await aget_user(db, user_name)
+
+    monkeypatch.setattr(sql_api, "aget_user", counting_aget_user)
+    monkeypatch.setattr(config.settings, "jwt_claims", True)
+
+    response = client.get("/token/", auth=(normal_user["user"], normal_user["password"]))
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    token = response.json()["access_token"]
+    claims = jwt.decode(token, config.settings["JWT_SECRET"], "HS256")
+    assert claims["adm"] is False
+    assert claims["dom"] == [domain_name]
+
+    # Avec les permissions dans le token, on ne lit pas l'utilisateur en base
+    users_read.clear()
+    for domain, status in [
+        (domain_name, fastapi.status.HTTP_404_NOT_FOUND),
+        ("example.com", fastapi.status.HTTP_403_FORBIDDEN),
+    ]:
+        response = client.get(
+            f"/domains/{domain}/mailboxes/toto",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == status
+    assert users_read == []
+
+    # Les anciens tokens, sans permissions, marchent toujours (via la base)
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/toto",
+        headers={"Authorization": f"Bearer {old_token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+    assert users_read == [normal_user["user"]]
+
+    # Un token dont les permissions viennent d'un autre processus (ou d'avant
+    # un redémarrage) n'est pas cru sur parole
+    forged = jwt.encode(
+        {**claims, "pv": "another-epoch.0", "dom": [domain_name, "example.com"]},
+        config.settings["JWT_SECRET"],
+        "HS256",
+    )
+    response = client.get(
+        "/domains/example.com/mailboxes/toto",
+        headers={"Authorization": f"Bearer {forged}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+    # Quand on retire un domaine à l'utilisateur, son token ne suffit plus
+    response = client.delete(
+        f"/allows/{domain_name}/{normal_user['user']}",
+        auth=(admin["user"], admin["password"]),
+    )
+    assert response.status_code == fastapi.status.HTTP_204_NO_CONTENT
+    users_read.clear()
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/toto",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+    assert users_read == [normal_user["user"]]
+
+    # Et quand on lui en donne un, il l'a tout de suite
+    response = client.post(
+        "/allows/",
+        json={"user": normal_user["user"], "domain": domain_name},
+        auth=(admin["user"], admin["password"]),
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/toto",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_mail",
+    ["example.com"],
+    indirect=True,
+)
+def test_token_cache(db_api, db_dovecot, log, client, normal_user, domain_mail, monkeypatch):
+    secret = config.settings["JWT_SECRET"]
+    domain_name = domain_mail["name"]
+
+    decoded = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    monkeypatch.setattr(auth.token_user.token_user, "cache_size", 2)
+
+    # Un token qui expire dans 2 secondes
+    expire = int(datetime.datetime.now(datetime.timezone.utc).timestamp()) + 2
+    token = jwt.encode({"sub": normal_user["user"], "exp": expire}, secret, "HS256")
+
+    # On ne vérifie la signature qu'une fois
+    for _ in range(3):
+        response = client.get(
+            f"/domains/{domain_name}/mailboxes/toto",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+    assert decoded == [token]
+
+    # Le cache est borné
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/toto",
+        headers={"Authorization": f"Bearer {normal_user['token']}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/toto",
+        headers={"Authorization": "Bearer not-a-valid-token"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+    assert len(auth.token_user.token_user.cache) <= 2
+
+    # Même dans le cache, un token expiré est refusé
+    time.sleep(max(expire + 1 - time.time(), 0))
+    decoded.clear()
+    response = client.get(
+        f"/domains/{domain_name}/mailboxes/toto",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+    assert decoded == []
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_mail",
+    ["tutu.net"],
+    indirect=True,
+)
+def test_one_connection_per_request(
+    db_api, db_dovecot, db_postfix, log, client, admin, normal_user, domain_mail
+):
+    # The auth and the route share the session (and the connection) of the
+    # request: we count the connections taken from the pools, per request.
+    engines = {
+        "api": sql_api.get_amaker().kw["bind"].sync_engine,
+        "dovecot": sql_dovecot.get_amaker().kw["bind"].sync_engine,
+        "postfix": sql_postfix.get_amaker().kw["bind"].sync_engine,
+    }
+    checkouts = collections.Counter()
+    listeners = {}
+    for name, engine in engines.items():
+        listeners[name] = lambda *args, name=name: checkouts.update([name])
+        sa.event.listen(engine, "checkout", listeners[name])
+
+    domain_name = domain_mail["name"]
+    basic_admin = {"auth": (admin["user"], admin["password"])}
+    basic_user = {"auth": (normal_user["user"], normal_user["password"])}
+    bearer = {"headers": {"Authorization": f"Bearer {normal_user['token']}"}}
+    try:
+        for path, auth, status in [
+            ("/users/", basic_admin, fastapi.status.HTTP_200_OK),
+            ("/allows/", basic_admin, fastapi.status.HTTP_200_OK),
+            ("/token/", basic_user, fastapi.status.HTTP_200_OK),
+            (f"/domains/{domain_name}", bearer, fastapi.status.HTTP_200_OK),
+            (f"/domains/{domain_name}/mailboxes/toto", bearer, fastapi.status.HTTP_404_NOT_FOUND),
+            (f"/domains/{domain_name}/aliases/", bearer, fastapi.status.HTTP_200_OK),
+        ]:
+            checkouts.clear()
+            response = client.get(path, **auth)
+            assert response.status_code == status
+            assert checkouts["api"] == 1, path
+            assert max(checkouts.values()) == 1, path
+    finally:
+        for name, engine in engines.items():
+            sa.event.remove(engine, "checkout", listeners[name])
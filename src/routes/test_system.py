@@ -0,0 +1,112 @@
+import json
+
+import fastapi.testclient
+import pytest
+
+from .. import drift, sql_dovecot, utils
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_web",
+    ["tutu.net,target.fr:dimail;other.org:ctx2"],
+    indirect=True,
+)
+def test_system__ox_refresh(client, admin, normal_user, domain_web):
+    # Only admins can refresh the OX contexts
+    response = client.post("/system/ox/refresh", auth=("bidibule", "toto"))
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+    response = client.post("/system/ox/refresh", auth=(admin["user"], admin["password"]))
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    contexts = sorted(response.json(), key=lambda ctx: ctx["cid"])
+    assert [ctx["name"] for ctx in contexts] == ["dimail", "ctx2"]
+    assert contexts[0]["domains"] == ["target.fr", "tutu.net"]
+    assert contexts[1]["domains"] == ["other.org"]
+
+
+def test_system__metrics(client, admin, ox_cluster):
+    response = client.get("/system/metrics", auth=(admin["user"], admin["password"]))
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    stats = response.json()["ox"][ox_cluster.name]
+    assert set(stats["contexts"].keys()) == {"contexts", "age"}
+    assert set(stats["users"].keys()) == {"contexts", "users", "hits", "misses", "refreshes"}
+
+
+def test_system__hashing_busy(client, admin, monkeypatch):
+    # The password hashing pool is saturated: we answer 503, and the client
+    # can retry later
+    monkeypatch.setattr(utils.hashing.hasher, "max_pending", 0)
+    response = client.get("/token/", auth=(admin["user"], admin["password"]))
+    assert response.status_code == fastapi.status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["retry-after"] == "1"
+
+    monkeypatch.undo()
+    response = client.get("/system/metrics", auth=(admin["user"], admin["password"]))
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert set(response.json()["hashing"].keys()) == {"workers", "pending", "max_pending"}
+    # The only session holding a connection is the one of this very request
+    sessions = response.json()["sessions"]
+    assert sessions["sample_rate"] == 1
+    assert list(sessions["open"].values()) == [1]
+    assert list(sessions["open"].keys())[0].endswith("for GET /system/metrics")
+    assert set(response.json()["db"].keys()) == {"api", "imap", "postfix"}
+    assert response.json()["db"]["api"]["checked_out"] == 1
+
+
+@pytest.mark.parametrize(
+    "normal_user",
+    ["bidibule:toto"],
+    indirect=True,
+)
+@pytest.mark.parametrize(
+    "domain_web",
+    ["tutu.net:dimail"],
+    indirect=True,
+)
+def test_system__drift(client, admin, normal_user, domain_web, db_dovecot_session, monkeypatch):
+    monkeypatch.setattr(drift.report, "last_report", None)
+    admin_auth = (admin["user"], admin["password"])
+    domain_name = domain_web["name"]
+
+    response = client.get("/system/drift", auth=admin_auth)
+    assert response.status_code == fastapi.status.HTTP_404_NOT_FOUND
+
+    # Une boite en règle, et une autre qui n'est que dans dovecot
+    response = client.post(
+        f"/domains/{domain_name}/mailboxes/ok",
+        json={"givenName": "Test", "surName": "Ok", "displayName": "Test Ok"},
+        headers={"Authorization": f"Bearer {normal_user['token']}"},
+    )
+    assert response.status_code == fastapi.status.HTTP_201_CREATED
+    sql_dovecot.create_user(db_dovecot_session, "seule", domain_name, "toto")
+
+    # Only admins can compute the drift
+    response = client.post("/system/drift", auth=("bidibule", "toto"))
+    assert response.status_code == fastapi.status.HTTP_403_FORBIDDEN
+
+    response = client.post("/system/drift", auth=admin_auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    report = response.json()
+    assert report["imap_users"] == 2
+    assert report["domains"][domain_name] == {"ox_only": 1, "dovecot_only": 1}
+
+    response = client.get("/system/drift", auth=admin_auth)
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    assert response.json() == report
+
+    response = client.get(
+        "/system/drift", auth=admin_auth, headers={"Accept": "application/x-ndjson"}
+    )
+    assert response.status_code == fastapi.status.HTTP_200_OK
+    drifts = [json.loads(line) for line in response.text.splitlines()]
+    assert [
+        (item["kind"], item["email"]) for item in drifts if item["domain"] == domain_name
+    ] == [
+        ("ox_only", f"oxadmin@{domain_name}"),
+        ("dovecot_only", f"seule@{domain_name}"),
+    ]
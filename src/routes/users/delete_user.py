@@ -10,11 +10,12 @@ async def delete_user(
     user: auth.DependsBasicAdmin,
     user_name: str,
 ) -> None:
-    user_db = sql_api.get_user(db, user_name)
+    user_db = await sql_api.aget_user(db, user_name)
     if user_db is None:
         raise fastapi.HTTPException(status_code=404, detail="Not found")
 
-    sql_api.delete_allows_by_user(db, user_name)
-    sql_api.delete_user(db, user_name)
+    await sql_api.adelete_allows_by_user(db, user_name)
+    await sql_api.adelete_user(db, user_name)
+    auth.creds_cache.forget(user_name)
     return None
 
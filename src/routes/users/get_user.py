@@ -10,7 +10,7 @@ async def get_user(
     user: auth.DependsBasicAdmin,
     user_name: str,
 ) -> web_models.User:
-    user_db = sql_api.get_user(db, user_name)
+    user_db = await sql_api.aget_user(db, user_name)
     if user_db is None:
         raise fastapi.HTTPException(status_code=404, detail="User not found")
     return web_models.User.from_db(user_db)
@@ -6,6 +6,8 @@ from .. import dependencies, routers
 async def get_users(
     db: dependencies.DependsApiDb,
     user: auth.DependsBasicAdmin,
+    page: dependencies.DependsPage,
 ) -> list[web_models.User]:
-    users = sql_api.get_users(db)
+    users = await sql_api.aget_users(db, limit=page.limit + 1, after=page.after(1))
+    users = page.cut(users, lambda user: (user.name,))
     return [web_models.User.from_db(user) for user in users]
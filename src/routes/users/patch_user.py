@@ -13,15 +13,18 @@ async def patch_user(
 ) -> web_models.User:
     """Updates a user."""
 
-    user_db = sql_api.get_user(db, user)
+    user_db = await sql_api.aget_user(db, user)
 
     if user_db is None:
         raise fastapi.HTTPException(status_code=404, detail="Not found")
 
+    # Whatever changes, the credentials checked before are not trusted anymore
+    auth.creds_cache.forget(user)
+
     if updates.password is not None:
-        user_db = sql_api.update_user_password(db, user, updates.password)
+        user_db = await sql_api.aupdate_user_password(db, user, updates.password)
 
     if updates.is_admin is not None:
-        user_db = sql_api.update_user_is_admin(db, user, updates.is_admin)
+        user_db = await sql_api.aupdate_user_is_admin(db, user, updates.is_admin)
 
     return web_models.User.from_db(user_db)
@@ -12,12 +12,12 @@ async def post_user(
 ) -> web_models.User:
     """Create user."""
 
-    user_db = sql_api.get_user(db, user.name)
+    user_db = await sql_api.aget_user(db, user.name)
 
     if user_db is not None:
         raise fastapi.HTTPException(status_code=409, detail="User already exists")
 
-    user_db = sql_api.create_user(
+    user_db = await sql_api.acreate_user(
         db, name=user.name, password=user.password, is_admin=user.is_admin
     )
 
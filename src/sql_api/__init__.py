@@ -1,4 +1,9 @@
 from .allow import (
+    aallow_domain_for_user,
+    adelete_allows_by_user,
+    adeny_domain_for_user,
+    aget_allowed,
+    aget_allows,
     allow_domain_for_user,
     delete_allows_by_user,
     deny_domain_for_user,
@@ -6,10 +11,35 @@ from .allow import (
     get_allows,
 )
 from .creds import Creds
-from .database import Api, get_maker, init_db
-from .domain import create_domain, get_domain, get_domains
-from .models import DBAllowed, DBDomain, DBUser
+from .database import Api, get_amaker, get_db, get_maker, init_db
+from .domain import (
+    acreate_domain,
+    aget_domain,
+    aget_domains,
+    astream_domains,
+    create_domain,
+    get_domain,
+    get_domains,
+)
+from .mailbox_state import (
+    aget_domains_to_reconcile,
+    aget_mailbox_state,
+    aget_mailbox_states,
+    amark_mailboxes_changed,
+    areplace_mailbox_states,
+    aset_state_checked,
+    astream_mailbox_states,
+)
+from .models import DBAllowed, DBDomain, DBMailboxState, DBUser
+from .perms import bump_perm_version, get_perm_version
 from .user import (
+    acount_users,
+    acreate_user,
+    adelete_user,
+    aget_user,
+    aget_users,
+    aupdate_user_is_admin,
+    aupdate_user_password,
     count_users,
     create_user,
     delete_user,
@@ -20,20 +50,48 @@ from .user import (
 )
 
 __all__ = [
+    aallow_domain_for_user,
+    acount_users,
+    acreate_domain,
+    acreate_user,
+    adelete_allows_by_user,
+    adelete_user,
+    adeny_domain_for_user,
+    aget_allowed,
+    aget_allows,
+    aget_domain,
+    aget_domains,
+    aget_domains_to_reconcile,
+    aget_mailbox_state,
+    aget_mailbox_states,
+    aget_user,
+    aget_users,
     allow_domain_for_user,
+    amark_mailboxes_changed,
     Api,
+    areplace_mailbox_states,
+    aset_state_checked,
+    astream_domains,
+    astream_mailbox_states,
+    aupdate_user_is_admin,
+    aupdate_user_password,
+    bump_perm_version,
     delete_allows_by_user,
     deny_domain_for_user,
     get_allowed,
     get_allows,
     Creds,
+    get_amaker,
+    get_db,
     get_maker,
     init_db,
     create_domain,
     get_domain,
     get_domains,
+    get_perm_version,
     DBAllowed,
     DBDomain,
+    DBMailboxState,
     DBUser,
     count_users,
     create_user,
@@ -1,7 +1,9 @@
 import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.orm as orm
 
-from . import models
+from .. import utils
+from . import models, perms
 
 
 def get_allows(db: orm.Session, user: str = "", domain: str = ""):
@@ -13,21 +15,55 @@ def get_allows(db: orm.Session, user: str = "", domain: str = ""):
     return query.all()
 
 
+async def aget_allows(
+    db: sa_async.AsyncSession,
+    user: str = "",
+    domain: str = "",
+    limit: int | None = None,
+    after: tuple | None = None,
+):
+    """Ordered by user and domain, see utils.cursor for `limit` and `after`."""
+    stmt = sa.select(models.DBAllowed)
+    if user != "":
+        stmt = stmt.filter_by(user=user)
+    if domain != "":
+        stmt = stmt.filter_by(domain=domain)
+    stmt = utils.cursor.paged(
+        stmt, [models.DBAllowed.user, models.DBAllowed.domain], limit, after
+    )
+    return (await db.scalars(stmt)).all()
+
+
 def get_allowed(db: orm.Session, user: str, domain: str) -> models.DBAllowed:
     return db.get(models.DBAllowed, {"domain": domain, "user": user})
     return db.query(models.DBAllowed).filter_by(domain=domain, user=user).first()
 
 
+async def aget_allowed(db: sa_async.AsyncSession, user: str, domain: str) -> models.DBAllowed:
+    return await db.get(models.DBAllowed, {"domain": domain, "user": user})
+
+
 def allow_domain_for_user(db: orm.Session, user: str, domain: str) -> models.DBAllowed:
     """Says the domain is allowed for the user. The user can manage mailboxes and
     aliases on that domain."""
     db_allowed = models.DBAllowed(domain=domain, user=user)
     db.add(db_allowed)
     db.commit()
+    perms.bump_perm_version(user)
     db.refresh(db_allowed)
     return db_allowed
 
 
+async def aallow_domain_for_user(
+    db: sa_async.AsyncSession, user: str, domain: str
+) -> models.DBAllowed:
+    db_allowed = models.DBAllowed(domain=domain, user=user)
+    db.add(db_allowed)
+    await db.commit()
+    perms.bump_perm_version(user)
+    return db_allowed
+
+
 def deny_domain_for_user(db: orm.Session, user: str, domain: str) -> models.DBAllowed:
     """Says the domain is denied (not allowed anymore) for the user. The user will
     not anymore be able to manage the aliases and the mailboxes on that domain."""
@@ -35,6 +71,18 @@ def deny_domain_for_user(db: orm.Session, user: str, domain: str) -> models.DBAl
     if db_allowed is not None:
         db.delete(db_allowed)
         db.commit()
+        perms.bump_perm_version(user)
+    return db_allowed
+
+
+async def adeny_domain_for_user(
+    db: sa_async.AsyncSession, user: str, domain: str
+) -> models.DBAllowed:
+    db_allowed = await aget_allowed(db, user, domain)
+    if db_allowed is not None:
+        await db.delete(db_allowed)
+        await db.commit()
+        perms.bump_perm_version(user)
     return db_allowed
 
 
@@ -42,4 +90,12 @@ def delete_allows_by_user(db: orm.Session, user: str) -> int:
     """Delete all the allows for this user."""
     res = db.execute(sa.delete(models.DBAllowed).where(models.DBAllowed.user == user))
     db.commit()
+    perms.bump_perm_version(user)
+    return res.rowcount
+
+
+async def adelete_allows_by_user(db: sa_async.AsyncSession, user: str) -> int:
+    res = await db.execute(sa.delete(models.DBAllowed).where(models.DBAllowed.user == user))
+    await db.commit()
+    perms.bump_perm_version(user)
     return res.rowcount
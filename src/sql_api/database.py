@@ -1,21 +1,36 @@
-import inspect
-
 import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.orm as orm
 
+from .. import utils
+
 maker: orm.sessionmaker | None = None
+amaker: sa_async.async_sessionmaker | None = None
 
 Api = orm.declarative_base()
 
-def init_db(config: str):
+def init_db(config: str, pool: dict | None = None):
+    """`pool` is the setting of the connection pool, see utils.pool."""
     global maker
+    global amaker
     url = config
-    engine = sa.create_engine(url)
+    engine = sa.create_engine(url, **utils.pool.engine_args(pool))
     maker = orm.sessionmaker(autocommit=False,
                              autoflush=False,
                              bind=engine,
                              info={},
+                             class_=utils.provenance.TracedSession,
                              close_resets_only=False)
+    # The routes use async sessions. The objects stay usable after a commit
+    # (reloading their attributes would need an await).
+    amaker = sa_async.async_sessionmaker(
+        bind=utils.pool.create_async_engine(url, pool),
+        autoflush=False,
+        expire_on_commit=False,
+        info={},
+        close_resets_only=False,
+        sync_session_class=utils.provenance.TracedSession,
+    )
     return engine
 
 
@@ -23,11 +38,25 @@ def get_maker() -> orm.sessionmaker:
     global maker
     if maker is None:
         raise Exception("You need to init the db by giving me a valid URL")
-    caller = inspect.currentframe().f_back.f_code.co_qualname
-    file = inspect.currentframe().f_back.f_code.co_filename
-    line = inspect.currentframe().f_back.f_code.co_firstlineno
-    maker.kw["info"]["caller"] = caller
-    maker.kw["info"]["file"] = f"{file}:{line}"
     return maker
 
 
+def get_amaker() -> sa_async.async_sessionmaker:
+    global amaker
+    if amaker is None:
+        raise Exception("You need to init the db by giving me a valid URL")
+    return amaker
+
+
+async def get_db():
+    """Dependency for fastapi that creates an async orm session and yields it.
+    Ensures the session is closed at the end. Fastapi calls it once per request,
+    so the auth dependencies and the route share the session (and the
+    connection)."""
+    db = get_amaker()()
+    # En cas d'erreur, on va lever une exception (404, 403, etc), or il faudra
+    # quand meme fermer la connexion a la base de données
+    try:
+        yield db
+    finally:
+        await db.close()
@@ -1,19 +1,49 @@
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.orm as orm
 
+from .. import utils
 from . import models
 
+STREAM_CHUNK = 500
+
 
 def get_domains(db: orm.Session):
     return db.query(models.DBDomain).all()
 
 
+async def aget_domains(
+    db: sa_async.AsyncSession, limit: int | None = None, after: tuple | None = None
+):
+    """Ordered by name, see utils.cursor for `limit` and `after`."""
+    stmt = utils.cursor.paged(sa.select(models.DBDomain), [models.DBDomain.name], limit, after)
+    return (await db.scalars(stmt)).all()
+
+
+async def astream_domains(db: sa_async.AsyncSession) -> typing.AsyncIterator[models.DBDomain]:
+    """Yields the domains, ordered by name, fetched from the database by
+    batches, never all at once."""
+    stmt = (
+        sa.select(models.DBDomain)
+        .order_by(models.DBDomain.name)
+        .execution_options(yield_per=STREAM_CHUNK)
+    )
+    async for domain in await db.stream_scalars(stmt):
+        yield domain
+
+
 def get_domain(db: orm.Session, domain_name: str):
     return db.get(models.DBDomain, domain_name)
     return db.query(models.DBDomain).filter(models.DBDomain.name == domain_name).first()
 
 
-def create_domain(
-    db: orm.Session,
+async def aget_domain(db: sa_async.AsyncSession, domain_name: str):
+    return await db.get(models.DBDomain, domain_name)
+
+
+def _make_domain(
     name: str,
     features: list[str],
     webmail_domain: str | None = None,
@@ -30,7 +60,39 @@ def create_domain(
         db_domain.imap_domains = [dom for dom in imap_domains]
     if smtp_domains is not None:
         db_domain.smtp_domains = [dom for dom in smtp_domains]
+    return db_domain
+
+
+def create_domain(
+    db: orm.Session,
+    name: str,
+    features: list[str],
+    webmail_domain: str | None = None,
+    mailbox_domain: str | None = None,
+    imap_domains: list[str] | None = None,
+    smtp_domains: list[str] | None = None,
+) -> models.DBDomain:
+    db_domain = _make_domain(
+        name, features, webmail_domain, mailbox_domain, imap_domains, smtp_domains
+    )
     db.add(db_domain)
     db.commit()
     db.refresh(db_domain)
     return db_domain
+
+
+async def acreate_domain(
+    db: sa_async.AsyncSession,
+    name: str,
+    features: list[str],
+    webmail_domain: str | None = None,
+    mailbox_domain: str | None = None,
+    imap_domains: list[str] | None = None,
+    smtp_domains: list[str] | None = None,
+) -> models.DBDomain:
+    db_domain = _make_domain(
+        name, features, webmail_domain, mailbox_domain, imap_domains, smtp_domains
+    )
+    db.add(db_domain)
+    await db.commit()
+    return db_domain
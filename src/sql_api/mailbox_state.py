@@ -0,0 +1,141 @@
+"""The mailbox_state table: the status of the mailboxes, as computed by the
+last reconciliation of OX and dovecot (see routes/mailboxes/reconcile.py), to
+read and filter them without asking OX."""
+import datetime
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
+
+from .. import utils
+from . import models
+
+STREAM_CHUNK = 500
+
+KEY = [models.DBMailboxState.username, models.DBMailboxState.domain]
+
+
+def now() -> datetime.datetime:
+    # The DateTime columns are naive, in UTC
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _select_states(domain_name: str, status: str | None):
+    stmt = sa.select(models.DBMailboxState).where(models.DBMailboxState.domain == domain_name)
+    if status is not None:
+        stmt = stmt.where(models.DBMailboxState.status == str(status))
+    return stmt
+
+
+async def aget_mailbox_state(
+    db: sa_async.AsyncSession, email: str
+) -> models.DBMailboxState | None:
+    return await db.get(models.DBMailboxState, email)
+
+
+async def aget_mailbox_states(
+    db: sa_async.AsyncSession,
+    domain_name: str,
+    status: str | None = None,
+    limit: int | None = None,
+    after: tuple | None = None,
+) -> list[models.DBMailboxState]:
+    """Ordered by (username, domain), see utils.cursor for `limit` and
+    `after`."""
+    stmt = utils.cursor.paged(_select_states(domain_name, status), KEY, limit, after)
+    return (await db.scalars(stmt)).all()
+
+
+async def astream_mailbox_states(
+    db: sa_async.AsyncSession, domain_name: str, status: str | None = None
+) -> typing.AsyncIterator[models.DBMailboxState]:
+    """Yields the states of the domain, ordered by (username, domain), fetched
+    from the database by batches, never all at once."""
+    stmt = (
+        _select_states(domain_name, status)
+        .order_by(*KEY)
+        .execution_options(yield_per=STREAM_CHUNK)
+    )
+    async for state in await db.stream_scalars(stmt):
+        yield state
+
+
+async def areplace_mailbox_states(
+    db: sa_async.AsyncSession,
+    domain_name: str,
+    states: typing.AsyncIterable[models.DBMailboxState],
+) -> dict[str, int]:
+    """Makes the stored states of the domain the given `states` (sorted by
+    (username, domain)), writing only the ones which changed. Returns how many
+    were added, updated and removed."""
+    stmt = _select_states(domain_name, None).order_by(*KEY)
+    stored = (await db.scalars(stmt)).all()
+    counts = {"added": 0, "updated": 0, "removed": 0}
+    added = []
+    async for _, old, new in utils.merge.amerge_join(
+        stored, states, models.DBMailboxState.key, models.DBMailboxState.key
+    ):
+        if old is None:
+            added.append(new)
+            counts["added"] += 1
+        elif new is None:
+            await db.delete(old)
+            counts["removed"] += 1
+        elif not old.same_state(new):
+            old.ox_uid = new.ox_uid
+            old.in_dovecot = new.in_dovecot
+            old.active = new.active
+            old.status = new.status
+            old.updated_at = new.updated_at
+            counts["updated"] += 1
+    # The deletes first: a flush inserts before it deletes, and an address
+    # both removed and added must not collide with itself
+    await db.flush()
+    db.add_all(added)
+    await db.commit()
+    return counts
+
+
+async def aset_state_checked(
+    db: sa_async.AsyncSession, domain_name: str, checked_at: datetime.datetime
+) -> None:
+    stmt = (
+        sa.update(models.DBDomain)
+        .where(models.DBDomain.name == domain_name)
+        .values(state_checked_at=checked_at)
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def amark_mailboxes_changed(db: sa_async.AsyncSession, domain_name: str) -> None:
+    """The mailboxes of the domain changed through the API: its mailbox_state
+    is not used until the next reconciliation."""
+    stmt = (
+        sa.update(models.DBDomain)
+        .where(models.DBDomain.name == domain_name)
+        .values(mailboxes_changed_at=now())
+    )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def aget_domains_to_reconcile(
+    db: sa_async.AsyncSession, checked_before: datetime.datetime
+) -> list[str]:
+    """The domains whose mailbox_state was never reconciled, was reconciled
+    before `checked_before`, or before the last change of their mailboxes. The
+    ones waiting for the longest first."""
+    checked_at = models.DBDomain.state_checked_at
+    stmt = (
+        sa.select(models.DBDomain.name)
+        .where(
+            sa.or_(
+                checked_at.is_(None),
+                checked_at < checked_before,
+                models.DBDomain.mailboxes_changed_at >= checked_at,
+            )
+        )
+        .order_by(checked_at.is_not(None), checked_at, models.DBDomain.name)
+    )
+    return list((await db.scalars(stmt)).all())
@@ -2,15 +2,13 @@ import datetime
 import uuid
 
 import jwt
-import passlib.hash
-
-# from passlib.hash import argon2
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 
-from .. import config
+from .. import config, utils
 from .creds import Creds
 from .database import Api
+from .perms import get_perm_version
 
 
 class DBUser(Api):
@@ -37,10 +35,16 @@ class DBUser(Api):
         return False
 
     def set_password(self, password: str):
-        self.hashed_password = passlib.hash.argon2.hash(password)
+        self.hashed_password = utils.hashing.hash_password(password)
 
     def verify_password(self, password: str):
-        return passlib.hash.argon2.verify(password, self.hashed_password)
+        return utils.hashing.verify_password(password, self.hashed_password)
+
+    async def aset_password(self, password: str):
+        self.hashed_password = await utils.hashing.ahash_password(password)
+
+    async def averify_password(self, password: str):
+        return await utils.hashing.averify_password(password, self.hashed_password)
 
     def create_token(self):
         now = datetime.datetime.now(datetime.timezone.utc)
@@ -50,6 +54,13 @@ class DBUser(Api):
             "sub": self.name,
             "exp": expire,
         }
+        if config.settings.jwt_claims:
+            # The version first: if the permissions change while we read them,
+            # the token will be outdated at once.
+            data["pv"] = get_perm_version(self.name)
+            creds = self.get_creds()
+            data["adm"] = creds.is_admin
+            data["dom"] = creds.domains
         secret = config.settings["JWT_SECRET"]
         algo = "HS256"
         return jwt.encode(data, secret, algo)
@@ -73,6 +84,10 @@ class DBDomain(Api):
     mailbox_domain = sa.Column(sa.String(200), nullable=True)
     imap_domains = sa.Column(sa.JSON(), nullable=True)
     smtp_domains = sa.Column(sa.JSON(), nullable=True)
+    # When the mailbox_state of the domain was last reconciled (from its start),
+    # and when its mailboxes were last changed through the API.
+    state_checked_at = sa.Column(sa.DateTime, nullable=True)
+    mailboxes_changed_at = sa.Column(sa.DateTime, nullable=True)
     users: orm.Mapped[list["DBUser"]] = orm.relationship(
         secondary="allowed", back_populates="domains"
     )
@@ -80,6 +95,15 @@ class DBDomain(Api):
     def has_feature(self, feature: str) -> bool:
         return feature in self.features
 
+    def has_fresh_state(self) -> bool:
+        """True when the mailbox_state of the domain was reconciled since the
+        last change of its mailboxes made through the API."""
+        if self.state_checked_at is None:
+            return False
+        if self.mailboxes_changed_at is None:
+            return True
+        return self.mailboxes_changed_at < self.state_checked_at
+
 
 class DBAllowed(Api):
     __tablename__ = "allowed"
@@ -92,3 +116,33 @@ class DBAllowed(Api):
 
     def __repr__(self):
         return 'sql_api.DBAllowed("%s","%s")' % (self.user, self.domain)
+
+
+class DBMailboxState(Api):
+    """The status of a mailbox, as computed by the last reconciliation of OX
+    and dovecot, so that it can be read without asking OX."""
+    __tablename__ = "mailbox_state"
+    __table_args__ = (
+        sa.Index("ix_mailbox_state_domain_username", "domain", "username"),
+        sa.Index("ix_mailbox_state_domain_status", "domain", "status", "username"),
+    )
+    email = sa.Column(sa.String(255), primary_key=True)
+    username = sa.Column(sa.String(128), nullable=False)
+    domain = sa.Column(sa.String(128), nullable=False)
+    ox_uid = sa.Column(sa.Integer, nullable=True)
+    in_dovecot = sa.Column(sa.Boolean, nullable=False)
+    active = sa.Column(sa.Boolean, nullable=True)
+    status = sa.Column(sa.String(16), nullable=False)
+    # When the state last changed
+    updated_at = sa.Column(sa.DateTime, nullable=False)
+
+    def key(self) -> tuple:
+        return (self.username, self.domain)
+
+    def same_state(self, other: "DBMailboxState") -> bool:
+        return (
+            self.ox_uid == other.ox_uid
+            and self.in_dovecot == other.in_dovecot
+            and self.active == other.active
+            and self.status == other.status
+        )
@@ -0,0 +1,25 @@
+"""The versions of the permissions of the users, kept in memory. A version is
+bumped each time the permissions of a user change (allows, admin rights,
+deletion): the tokens which carry the permissions of their user (see the
+jwt_claims setting) also carry the version, and are trusted only while it is
+the current one.
+
+The versions are not shared between the processes of the API, and are lost
+on restart: they start from a random epoch, so that a token made by another
+process (or before a restart) is never trusted on its claims alone."""
+import secrets
+import threading
+
+epoch = secrets.token_hex(8)
+_versions: dict[str, int] = {}
+_lock = threading.Lock()
+
+
+def get_perm_version(user_name: str) -> str:
+    with _lock:
+        return f"{epoch}.{_versions.get(user_name, 0)}"
+
+
+def bump_perm_version(user_name: str) -> None:
+    with _lock:
+        _versions[user_name] = _versions.get(user_name, 0) + 1
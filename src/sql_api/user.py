@@ -1,17 +1,31 @@
 import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.orm as orm
 
-from . import models
+from .. import utils
+from . import models, perms
 
 
 def count_users(db: orm.Session) -> int:
     return db.query(models.DBUser).count()
 
 
+async def acount_users(db: sa_async.AsyncSession) -> int:
+    return await db.scalar(sa.select(sa.func.count()).select_from(models.DBUser))
+
+
 def get_users(db: orm.Session):
     return db.query(models.DBUser).all()
 
 
+async def aget_users(
+    db: sa_async.AsyncSession, limit: int | None = None, after: tuple | None = None
+):
+    """Ordered by name, see utils.cursor for `limit` and `after`."""
+    stmt = utils.cursor.paged(sa.select(models.DBUser), [models.DBUser.name], limit, after)
+    return (await db.scalars(stmt)).all()
+
+
 def get_user(db: orm.Session, user_name: str):
     return db.get(models.DBUser, user_name)
     return db.execute(
@@ -20,6 +34,14 @@ def get_user(db: orm.Session, user_name: str):
     return db.query(models.DBUser).filter(models.DBUser.name == user_name).first()
 
 
+async def aget_user(db: sa_async.AsyncSession, user_name: str):
+    """The domains of the user are loaded too: get_creds can not load them
+    lazily from an async session."""
+    return await db.get(
+        models.DBUser, user_name, options=[orm.selectinload(models.DBUser.domains)]
+    )
+
+
 def create_user(db: orm.Session, name: str, password: str, is_admin: bool):
     db_user = models.DBUser(
         name=name,
@@ -37,6 +59,31 @@ def create_user(db: orm.Session, name: str, password: str, is_admin: bool):
     return db_user
 
 
+async def acreate_user(db: sa_async.AsyncSession, name: str, password: str, is_admin: bool):
+    """Same as create_user, on an async session, with the password hashed out
+    of the event loop. Raises utils.HashingBusy when the hashing pool is
+    saturated."""
+    db_user = models.DBUser(
+        name=name,
+        is_admin=is_admin,
+    )
+    try:
+        await db_user.aset_password(password)
+    except utils.HashingBusy:
+        raise
+    except Exception as e:
+        print(str(e))
+        return None
+    try:
+        db.add(db_user)
+        await db.commit()
+    except Exception as e:
+        print(str(e))
+        await db.rollback()
+        return None
+    return db_user
+
+
 def update_user_password(db: orm.Session, name: str, password: str):
     db_user = get_user(db, name)
     if db_user is None:
@@ -52,6 +99,30 @@ def update_user_password(db: orm.Session, name: str, password: str):
     return db_user
 
 
+async def aupdate_user_password(db: sa_async.AsyncSession, name: str, password: str):
+    """Same as update_user_password, on an async session, with the password
+    hashed out of the event loop. Raises utils.HashingBusy when the hashing
+    pool is saturated."""
+    db_user = await aget_user(db, name)
+    if db_user is None:
+        return None
+    try:
+        hashed = await utils.hashing.ahash_password(password)
+    except utils.HashingBusy:
+        raise
+    except Exception as e:
+        print(str(e))
+        return db_user
+    try:
+        db_user.hashed_password = hashed
+        await db.commit()
+    except Exception as e:
+        print(str(e))
+        await db.rollback()
+        await db.refresh(db_user)
+    return db_user
+
+
 def update_user_is_admin(db: orm.Session, name: str, is_admin: bool):
     db_user = get_user(db, name)
     if db_user is None:
@@ -60,6 +131,7 @@ def update_user_is_admin(db: orm.Session, name: str, is_admin: bool):
     try:
         db.flush()
         db.commit()
+        perms.bump_perm_version(name)
     except Exception as e:
         print(str(e))
         db.rollback()
@@ -67,9 +139,37 @@ def update_user_is_admin(db: orm.Session, name: str, is_admin: bool):
     return db_user
 
 
+async def aupdate_user_is_admin(db: sa_async.AsyncSession, name: str, is_admin: bool):
+    db_user = await aget_user(db, name)
+    if db_user is None:
+        return None
+    db_user.is_admin = is_admin
+    try:
+        await db.commit()
+        perms.bump_perm_version(name)
+    except Exception as e:
+        print(str(e))
+        await db.rollback()
+        await db.refresh(db_user)
+    return db_user
+
+
 def delete_user(db: orm.Session, name: str):
     db_user = get_user(db, name)
     if db_user is not None:
         db.delete(db_user)
         db.commit()
+        perms.bump_perm_version(name)
+    return db_user
+
+
+async def adelete_user(db: sa_async.AsyncSession, name: str):
+    db_user = await aget_user(db, name)
+    if db_user is not None:
+        # The allows may have been removed since the user was loaded: the
+        # delete removes the allows listed in the user.
+        await db.refresh(db_user, ["domains"])
+        await db.delete(db_user)
+        await db.commit()
+        perms.bump_perm_version(name)
     return db_user
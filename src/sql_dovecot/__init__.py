@@ -1,13 +1,35 @@
-from .crud import create_user, delete_user, get_user, get_users
-from .database import Dovecot, get_maker, init_db
+from .crud import (
+    acreate_user,
+    acreate_users,
+    adelete_user,
+    aget_existing_usernames,
+    aget_user,
+    aget_users,
+    astream_users,
+    create_user,
+    delete_user,
+    get_existing_usernames,
+    get_user,
+    get_users,
+)
+from .database import Dovecot, get_amaker, get_maker, init_db
 from .models import ImapUser
 
 __all__ = [
+    acreate_user,
+    acreate_users,
+    adelete_user,
+    aget_existing_usernames,
+    aget_user,
+    aget_users,
+    astream_users,
     create_user,
     delete_user,
     Dovecot,
+    get_existing_usernames,
     get_users,
     get_user,
+    get_amaker,
     get_maker,
     init_db,
     ImapUser,
@@ -1,16 +1,61 @@
+import typing
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.orm as orm
 
+from .. import utils
 from . import models
 
+STREAM_CHUNK = 500
+
 
 def get_user(db: orm.Session, username: str, domain: str):
     return db.get(models.ImapUser, {"username": username, "domain": domain})
 
 
+async def aget_user(db: sa_async.AsyncSession, username: str, domain: str):
+    return await db.get(models.ImapUser, {"username": username, "domain": domain})
+
+
 def get_users(db: orm.Session, domain_name: str):
     return db.query(models.ImapUser).filter(models.ImapUser.domain == domain_name).all()
 
 
+async def aget_users(
+    db: sa_async.AsyncSession,
+    domain_name: str,
+    limit: int | None = None,
+    after: tuple | None = None,
+):
+    """Ordered by username (and domain), see utils.cursor for `limit` and
+    `after`."""
+    stmt = utils.cursor.paged(
+        sa.select(models.ImapUser).where(models.ImapUser.domain == domain_name),
+        [models.ImapUser.username, models.ImapUser.domain],
+        limit,
+        after,
+    )
+    return (await db.scalars(stmt)).all()
+
+
+async def astream_users(
+    db: sa_async.AsyncSession, domain_name: str | None = None
+) -> typing.AsyncIterator[models.ImapUser]:
+    """Yields the users of a domain (of all the domains, ordered by domain,
+    when None), ordered by username, fetched from the database by batches,
+    never all at once."""
+    stmt = (
+        sa.select(models.ImapUser)
+        .order_by(models.ImapUser.domain, models.ImapUser.username)
+        .execution_options(yield_per=STREAM_CHUNK)
+    )
+    if domain_name is not None:
+        stmt = stmt.where(models.ImapUser.domain == domain_name)
+    async for user in await db.stream_scalars(stmt):
+        yield user
+
+
 def create_user(db: orm.Session, username: str, domain: str, password: str):
     imap_user = models.ImapUser(
         username=username,
@@ -33,9 +78,103 @@ def create_user(db: orm.Session, username: str, domain: str, password: str):
     return imap_user
 
 
+async def acreate_user(db: sa_async.AsyncSession, username: str, domain: str, hashed: str):
+    """Same as create_user, on an async session, with the password already
+    hashed (utils.hashing.ahash_password): the caller hashes it before doing
+    anything else, so that a saturated hashing pool (utils.HashingBusy) does
+    not stop it half way."""
+    imap_user = models.ImapUser(
+        username=username,
+        domain=domain,
+        active="Y",
+        password="WILL BE ENCODED",
+        uid=0,
+        gid=0,
+        home="",
+    )
+    imap_user.set_hashed_password(hashed)
+    try:
+        db.add(imap_user)
+        await db.commit()
+    except Exception as e:
+        print(str(e))
+        await db.rollback()
+        return None
+    return imap_user
+
+
+def get_existing_usernames(db: orm.Session, domain: str, usernames: list[str]) -> set[str]:
+    existing = set()
+    # Chunks, to stay below the limit on the number of bound parameters
+    for i in range(0, len(usernames), 500):
+        chunk = usernames[i : i + 500]
+        existing.update(
+            db.scalars(
+                sa.select(models.ImapUser.username).where(
+                    models.ImapUser.domain == domain,
+                    models.ImapUser.username.in_(chunk),
+                )
+            )
+        )
+    return existing
+
+
+async def aget_existing_usernames(
+    db: sa_async.AsyncSession, domain: str, usernames: list[str]
+) -> set[str]:
+    existing = set()
+    for i in range(0, len(usernames), 500):
+        chunk = usernames[i : i + 500]
+        existing.update(
+            await db.scalars(
+                sa.select(models.ImapUser.username).where(
+                    models.ImapUser.domain == domain,
+                    models.ImapUser.username.in_(chunk),
+                )
+            )
+        )
+    return existing
+
+
+async def acreate_users(db: sa_async.AsyncSession, domain: str, users: list[tuple[str, str]]):
+    """Creates many users of a domain, given as (username, hashed password),
+    in a single transaction: either they are all created, or none of them is
+    (and we return None). The passwords are hashed by the caller
+    (utils.hashing.ahash_passwords), before doing anything else."""
+    imap_users = []
+    for username, hashed in users:
+        imap_user = models.ImapUser(
+            username=username,
+            domain=domain,
+            active="Y",
+            password="WILL BE ENCODED",
+            uid=0,
+            gid=0,
+            home="",
+        )
+        imap_user.set_hashed_password(hashed)
+        imap_users.append(imap_user)
+    try:
+        db.add_all(imap_users)
+        await db.commit()
+    except Exception as e:
+        print(str(e))
+        await db.rollback()
+        return None
+    return imap_users
+
+
 def delete_user(db: orm.Session, username: str, domain: str):
     user = get_user(db, username, domain)
     if user is not None:
         db.delete(user)
         db.commit()
     return user
+
+
+async def adelete_user(db: sa_async.AsyncSession, username: str, domain: str):
+    user = await aget_user(db, username, domain)
+    if user is not None:
+        await db.delete(user)
+        await db.commit()
+    return user
@@ -1,7 +1,7 @@
-import passlib.hash
 import sqlalchemy as sa
 import sqlalchemy.dialects.mysql
 
+from .. import utils
 from . import database
 
 
@@ -22,12 +22,24 @@ class ImapUser(database.Dovecot):
     )
 
     def set_password(self, password: str) -> None:
-        self.password = "{ARGON2ID}" + passlib.hash.argon2.hash(password)
+        self.set_hashed_password(utils.hashing.hash_password(password))
 
     def check_password(self, password: str) -> bool:
+        return utils.hashing.verify_password(password, self.get_hashed_password())
+
+    async def aset_password(self, password: str) -> None:
+        self.set_hashed_password(await utils.hashing.ahash_password(password))
+
+    async def acheck_password(self, password: str) -> bool:
+        return await utils.hashing.averify_password(password, self.get_hashed_password())
+
+    def set_hashed_password(self, hashed: str) -> None:
+        self.password = "{ARGON2ID}" + hashed
+
+    def get_hashed_password(self) -> str:
         if not self.password.startswith("{ARGON2ID}"):
             raise Exception("This password was not encoded by me, i can't check it")
-        return passlib.hash.argon2.verify(password, self.password[len("{ARGON2ID}") :])
+        return self.password[len("{ARGON2ID}") :]
 
     def email(self) -> str:
         return self.username + "@" + self.domain
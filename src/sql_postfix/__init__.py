@@ -1,23 +1,44 @@
 from .crud import (
+    acreate_alias,
+    acreate_aliases,
+    adelete_alias,
+    adelete_aliases_by_name,
+    aget_alias,
+    aget_aliases_by_domain,
+    aget_aliases_by_name,
+    astream_aliases_by_domain,
     create_alias,
+    create_aliases,
     delete_alias,
     delete_aliases_by_name,
     get_alias,
     get_aliases_by_domain,
-    get_aliases_by_name
+    get_aliases_by_name,
+    stream_aliases_by_domain,
 )
-from .database import get_maker, init_db, Postfix
+from .database import get_amaker, get_maker, init_db, Postfix
 from .models import PostfixAlias
 
 __all__ = [
+    acreate_alias,
+    acreate_aliases,
+    adelete_alias,
+    adelete_aliases_by_name,
+    aget_alias,
+    aget_aliases_by_domain,
+    aget_aliases_by_name,
+    astream_aliases_by_domain,
     create_alias,
+    create_aliases,
     delete_alias,
     delete_aliases_by_name,
     get_alias,
     get_aliases_by_domain,
     get_aliases_by_name,
+    get_amaker,
     get_maker,
     init_db,
     Postfix,
     PostfixAlias,
+    stream_aliases_by_domain,
 ]
@@ -1,6 +1,12 @@
+import typing
+
 import sqlalchemy as sa
+import sqlalchemy.dialects.mysql
+import sqlalchemy.dialects.sqlite
+import sqlalchemy.ext.asyncio as sa_async
 import sqlalchemy.orm as orm
 
+from .. import utils
 from . import models
 
 
@@ -8,16 +14,42 @@ def get_alias(db: orm.Session, alias: str, destination: str):
     return db.get(models.PostfixAlias, {"alias": alias, "destination": destination})
 
 
+async def aget_alias(db: sa_async.AsyncSession, alias: str, destination: str):
+    return await db.get(models.PostfixAlias, {"alias": alias, "destination": destination})
+
+
 def get_aliases_by_domain(db: orm.Session, domain: str):
     return (
         db.query(models.PostfixAlias).filter(models.PostfixAlias.domain == domain).all()
     )
 
 
+async def aget_aliases_by_domain(
+    db: sa_async.AsyncSession,
+    domain: str,
+    limit: int | None = None,
+    after: tuple | None = None,
+):
+    """Ordered by alias and destination, see utils.cursor for `limit` and
+    `after`."""
+    stmt = utils.cursor.paged(
+        sa.select(models.PostfixAlias).where(models.PostfixAlias.domain == domain),
+        [models.PostfixAlias.alias, models.PostfixAlias.destination],
+        limit,
+        after,
+    )
+    return (await db.scalars(stmt)).all()
+
+
 def get_aliases_by_name(db: orm.Session, name: str):
     return db.query(models.PostfixAlias).filter(models.PostfixAlias.alias == name).all()
 
 
+async def aget_aliases_by_name(db: sa_async.AsyncSession, name: str):
+    stmt = sa.select(models.PostfixAlias).where(models.PostfixAlias.alias == name)
+    return (await db.scalars(stmt)).all()
+
+
 def create_alias(
     db: orm.Session, domain: str, username: str, destination: str
 ) -> models.PostfixAlias:
@@ -37,6 +69,145 @@ def create_alias(
     return db_alias
 
 
+async def acreate_alias(
+    db: sa_async.AsyncSession, domain: str, username: str, destination: str
+) -> models.PostfixAlias:
+    try:
+        alias = username + "@" + domain
+        db_alias = models.PostfixAlias(
+            alias=alias,
+            domain=domain,
+            destination=destination,
+        )
+        db.add(db_alias)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        return None
+    return db_alias
+
+
+CHUNK_SIZE = 500
+
+
+def _insert_ignore(db: orm.Session, rows: list[dict]):
+    """A multi-row insert, where the rows that already exist are ignored."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = sa.dialects.mysql.insert(models.PostfixAlias).values(rows)
+        # Updating a column to its own value is a no-op
+        return stmt.on_duplicate_key_update(alias=stmt.inserted.alias)
+    if dialect == "sqlite":
+        stmt = sa.dialects.sqlite.insert(models.PostfixAlias).values(rows)
+        return stmt.on_conflict_do_nothing()
+    raise Exception(f"Bulk insert is not implemented for {dialect}")
+
+
+def create_aliases(
+    db: orm.Session, domain: str, aliases: list[tuple[str, str]]
+) -> list[bool] | None:
+    """Creates many aliases of a domain, given as (username, destination), in
+    chunks of multi-row inserts, in a single transaction. Returns, for each
+    alias, True if it was created, False if it already existed (or was given
+    twice). Returns None if the transaction failed (nothing is created then)."""
+    created = []
+    seen = set()
+    try:
+        for chunk in _chunks(domain, aliases):
+            existing = set(db.execute(_existing_aliases(domain, chunk)).tuples())
+            rows = _new_aliases(domain, chunk, existing, seen, created)
+            if rows:
+                db.execute(_insert_ignore(db, rows))
+        db.commit()
+    except Exception as e:
+        print(str(e))
+        db.rollback()
+        return None
+    return created
+
+
+async def acreate_aliases(
+    db: sa_async.AsyncSession, domain: str, aliases: list[tuple[str, str]]
+) -> list[bool] | None:
+    """Same as create_aliases, on an async session."""
+    created = []
+    seen = set()
+    try:
+        for chunk in _chunks(domain, aliases):
+            existing = set((await db.execute(_existing_aliases(domain, chunk))).tuples())
+            rows = _new_aliases(domain, chunk, existing, seen, created)
+            if rows:
+                await db.execute(_insert_ignore(db, rows))
+        await db.commit()
+    except Exception as e:
+        print(str(e))
+        await db.rollback()
+        return None
+    return created
+
+
+def _chunks(domain: str, aliases: list[tuple[str, str]]) -> typing.Iterator[list]:
+    """The (alias, destination) to create, by chunks."""
+    for i in range(0, len(aliases), CHUNK_SIZE):
+        yield [
+            (username + "@" + domain, destination)
+            for (username, destination) in aliases[i : i + CHUNK_SIZE]
+        ]
+
+
+def _existing_aliases(domain: str, chunk: list[tuple[str, str]]):
+    return (
+        sa.select(models.PostfixAlias.alias, models.PostfixAlias.destination)
+        .where(models.PostfixAlias.domain == domain)
+        .where(
+            sa.tuple_(models.PostfixAlias.alias, models.PostfixAlias.destination).in_(chunk)
+        )
+    )
+
+
+def _new_aliases(
+    domain: str, chunk: list[tuple[str, str]], existing: set, seen: set, created: list[bool]
+) -> list[dict]:
+    """The rows to insert for a chunk, the aliases which are not in the database
+    and were not seen before in the batch. Appends to `created` whether each
+    alias of the chunk is new."""
+    rows = []
+    for key in chunk:
+        is_new = key not in existing and key not in seen
+        created.append(is_new)
+        seen.add(key)
+        if is_new:
+            rows.append({"alias": key[0], "domain": domain, "destination": key[1]})
+    return rows
+
+
+def stream_aliases_by_domain(db: orm.Session, domain: str) -> typing.Iterator:
+    """Yields the aliases of a domain, fetched from the database by batches,
+    never all at once."""
+    stmt = (
+        sa.select(models.PostfixAlias)
+        .where(models.PostfixAlias.domain == domain)
+        .order_by(models.PostfixAlias.alias, models.PostfixAlias.destination)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    for alias in db.scalars(stmt):
+        yield alias
+
+
+async def astream_aliases_by_domain(
+    db: sa_async.AsyncSession, domain: str
+) -> typing.AsyncIterator:
+    """Same as stream_aliases_by_domain, on an async session."""
+    stmt = (
+        sa.select(models.PostfixAlias)
+        .where(models.PostfixAlias.domain == domain)
+        .order_by(models.PostfixAlias.alias, models.PostfixAlias.destination)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    async for alias in await db.stream_scalars(stmt):
+        yield alias
+
+
 def delete_alias(db: orm.Session, alias: str, destination: str) -> int:
     db_alias = get_alias(db, alias, destination)
     if db_alias is not None:
@@ -46,7 +217,24 @@ def delete_alias(db: orm.Session, alias: str, destination: str) -> int:
     return 0
 
 
+async def adelete_alias(db: sa_async.AsyncSession, alias: str, destination: str) -> int:
+    db_alias = await aget_alias(db, alias, destination)
+    if db_alias is not None:
+        await db.delete(db_alias)
+        await db.commit()
+        return 1
+    return 0
+
+
 def delete_aliases_by_name(db: orm.Session, name: str):
     res = db.execute(sa.delete(models.PostfixAlias).where(models.PostfixAlias.alias == name))
     db.commit()
     return res.rowcount
+
+
+async def adelete_aliases_by_name(db: sa_async.AsyncSession, name: str):
+    res = await db.execute(
+        sa.delete(models.PostfixAlias).where(models.PostfixAlias.alias == name)
+    )
+    await db.commit()
+    return res.rowcount
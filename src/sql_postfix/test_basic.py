@@ -69,3 +69,43 @@ def test_alias__create_and_get_an_alias(db_postfix_session):
         db_postfix_session, "from@example.com"
     )
     assert count == 0
+
+
+def test_alias__bulk_create_and_stream(db_postfix_session, monkeypatch):
+    """Proves that we can create many aliases at once, and that the existing
+    ones are reported, not created twice."""
+    monkeypatch.setattr(sql_postfix.crud, "CHUNK_SIZE", 3)
+    alias = sql_postfix.create_alias(db_postfix_session, "example.com", "from", "to@example.com")
+    assert isinstance(alias, sql_postfix.PostfixAlias)
+
+    created = sql_postfix.create_aliases(
+        db_postfix_session,
+        "example.com",
+        [
+            ("from", "to@example.com"),
+            ("from", "other@example.com"),
+            ("a", "b@example.com"),
+            ("c", "d@example.com"),
+            ("a", "b@example.com"),
+            ("e", "f@example.com"),
+            ("g", "h@example.com"),
+        ],
+    )
+    assert created == [False, True, True, True, False, True, True]
+
+    aliases = list(sql_postfix.stream_aliases_by_domain(db_postfix_session, "example.com"))
+    assert [(alias.alias, alias.destination) for alias in aliases] == [
+        ("a@example.com", "b@example.com"),
+        ("c@example.com", "d@example.com"),
+        ("e@example.com", "f@example.com"),
+        ("from@example.com", "other@example.com"),
+        ("from@example.com", "to@example.com"),
+        ("g@example.com", "h@example.com"),
+    ]
+
+    # When the transaction fails, nothing is created
+    created = sql_postfix.create_aliases(
+        db_postfix_session, "example.com", [("i", "j@example.com"), (None, "k@example.com")]
+    )
+    assert created is None
+    assert sql_postfix.get_alias(db_postfix_session, "i@example.com", "j@example.com") is None
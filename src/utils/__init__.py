@@ -1,3 +1,5 @@
+from . import cursor, fanout, hashing, merge, pool, provenance
+from .hashing import HashingBusy
 from .mail import split_email
 
-__all__ = [split_email]
+__all__ = [cursor, fanout, hashing, merge, pool, provenance, HashingBusy, split_email]
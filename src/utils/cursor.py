@@ -0,0 +1,37 @@
+"""The cursors of the paged listings. The listings are ordered by their primary
+key, and a page starts after the key of the last item of the previous page
+(keyset pagination): the cursor holds that key, opaque to the clients."""
+import base64
+import json
+
+import sqlalchemy as sa
+
+
+def encode(key: tuple) -> str:
+    data = json.dumps(list(key), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode(cursor: str, size: int) -> tuple:
+    """The key in the cursor, which must have `size` parts."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = json.loads(data)
+    except Exception:
+        raise Exception("Invalid cursor")
+    if not isinstance(key, list) or len(key) != size or not all(
+        isinstance(part, str) for part in key
+    ):
+        raise Exception("Invalid cursor")
+    return tuple(key)
+
+
+def paged(stmt: sa.Select, columns: list, limit: int | None, after: tuple | None) -> sa.Select:
+    """The statement ordered by `columns` (the primary key), starting after the
+    key `after` when given, with at most `limit` rows when given."""
+    stmt = stmt.order_by(*columns)
+    if after is not None:
+        stmt = stmt.where(sa.tuple_(*columns) > sa.tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
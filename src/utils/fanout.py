@@ -0,0 +1,60 @@
+"""Runs independent lookups (in OX, in the dovecot database...) at the same
+time, each within its own timeout: the slowest source decides of the latency,
+not the sum of all of them. A lookup which times out gives MISSING, and the
+route answers with what the other sources gave.
+
+The timeouts are by source name, see `configure` (ox_lookup_timeout and
+imap_lookup_timeout in config/settings.toml)."""
+import asyncio
+import logging
+import typing
+
+log = logging.getLogger(__name__)
+
+
+class Missing:
+    """The result of a lookup which did not answer in time."""
+
+    def __repr__(self) -> str:
+        return "MISSING"
+
+
+MISSING = Missing()
+
+timeouts: dict[str, float] = {}
+timed_out: dict[str, int] = {}
+
+
+def configure(**source_timeouts: float) -> None:
+    """The timeout of each source, in seconds, 0 to wait as long as it takes."""
+    global timeouts
+    timeouts = dict(source_timeouts)
+
+
+async def within(source: str, lookup: typing.Awaitable) -> typing.Any:
+    """The result of the lookup, or MISSING if the source takes too long."""
+    timeout = timeouts.get(source, 0)
+    if not timeout:
+        return await lookup
+    try:
+        return await asyncio.wait_for(lookup, timeout)
+    except TimeoutError:
+        log.warning(f"No answer from {source} after {timeout}s, answering without it")
+        timed_out[source] = timed_out.get(source, 0) + 1
+        return MISSING
+
+
+async def gather(**lookups: typing.Awaitable) -> dict[str, typing.Any]:
+    """Runs the lookups, given by source, at the same time. Returns their
+    results by source (MISSING for the ones which timed out)."""
+    results = await asyncio.gather(
+        *[within(source, lookup) for source, lookup in lookups.items()]
+    )
+    return dict(zip(lookups, results))
+
+
+def stats() -> dict:
+    return {
+        "timeouts": timeouts,
+        "timed_out": timed_out,
+    }
@@ -0,0 +1,142 @@
+"""Password hashing, with argon2. Hashing and verifying a password costs a lot
+of CPU (that's the point), so the async API runs them in a pool of processes,
+never on the thread of the event loop. When too many hashes are waiting for
+the pool, we refuse new ones (HashingBusy, which the API turns into a 503)
+instead of making everybody wait.
+
+The argon2 costs are configurable: changing them does not break the existing
+hashes, each hash carries its own costs."""
+import asyncio
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+
+import passlib.hash
+
+log = logging.getLogger(__name__)
+
+
+class HashingBusy(Exception):
+    def __init__(self):
+        super(HashingBusy, self).__init__("Too many passwords being hashed, retry later")
+
+
+class Hasher:
+    def __init__(self):
+        self.params: dict = {}
+        self.workers = 0
+        self.max_pending = 0
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor: concurrent.futures.ProcessPoolExecutor | None = None
+
+    def configure(
+        self,
+        workers: int = 0,
+        max_pending: int = 0,
+        time_cost: int | None = None,
+        memory_cost: int | None = None,
+        parallelism: int | None = None,
+    ) -> None:
+        """`workers` is the number of processes (0: one per core), and
+        `max_pending` the number of hashes that can be running or waiting for
+        a process (0: 8 per process). The costs left to None are the default
+        ones of passlib."""
+        self.shutdown()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 8 * self.workers
+        self.params = {}
+        if time_cost is not None:
+            self.params["rounds"] = time_cost
+        if memory_cost is not None:
+            self.params["memory_cost"] = memory_cost
+        if parallelism is not None:
+            self.params["parallelism"] = parallelism
+
+    def get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                log.info(f"Starting {self.workers} processes for password hashing")
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # fork is not safe in a process that runs threads
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.executor
+
+    def shutdown(self) -> None:
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def run(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                log.warning(f"Password hashing is saturated ({self.pending} pending)")
+                raise HashingBusy()
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.get_executor(), func, *args)
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+
+def _hash(password: str, params: dict) -> str:
+    return passlib.hash.argon2.using(**params).hash(password)
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return passlib.hash.argon2.verify(password, hashed)
+
+
+hasher = Hasher()
+hasher.configure()
+
+
+def configure(**kwargs) -> None:
+    hasher.configure(**kwargs)
+
+
+def shutdown() -> None:
+    hasher.shutdown()
+
+
+def stats() -> dict:
+    return {
+        "workers": hasher.workers,
+        "pending": hasher.pending,
+        "max_pending": hasher.max_pending,
+    }
+
+
+def hash_password(password: str) -> str:
+    """Hashes the password inline, for the callers which are not async."""
+    return _hash(password, hasher.params)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return _verify(password, hashed)
+
+
+async def ahash_password(password: str) -> str:
+    return await hasher.run(_hash, password, hasher.params)
+
+
+async def averify_password(password: str, hashed: str) -> bool:
+    return await hasher.run(_verify, password, hashed)
+
+
+async def ahash_passwords(passwords: list[str]) -> list[str]:
+    """Hashes many passwords, using all the processes of the pool, but not
+    more: the other requests can still get their passwords hashed."""
+    results = []
+    for i in range(0, len(passwords), hasher.workers):
+        chunk = passwords[i : i + hasher.workers]
+        results.extend(await asyncio.gather(*[ahash_password(password) for password in chunk]))
+    return results
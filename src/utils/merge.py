@@ -0,0 +1,40 @@
+"""Joins two listings sorted by the same key, as they come, without indexing
+them: the memory used does not depend on the size of the listings."""
+import typing
+
+
+async def _aiter(items: typing.Iterable | typing.AsyncIterable) -> typing.AsyncIterator:
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def amerge_join(
+    left: typing.Iterable | typing.AsyncIterable,
+    right: typing.Iterable | typing.AsyncIterable,
+    left_key: typing.Callable,
+    right_key: typing.Callable,
+) -> typing.AsyncIterator[tuple]:
+    """Full outer join of two listings, each sorted by its key (and without
+    duplicate keys). Yields (key, left item, right item) in the order of the
+    keys, with None for the side which does not have the key."""
+    lefts = _aiter(left)
+    rights = _aiter(right)
+    lhs = await anext(lefts, None)
+    rhs = await anext(rights, None)
+    while lhs is not None or rhs is not None:
+        lkey = left_key(lhs) if lhs is not None else None
+        rkey = right_key(rhs) if rhs is not None else None
+        if rhs is None or (lhs is not None and lkey < rkey):
+            yield (lkey, lhs, None)
+            lhs = await anext(lefts, None)
+        elif lhs is None or rkey < lkey:
+            yield (rkey, None, rhs)
+            rhs = await anext(rights, None)
+        else:
+            yield (lkey, lhs, rhs)
+            lhs = await anext(lefts, None)
+            rhs = await anext(rights, None)
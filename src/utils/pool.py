@@ -0,0 +1,111 @@
+"""The settings of the connection pools of our databases (see `api_db_pool` and
+the others in config/settings.toml), their warm-up, and their counters.
+
+A pool setting is a table, all its keys are optional:
+- size: connections kept open in the pool,
+- max_overflow: connections opened beyond `size` under load (closed when
+  given back),
+- timeout: seconds to wait for a connection when they are all in use,
+- recycle: seconds after which a connection is replaced (set it below the
+  idle timeout of the proxy or of the server),
+- pre_ping: check a connection is alive before using it,
+- warm_up: connections opened when the API starts.
+
+The routes use async engines, built from the same urls and settings, with an
+async driver instead of the sync one."""
+import logging
+
+import sqlalchemy as sa
+import sqlalchemy.ext.asyncio
+
+log = logging.getLogger(__name__)
+
+ENGINE_ARGS = {
+    "size": "pool_size",
+    "max_overflow": "max_overflow",
+    "timeout": "pool_timeout",
+    "recycle": "pool_recycle",
+    "pre_ping": "pool_pre_ping",
+}
+
+
+def engine_args(pool: dict | None) -> dict:
+    """The arguments of sa.create_engine for this pool setting."""
+    if not pool:
+        return {}
+    args = {}
+    for key, value in pool.items():
+        if key in ENGINE_ARGS:
+            args[ENGINE_ARGS[key]] = value
+        elif key != "warm_up":
+            raise Exception(f"Unknown pool setting {key}")
+    return args
+
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mariadb": "mariadb+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_url(url: str) -> sa.URL:
+    """The same url, with an async driver."""
+    url = sa.make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise Exception(f"No async driver for the {backend} databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_async_engine(url: str, pool: dict | None) -> sa.ext.asyncio.AsyncEngine:
+    url = async_url(url)
+    args = engine_args(pool)
+    if url.get_backend_name() == "sqlite" and url.database not in [None, "", ":memory:"]:
+        # Like the sync engine (aiosqlite opens no pool by default)
+        args["poolclass"] = sa.pool.AsyncAdaptedQueuePool
+    return sa.ext.asyncio.create_async_engine(url, **args)
+
+
+def warm_up(name: str, engine: sa.Engine, pool: dict | None) -> None:
+    """Opens the connections of the pool before the first requests need them.
+    The API still starts when the database is not there (yet)."""
+    count = (pool or {}).get("warm_up", 0)
+    conns = []
+    try:
+        for _ in range(count):
+            conns.append(engine.connect())
+    except Exception as e:
+        log.warning(f"Failed to warm up the pool of the {name} database: {e}")
+    finally:
+        for conn in conns:
+            conn.close()
+    log.info(f"Warmed up {len(conns)} connections to the {name} database")
+
+
+async def awarm_up(name: str, engine: sa.ext.asyncio.AsyncEngine, pool: dict | None) -> None:
+    """Same as warm_up, for an async engine."""
+    count = (pool or {}).get("warm_up", 0)
+    conns = []
+    try:
+        for _ in range(count):
+            conns.append(await engine.connect())
+    except Exception as e:
+        log.warning(f"Failed to warm up the pool of the {name} database: {e}")
+    finally:
+        for conn in conns:
+            await conn.close()
+    log.info(f"Warmed up {len(conns)} connections to the {name} database")
+
+
+def stats(engine: sa.Engine | sa.ext.asyncio.AsyncEngine) -> dict:
+    pool = engine.pool
+    if not isinstance(pool, sa.pool.QueuePool):
+        return {"class": type(pool).__name__}
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
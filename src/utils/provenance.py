@@ -0,0 +1,100 @@
+"""Where the orm sessions come from, to trace the sessions (and the
+connections) we lose. Each session is tagged, when it is created, with the
+route of the request (kept in a contextvar by RouteMiddleware) and with the
+function which created it.
+
+Finding that function means walking the stack, which is not free: it is done
+for a sample of the sessions only (`set_sample_rate`, which can be changed at
+any time). The other sessions are still tagged with their route."""
+import contextvars
+import logging
+import os
+import random
+import sys
+import weakref
+
+import sqlalchemy
+import sqlalchemy.orm as orm
+
+log = logging.getLogger(__name__)
+
+SQLALCHEMY = os.path.dirname(sqlalchemy.__file__)
+
+route: contextvars.ContextVar[str] = contextvars.ContextVar("route", default="")
+
+sample_rate = 1.0
+_sessions: weakref.WeakSet = weakref.WeakSet()
+
+
+def set_sample_rate(rate: float) -> None:
+    """The fraction of the sessions for which we find the calling function,
+    between 0 (never) and 1 (always)."""
+    global sample_rate
+    sample_rate = rate
+
+
+class TracedSession(orm.Session):
+    """An orm session which knows where it comes from, in its `info`: the
+    route, the caller, and its file (when sampled)."""
+
+    def __init__(self, *args, **kwargs):
+        super(TracedSession, self).__init__(*args, **kwargs)
+        self.info["route"] = route.get()
+        if sample_rate >= 1 or (sample_rate > 0 and random.random() < sample_rate):
+            # Skip the frames of sqlalchemy (the maker, and for the async
+            # sessions, the AsyncSession) up to who called the maker
+            frame = sys._getframe(1)
+            while frame.f_back is not None and frame.f_code.co_filename.startswith(SQLALCHEMY):
+                frame = frame.f_back
+            code = frame.f_code
+            self.info["caller"] = code.co_qualname
+            self.info["file"] = f"{code.co_filename}:{code.co_firstlineno}"
+        else:
+            self.info["caller"] = "(not sampled)"
+            self.info["file"] = "(not sampled)"
+        _sessions.add(self)
+
+
+class RouteMiddleware:
+    """ASGI middleware keeping the route of the request in the `route`
+    contextvar, for the sessions created while serving it."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = route.set(f"{scope['method']} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route.reset(token)
+
+
+def describe(session: orm.Session) -> str:
+    info = session.info
+    return f"{info.get('caller')} @ {info.get('file')} for {info.get('route') or '(no route)'}"
+
+
+def open_sessions() -> dict[str, int]:
+    """The sessions which hold a connection right now, by provenance."""
+    counts: dict[str, int] = {}
+    for session in list(_sessions):
+        if session.in_transaction():
+            key = describe(session)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def stats() -> dict:
+    return {
+        "sample_rate": sample_rate,
+        "open": open_sessions(),
+    }
+
+
+def log_open_sessions() -> None:
+    for key, count in open_sessions().items():
+        log.warning(f"{count} session(s) still holding a connection, created by {key}")
@@ -1,4 +1,8 @@
+import asyncio
+
 import pytest
+import sqlalchemy as sa
+import sqlalchemy.orm
 
 from .. import utils
 
@@ -14,3 +18,127 @@ def test_split_email():
         str(e)
         == "<ExceptionInfo Exception('The email address <not-an-email> is not valid') tblen=2>"
     )
+
+
+def test_hashing():
+    hashing = utils.hashing
+    hashing.configure(workers=1, time_cost=1, memory_cost=1024, parallelism=1)
+    try:
+        hashed = hashing.hash_password("secret")
+        assert "m=1024,t=1,p=1" in hashed
+        assert hashing.verify_password("secret", hashed)
+
+        async def in_the_pool():
+            hashed = await hashing.ahash_password("secret")
+            many = await hashing.ahash_passwords(["a", "b", "c"])
+            return (
+                hashed,
+                await hashing.averify_password("secret", hashed),
+                await hashing.averify_password("wrong", hashed),
+                many,
+            )
+
+        (hashed, good, bad, many) = asyncio.run(in_the_pool())
+        assert "m=1024,t=1,p=1" in hashed
+        assert good and not bad
+        assert [hashing.verify_password(x, y) for x, y in zip("abc", many)] == [True] * 3
+
+        # When too many hashes are pending, we refuse new ones
+        hashing.hasher.pending = hashing.hasher.max_pending
+        with pytest.raises(utils.HashingBusy):
+            asyncio.run(hashing.ahash_password("secret"))
+        hashing.hasher.pending = 0
+    finally:
+        hashing.configure()
+
+
+def test_provenance():
+    provenance = utils.provenance
+    maker = sa.orm.sessionmaker(
+        bind=sa.create_engine("sqlite://"), class_=provenance.TracedSession
+    )
+
+    def make_session():
+        return maker()
+
+    token = provenance.route.set("GET /somewhere")
+    try:
+        session = make_session()
+        assert session.info["route"] == "GET /somewhere"
+        assert session.info["caller"] == "test_provenance.<locals>.make_session"
+        assert session.info["file"].endswith("utils/test_basic.py:" + str(
+            make_session.__code__.co_firstlineno
+        ))
+
+        # The sessions holding a connection are counted
+        session.execute(sa.text("select 1"))
+        assert provenance.open_sessions() == {provenance.describe(session): 1}
+        session.close()
+        assert provenance.open_sessions() == {}
+
+        provenance.set_sample_rate(0)
+        session = make_session()
+        assert session.info["route"] == "GET /somewhere"
+        assert session.info["caller"] == "(not sampled)"
+        session.close()
+    finally:
+        provenance.set_sample_rate(1)
+        provenance.route.reset(token)
+
+
+def test_pool(tmp_path):
+    pool = {"size": 3, "max_overflow": 1, "recycle": 60, "pre_ping": True, "warm_up": 2}
+    assert utils.pool.engine_args(pool) == {
+        "pool_size": 3,
+        "max_overflow": 1,
+        "pool_recycle": 60,
+        "pool_pre_ping": True,
+    }
+    assert utils.pool.engine_args(None) == {}
+    with pytest.raises(Exception):
+        utils.pool.engine_args({"sise": 3})
+
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/pool.db", **utils.pool.engine_args(pool))
+    assert utils.pool.stats(engine)["checked_in"] == 0
+    utils.pool.warm_up("test", engine, pool)
+    assert utils.pool.stats(engine) == {
+        "class": "QueuePool",
+        "size": 3,
+        "checked_in": 2,
+        "checked_out": 0,
+        "overflow": -1,
+    }
+    with engine.connect():
+        assert utils.pool.stats(engine)["checked_out"] == 1
+
+    # A database which is not there does not stop the API
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/not/there.db")
+    utils.pool.warm_up("test", engine, pool)
+    engine.dispose()
+
+
+def test_merge_join():
+    async def stream(items):
+        for item in items:
+            yield item
+
+    async def join(left, right):
+        return [
+            row
+            async for row in utils.merge.amerge_join(
+                left, right, lambda x: x[0], lambda y: y.upper()
+            )
+        ]
+
+    left = [("A", 1), ("C", 3), ("D", 4)]
+    right = ["a", "b", "d", "e"]
+    assert asyncio.run(join(left, stream(right))) == [
+        ("A", ("A", 1), "a"),
+        ("B", None, "b"),
+        ("C", ("C", 3), None),
+        ("D", ("D", 4), "d"),
+        ("E", None, "e"),
+    ]
+    assert asyncio.run(join([], right)) == [(y.upper(), None, y) for y in right]
+    assert asyncio.run(join(left, [])) == [(x[0], x, None) for x in left]
+    assert asyncio.run(join([], [])) == []
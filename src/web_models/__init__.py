@@ -1,25 +1,39 @@
 from .admin import Allowed, CreateUser, UpdateUser, Domain, Feature, Token, User
-from .alias import Alias, CreateAlias
+from .alias import Alias, BulkAliasResult, CreateAlias
 from .mailbox import (
+    BatchMailbox,
+    BatchMailboxResult,
+    BatchStatus,
     CreateMailbox,
     Mailbox,
+    MailboxField,
     MailboxStatus,
     MailboxType,
     NewMailbox,
     UpdateMailbox,
 )
+from .system import Context, Drift, DriftKind, DriftReport
 
 __all__ = [
     Allowed,
+    Context,
     CreateAlias,
     CreateUser,
     Domain,
+    Drift,
+    DriftKind,
+    DriftReport,
     Feature,
     Token,
     User,
     Alias,
+    BatchMailbox,
+    BatchMailboxResult,
+    BatchStatus,
+    BulkAliasResult,
     CreateMailbox,
     Mailbox,
+    MailboxField,
     MailboxStatus,
     MailboxType,
     NewMailbox,
@@ -1,6 +1,9 @@
+import csv
+
 import pydantic
 
 from .. import sql_postfix, utils
+from .mailbox import BatchStatus
 
 
 class Alias(pydantic.BaseModel):
@@ -25,3 +28,16 @@ class Alias(pydantic.BaseModel):
 class CreateAlias(pydantic.BaseModel):
     user_name: str
     destination: str
+
+    @classmethod
+    def list_from_csv(cls, text: str) -> list["CreateAlias"]:
+        """Reads the aliases from a csv text, with a 'user_name,destination'
+        header (as written by the export)."""
+        return [cls.model_validate(line) for line in csv.DictReader(text.splitlines())]
+
+
+class BulkAliasResult(pydantic.BaseModel):
+    user_name: str
+    destination: str
+    status: BatchStatus
+    detail: str | None = None
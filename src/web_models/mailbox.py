@@ -1,6 +1,8 @@
 import enum
+import typing
 
 import pydantic
+from .. import sql_api
 from .. import sql_dovecot
 from .. import oxcli
 
@@ -16,6 +18,17 @@ class MailboxStatus(enum.StrEnum):
     Unknown = "unknown"
 
 
+class MailboxField(enum.StrEnum):
+    """The fields of a Mailbox a client can ask for (`fields`)."""
+    Type = "type"
+    Status = "status"
+    Email = "email"
+    GivenName = "givenName"
+    SurName = "surName"
+    DisplayName = "displayName"
+    Active = "active"
+
+
 class Mailbox(pydantic.BaseModel):
     type: MailboxType
     status: MailboxStatus
@@ -23,6 +36,32 @@ class Mailbox(pydantic.BaseModel):
     givenName: str | None = None
     surName: str | None = None
     displayName: str | None = None
+    # Only sent when asked for, in `fields`
+    active: bool | None = None
+
+    # The fields sent when the client does not choose
+    DEFAULT_FIELDS: typing.ClassVar[list[MailboxField]] = [
+        MailboxField.Type,
+        MailboxField.Status,
+        MailboxField.Email,
+        MailboxField.GivenName,
+        MailboxField.SurName,
+        MailboxField.DisplayName,
+    ]
+    # The fields which need OX (the status needs both OX and dovecot)
+    OX_FIELDS: typing.ClassVar[set[MailboxField]] = {
+        MailboxField.Status,
+        MailboxField.GivenName,
+        MailboxField.SurName,
+        MailboxField.DisplayName,
+    }
+    # The fields in the mailbox_state table (sql_api.DBMailboxState)
+    STATE_FIELDS: typing.ClassVar[set[MailboxField]] = {
+        MailboxField.Type,
+        MailboxField.Status,
+        MailboxField.Email,
+        MailboxField.Active,
+    }
 
     # username: str | None = None
     # domain: str | None = None
@@ -55,6 +94,8 @@ class Mailbox(pydantic.BaseModel):
             self.givenName = in_ox_user.givenName
             self.surName = in_ox_user.surName
             self.displayName = in_ox_user.displayName
+        if in_db_user:
+            self.active = in_db_user.active == "Y"
 
         if webmail and in_db_user and in_ox_user:
             self.status = MailboxStatus.OK
@@ -62,6 +103,51 @@ class Mailbox(pydantic.BaseModel):
             self.status = MailboxStatus.OK
         return self
 
+    @classmethod
+    def from_partial_users(
+            cls,
+            in_ox_user: oxcli.OxUser | None,
+            in_db_user: sql_dovecot.ImapUser | None,
+            email: str,
+    ):
+        """When OX or dovecot did not answer (or was not asked): we show what
+        the other one knows, and we can not tell if the mailbox is fine."""
+        self = cls(
+            type=MailboxType.Mailbox,
+            status=MailboxStatus.Unknown,
+            email=email,
+        )
+        if in_ox_user:
+            self.givenName = in_ox_user.givenName
+            self.surName = in_ox_user.surName
+            self.displayName = in_ox_user.displayName
+        if in_db_user:
+            self.active = in_db_user.active == "Y"
+        return self
+
+    @classmethod
+    def from_state(
+            cls,
+            state: sql_api.DBMailboxState,
+            in_ox_user: oxcli.OxUser | None = None,
+    ):
+        """From the status stored by the last reconciliation, with the names
+        from OX when they are asked for."""
+        self = cls(
+            type=MailboxType.Mailbox,
+            status=MailboxStatus(state.status),
+            email=state.email,
+            active=state.active,
+        )
+        if in_ox_user:
+            self.givenName = in_ox_user.givenName
+            self.surName = in_ox_user.surName
+            self.displayName = in_ox_user.displayName
+        return self
+
+    def dump(self, fields: list[MailboxField]) -> dict:
+        return self.model_dump(mode="json", include=set(fields))
+
     def __eq__(self, other):
         return isinstance(self, Mailbox) and self.email == other.email
 
@@ -81,6 +167,23 @@ class NewMailbox(pydantic.BaseModel):
     uuid: pydantic.UUID4
 
 
+class BatchMailbox(CreateMailbox):
+    user_name: str
+
+
+class BatchStatus(enum.StrEnum):
+    Created = "created"
+    Conflict = "conflict"
+    Failed = "failed"
+
+
+class BatchMailboxResult(pydantic.BaseModel):
+    user_name: str
+    status: BatchStatus
+    detail: str | None = None
+    mailbox: NewMailbox | None = None
+
+
 class UpdateMailbox(pydantic.BaseModel):
     domain: str | None = None
     user_name: str | None = None
@@ -0,0 +1,48 @@
+import datetime
+import enum
+
+import pydantic
+
+from .. import oxcli
+
+
+class Context(pydantic.BaseModel):
+    cid: int
+    name: str
+    domains: list[str]
+
+    @classmethod
+    def from_ox(cls, ctx: oxcli.OxContext):
+        return cls(
+            cid=ctx.cid,
+            name=ctx.name,
+            domains=sorted(ctx.domains),
+        )
+
+
+class DriftKind(enum.StrEnum):
+    # In OX, without a mailbox in dovecot
+    OxOnly = "ox_only"
+    # In dovecot, without a user in OX, on a domain with the webmail
+    DovecotOnly = "dovecot_only"
+    # In both, but the OX username is not the dovecot one
+    NameMismatch = "name_mismatch"
+
+
+class Drift(pydantic.BaseModel):
+    kind: DriftKind
+    domain: str
+    email: str
+    context: str | None = None
+    ox_username: str | None = None
+    imap_username: str | None = None
+
+
+class DriftReport(pydantic.BaseModel):
+    started_at: datetime.datetime
+    finished_at: datetime.datetime
+    contexts: int
+    ox_users: int
+    imap_users: int
+    # The count of drifts by kind, for the domains which have some
+    domains: dict[str, dict[DriftKind, int]]